@@ -0,0 +1,201 @@
+
+# Description:
+#   Audit of every camera at once for outages and anomalies, rather than running commands
+#   6 and 7 camera by camera. load() pulls one camera type's camera x day (or camera x
+#   month) matrix of violations from the camera rollups (see rollups.py) with a single
+#   query, and the checks below run on the whole matrix with NumPy:
+#     - stopped:  cameras whose last violation is well before the end of the data
+#     - zero run: consecutive periods without violations inside a camera's active span
+#                 (periods with no data for any camera are skipped, so a gap in the data
+#                 isn't taken for an outage)
+#     - spike:    periods far above the camera's average over the periods just before
+#   Each finding gets an impact, roughly the number of violations missed (or extra), and
+#   audit() ranks all of them by it.
+#
+#   python anomalies.py [--db FILE] [--first-year 2014] [--last-year 2024] [--grain day|month] [--top 25]
+
+import datetime
+
+import numpy as np
+
+import queries
+
+# Per grain: shortest zero run reported, periods of silence before a camera counts as
+# stopped, and the number of periods before each one its spike baseline is taken over
+SETTINGS = {
+    "day": {"zero_run": 7, "stopped": 30, "window": 28},
+    "month": {"zero_run": 2, "stopped": 2, "window": 6},
+}
+
+# A spike is at least SPIKE_RATIO times the baseline and SPIKE_SCORE standard deviations
+# above it (the deviation is at least the square root of the baseline, as for counts)
+SPIKE_RATIO = 3.0
+SPIKE_SCORE = 5.0
+
+##################################################################
+# CameraMatrix
+# Violations of one camera type per camera and period: counts has a row per camera in
+# camera_ids (ID order) and a column per day or month from the start of first_year to
+# the end of last_year. Only cameras with rollup rows in the range have a row.
+class CameraMatrix:
+    def __init__(self, kind, grain, first_year, last_year, camera_ids, counts):
+        self.kind = kind
+        self.grain = grain
+        self.first_year = first_year
+        self.last_year = last_year
+        self.camera_ids = camera_ids
+        self.counts = counts
+        for values in (camera_ids, counts):
+            values.flags.writeable = False
+
+    ##################################################################
+    # periods
+    # The day or month of every column as numpy datetime64 values.
+    def periods(self):
+        unit = "D" if self.grain == "day" else "M"
+        start = f"{self.first_year:04d}-01-01" if self.grain == "day" else f"{self.first_year:04d}-01"
+        end = f"{self.last_year + 1:04d}-01-01" if self.grain == "day" else f"{self.last_year + 1:04d}-01"
+        return np.arange(start, end, dtype=f"datetime64[{unit}]")
+
+##################################################################
+# load
+# Given connection to database, a camera type, a range of years and "day" or "month",
+# returns its CameraMatrix. The rollups should be up to date (see rollups.refresh).
+def load(dbConn, kind, first_year, last_year, grain="day"):
+    dbCursor = dbConn.cursor()
+    if grain == "day":
+        start = datetime.date(first_year, 1, 1)
+        end = datetime.date(last_year + 1, 1, 1)
+        dbCursor.execute(queries.CAMERA_DAYS_IN_RANGE, (start.isoformat(), kind, start.isoformat(), end.isoformat()))
+        size = (end - start).days
+    else:
+        dbCursor.execute(queries.CAMERA_MONTHS_IN_RANGE, (first_year, kind, f"{first_year:04d}", f"{last_year:04d}"))
+        size = (last_year - first_year + 1) * 12
+
+    rows = np.array(dbCursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+    camera_ids, cameras = np.unique(rows[:, 0], return_inverse=True)
+    counts = np.zeros((len(camera_ids), size), dtype=np.int64)
+    counts[cameras, rows[:, 1]] = rows[:, 2]  # One rollup row per camera and period
+    return CameraMatrix(kind, grain, first_year, last_year, camera_ids, counts)
+
+##################################################################
+# spans
+# Returns (first, last, any) for each camera: the first and last periods with violations
+# among the given columns, and whether there are any.
+def spans(counts):
+    reporting = counts > 0
+    found = reporting.any(axis=1)
+    first = reporting.argmax(axis=1)
+    last = counts.shape[1] - 1 - reporting[:, ::-1].argmax(axis=1)
+    return first, last, found
+
+##################################################################
+# finding
+# One row of the report.
+def finding(matrix, labels, row, anomaly, start, end, periods, violations, expected):
+    return {"type": matrix.kind, "camera_id": int(matrix.camera_ids[row]), "anomaly": anomaly,
+            "start": str(labels[start]), "end": str(labels[end]), "periods": int(periods),
+            "violations": int(violations), "expected": round(float(expected), 1),
+            "impact": round(abs(float(expected) * periods - violations), 1)}
+
+##################################################################
+# detect
+# Runs every check on a CameraMatrix. Returns the findings in no particular order.
+def detect(matrix):
+    settings = SETTINGS[matrix.grain]
+    labels = matrix.periods()
+    counts = matrix.counts
+    findings = []
+
+    # Only periods with data for some camera; index maps them back to matrix columns
+    index = np.flatnonzero(counts.sum(axis=0) > 0)
+    if not len(index):
+        return findings
+    counts = counts[:, index]
+    first, last, found = spans(counts)
+    periods = np.arange(counts.shape[1])
+    mean = np.where(found, counts.sum(axis=1) / (last - first + 1), 0.0)  # Per period over the active span
+
+    # Stopped: silent for the last periods of the data
+    silent = counts.shape[1] - 1 - last
+    for row in np.flatnonzero(found & (silent >= settings["stopped"])).tolist():
+        findings.append(finding(matrix, labels, row, "stopped", index[last[row] + 1], index[-1],
+                                index[-1] - index[last[row]], 0, mean[row]))
+
+    # Zero runs: edges of each run of zeros between the first and last active period
+    zero = (counts == 0) & (periods > first[:, None]) & (periods < last[:, None])
+    edges = np.diff(np.pad(zero, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    stops = np.nonzero(edges == -1)[1]  # Row-major like starts, so each run's start and stop line up
+    lengths = index[stops - 1] - index[starts] + 1
+    for row, start, stop, length in zip(rows.tolist(), starts.tolist(), stops.tolist(), lengths.tolist()):
+        if length >= settings["zero_run"]:
+            findings.append(finding(matrix, labels, row, "zero run", index[start], index[stop - 1], length, 0,
+                                    mean[row]))
+
+    # Spikes: against the mean and deviation of the window periods before, from running sums
+    window = settings["window"]
+    values = counts.astype(np.float64)
+    sums = np.pad(np.cumsum(values, axis=1), ((0, 0), (1, 0)))
+    squares = np.pad(np.cumsum(values * values, axis=1), ((0, 0), (1, 0)))
+    baseline = np.full(values.shape, np.nan)
+    deviation = np.full(values.shape, np.nan)
+    baseline[:, window:] = (sums[:, window:-1] - sums[:, :-window - 1]) / window
+    variance = (squares[:, window:-1] - squares[:, :-window - 1]) / window - baseline[:, window:] ** 2
+    deviation[:, window:] = np.maximum(np.sqrt(np.maximum(variance, 0)), np.sqrt(baseline[:, window:]))
+    with np.errstate(invalid="ignore"):
+        spike = ((periods - window >= first[:, None]) & (baseline > 0) & (values >= SPIKE_RATIO * baseline)
+                 & (values - baseline >= SPIKE_SCORE * deviation))
+    for row, column in zip(*np.nonzero(spike)):
+        findings.append(finding(matrix, labels, row, "spike", index[column], index[column], 1,
+                                counts[row, column], baseline[row, column]))
+    return findings
+
+##################################################################
+# audit
+# Runs detect() on the matrices of every camera type and returns all findings ranked by
+# impact (largest first).
+def audit(matrices):
+    findings = [row for matrix in matrices for row in detect(matrix)]
+    findings.sort(key=lambda row: (-row["impact"], row["type"], row["camera_id"], row["start"]))
+    return findings
+
+##################################################################
+# report
+# Formats ranked findings (with addresses, see api.camera_anomalies) as report lines.
+def report(findings):
+    lines = [f"  {'#':>4}  {'Type':<6}{'Camera':>7}  {'Anomaly':<9}{'From':<12}{'To':<12}{'Periods':>8}"
+             f"{'Count':>9}{'Expected':>10}{'Impact':>11}  Address"]
+    for rank, row in enumerate(findings, 1):
+        lines.append(f"  {rank:>4}  {row['type']:<6}{row['camera_id']:>7}  {row['anomaly']:<9}{row['start']:<12}"
+                     f"{row['end']:<12}{row['periods']:>8,}{row['violations']:>9,}{row['expected']:>10,.1f}"
+                     f"{row['impact']:>11,.0f}  {row.get('address') or ''}")
+    return lines
+
+# main
+if __name__ == "__main__":
+    import argparse  # Only the command line needs these
+    import time
+
+    import api
+
+    parser = argparse.ArgumentParser(description="Rank every camera's outages, zero runs and spikes.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--first-year", default="2014")
+    parser.add_argument("--last-year", default=str(datetime.date.today().year))
+    parser.add_argument("--grain", choices=list(SETTINGS), default="day")
+    parser.add_argument("--top", type=int, default=25, help="findings to print (default: %(default)s)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    dbConn = api.open_database(args.db)
+    try:
+        findings = api.camera_anomalies(dbConn, args.first_year, args.last_year, args.grain)
+    except api.QueryError as error:
+        parser.exit(1, f"{error}\n")
+    elapsed = time.perf_counter() - start
+
+    counts = {anomaly: sum(row["anomaly"] == anomaly for row in findings) for anomaly in ("stopped", "zero run", "spike")}
+    print(f"Camera audit {args.first_year}-{args.last_year} by {args.grain}: "
+          f"{', '.join(f'{count:,} {anomaly}' for anomaly, count in counts.items())} in {elapsed:.2f} s")
+    print("\n".join(report(findings[:args.top])))
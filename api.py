@@ -0,0 +1,449 @@
+
+# Description:
+#   Query functions behind each menu command. Every function takes a database connection
+#   and the command's arguments and returns its results as a list of rows (dictionaries),
+#   without printing, prompting or plotting, so the same lookups can be run from the menu
+#   in main.py, the command line (cli.py) or any other script. Input the command can't
+#   answer raises QueryError with the message to show the user. Results are cached per
+#   database and arguments (see cache.py) until the data changes. Commands that query the
+#   red light and speed tables run the two halves in parallel (see parallel.py).
+#
+#   The long listings (commands 1, 4, 5 and 9) also have iter_ versions that return the
+#   rows of one page (limit and offset, pushed into the SQL) as they are fetched, a chunk
+#   at a time, so the menu and the command line can print them without holding them all.
+#
+#   NumPy and the modules built on it (anomalies.py, columnar.py, timeseries.py) are
+#   imported by the functions that need them rather than here, so the menu comes up
+#   without loading them.
+
+import collections
+import datetime
+import sqlite3
+
+import cache
+import cancel
+import compact
+import indexes
+import instrument
+import parallel
+import queries
+import registry
+import rollups
+import search
+import shards
+import spatial
+
+DATABASE = "chicago-traffic-cameras.db"
+FETCH_SIZE = 500  # Rows fetched at a time by the iter_ functions
+
+# Camera types in the order the menu lists them
+KINDS = ("red", "speed")
+
+# Formats normalize_date tries in turn (%m and %d also take one digit, %Y only four)
+DATE_FORMATS = ("%Y-%m-%d", "%m/%d/%Y", "%m/%d/%y")
+
+class QueryError(Exception):
+    pass
+
+##################################################################
+# open_database
+# Opens the database and makes sure the indexes and rollup tables the queries use are in
+# place. Returns the connection.
+def open_database(path=DATABASE):
+    dbConn = sqlite3.connect(path, factory=instrument.connection_factory()) # Timed if instrument.py is on
+    cancel.watch(dbConn, handler=not instrument.ENABLED) # Ctrl-C and the time budget stop its queries
+    indexes.ensure_indexes(dbConn) # Creates any missing date/camera indexes
+    rollups.refresh(dbConn) # Builds or updates the violation summary tables
+    search.ensure(dbConn) # Builds the name/address search index the first time
+    spatial.ensure(dbConn) # Builds the camera location index the first time
+    return dbConn
+
+##################################################################
+# concatenate
+# Joins the per-camera-type row lists returned by parallel.map_kinds into one list.
+def concatenate(results):
+    return [row for rows in results for row in rows]
+
+##################################################################
+# stream
+# Yields the rows of an executed cursor, fetching FETCH_SIZE at a time.
+def stream(dbCursor, size=FETCH_SIZE):
+    while True:
+        rows = dbCursor.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+##################################################################
+# page
+# Returns the LIMIT clause and its parameters for limit rows (all of them if None)
+# starting offset rows in.
+def page(limit=None, offset=0):
+    try:
+        limit = -1 if limit is None else int(limit)
+        offset = int(offset or 0)
+    except ValueError:
+        raise QueryError("The limit and offset must be whole numbers.")
+    if limit < -1 or offset < 0:
+        raise QueryError("The limit and offset can't be negative.")
+    return " LIMIT ? OFFSET ?", (limit, offset)
+
+##################################################################
+# valid_date
+# Checks a date string is in one of the accepted formats (YYYY-MM-DD, MM/DD/YYYY, M/D/YYYY, YYYY-M-D, MM/DD/YY).
+def valid_date(date):
+    return ((len(date) == 10 and date[4] == '-' and date[7] == '-') or (len(date) == 10 and date[2] == '/' and date[5] == '/')
+            or (len(date) == 8 and date[1] == '/' and date[3] == '/') or (len(date) == 8 and date[4] == '-' and date[6] == '-')
+            or (len(date) == 8 and date[2] == '/' and date[5] == '/'))
+
+##################################################################
+# normalize_date
+# Converts a date in any of the valid_date formats to YYYY-MM-DD, the form the database
+# stores, or returns None if it isn't a real date.
+def normalize_date(date):
+    date = str(date).strip()
+    if not valid_date(date):
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date, date_format).date().isoformat()
+        except ValueError:
+            continue
+    return None
+
+##################################################################
+# camera_type
+# Returns "red" or "speed" for the table a camera ID is found in, or None if it isn't found.
+def camera_type(dbConn, camera_id):
+    camera = registry.get(dbConn).find(camera_id)
+    return camera.kind if camera else None
+
+##################################################################
+# Command 1
+# Intersections whose name matches a pattern (wildcards _ and % allowed).
+@cache.cached(ignore_case=True)
+def find_intersections(dbConn, pattern):
+    return list(iter_intersections(dbConn, pattern))
+
+def iter_intersections(dbConn, pattern, limit=None, offset=0):
+    clause, parameters = page(limit, offset)
+    source, column = search.like_source(dbConn, "Intersections")
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(f"""SELECT Intersections.Intersection_ID, Intersections.Intersection
+                    FROM {source} WHERE {column} LIKE ?
+                    ORDER BY Intersections.Intersection ASC""" + clause, (pattern,) + parameters)
+    return ({"intersection_id": row[0], "intersection": row[1]} for row in stream(dbCursor))
+
+##################################################################
+# Command 2
+# Red light and speed cameras at an intersection.
+@cache.cached(ignore_case=True)
+def cameras_at_intersection(dbConn, intersection):
+    source, column = search.like_source(dbConn, "Intersections")
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(f"SELECT Intersections.Intersection_ID FROM {source} WHERE {column} LIKE ?", (intersection,))
+    at_intersection = registry.get(dbConn).at_intersection # Cameras by intersection, no join needed
+    cameras = sorted((camera for row in dbCursor.fetchall() for camera in at_intersection.get(row[0], [])),
+                     key=lambda camera: camera.camera_id)
+    return [{"type": camera.kind, "camera_id": camera.camera_id, "address": camera.address}
+            for kind in KINDS for camera in cameras if camera.kind == kind]
+
+##################################################################
+# Command 3
+# Red light and speed violations on a date, with each type's share of the total. Returns
+# no rows if the date is outside the range of dates in the database. The date may be in
+# any format valid_date accepts.
+@cache.cached
+def violations_on_date(dbConn, date):
+    date = normalize_date(date) # Compared with the stored YYYY-MM-DD dates, whatever format it was typed in
+    if date is None:
+        raise QueryError("Invalid date format. Please enter the date in YYYY-MM-DD format.")
+
+    # Gets min/max dates from database (and its year shards)
+    min_date, max_date = shards.date_range(dbConn, "SpeedViolations")
+    if not min_date:
+        raise QueryError("No violation records exist in the database.")
+    if not (min_date <= date <= max_date):
+        return []
+
+    def kind_count(dbConn, kind):
+        violations = queries.TABLES[kind][0]
+        days = compact.compact_table(dbConn, violations) # By day number if migrated (see compact.py)
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(compact.DATE_TOTAL.format(days=days) if days else
+                         f"SELECT SUM(Num_Violations) FROM {violations} WHERE Violation_Date = ?", (date,))
+        count = dbCursor.fetchone()[0] or 0  # Convert None to 0
+        if date[:4] in sharded:  # Only the shard of the date's year
+            shardCursor = parallel.read_only_connection(sharded[date[:4]]).cursor()
+            shardCursor.execute(f"SELECT SUM(Num_Violations) FROM {violations} WHERE Violation_Date = ?", (date,))
+            count += shardCursor.fetchone()[0] or 0
+        return count
+
+    sharded = shards.of_connection(dbConn)
+
+    counts = dict(zip(KINDS, parallel.map_kinds(dbConn, kind_count, KINDS)))
+
+    total = sum(counts.values())
+    return [{"type": kind, "violations": counts[kind],
+             "percentage": (counts[kind] / total * 100) if total else None} for kind in KINDS]
+
+##################################################################
+# Command 4
+# Number of red light and speed cameras at each intersection, with the share of all
+# cameras of that type.
+@cache.cached
+def cameras_per_intersection(dbConn):
+    return concatenate(list(iter_cameras_per_intersection(dbConn, kind)) for kind in KINDS)
+
+def iter_cameras_per_intersection(dbConn, kind, limit=None, offset=0):
+    clause, (limit, offset) = page(limit, offset)
+    cameras = registry.get(dbConn)
+    total = len(cameras.of_kind(kind))
+
+    # Counted from the registry; intersections missing from Intersections are left out like the join did
+    counts = collections.Counter(camera.intersection_id for camera in cameras.of_kind(kind)
+                                 if camera.intersection_id in cameras.intersections)
+    rows = sorted(counts.items(), key=lambda item: (item[1], item[0]), reverse=True)
+    rows = rows[offset:None if limit < 0 else offset + limit]
+    return ({"type": kind, "intersection_id": intersection_id, "intersection": cameras.intersections[intersection_id],
+             "cameras": count, "percentage": count / total * 100} for intersection_id, count in rows)
+
+##################################################################
+# Command 5
+# Red light and speed violations at each intersection in a year, with each intersection's
+# share of that year's total.
+@cache.cached
+def violations_by_intersection(dbConn, year):
+    rollups.refresh(dbConn) # Here, since the read-only connections of map_kinds can't write the rollups
+    return concatenate(parallel.map_kinds(dbConn, lambda dbConn, kind: list(year_by_intersection(dbConn, kind, year)[1]),
+                                          KINDS))
+
+##################################################################
+# year_by_intersection
+# One camera type's ("red" or "speed") violations at each intersection in a year, and
+# the year's total they are a share of. Returns (total, rows) with the rows streamed as
+# they are read; the total is None if there are no violations that year.
+def year_by_intersection(dbConn, kind, year, limit=None, offset=0):
+    import columnar
+
+    clause, parameters = page(limit, offset)
+    year = str(year).strip()
+    store = columnar.current(dbConn)
+    if store is not None:
+        total, rows = columnar.year_by_intersection(store, kind, year)
+        end = None if parameters[0] < 0 else parameters[1] + parameters[0]
+        rows = rows[parameters[1]:end]
+    else:
+        rollups.refresh(dbConn) # Picks up any violations added since the last refresh
+        dbCursor = dbConn.cursor()
+        dbCursor.execute(queries.YEAR_TOTAL, (kind, year))
+        total = dbCursor.fetchone()[0]
+        dbCursor.execute(queries.YEAR_BY_INTERSECTION + clause, (kind, year) + parameters)
+        rows = stream(dbCursor)
+    return total, ({"type": kind, "intersection_id": row[0], "intersection": row[1], "violations": row[2],
+                    "percentage": row[2] / total * 100} for row in rows)
+
+def iter_violations_by_intersection(dbConn, kind, year, limit=None, offset=0):
+    return year_by_intersection(dbConn, kind, year, limit, offset)[1]
+
+##################################################################
+# Command 6
+# Violations per year for a camera.
+@cache.cached
+def violations_by_year(dbConn, camera_id):
+    camera = registry.get(dbConn).find(camera_id)
+    if camera is None:
+        raise QueryError("No cameras matching that ID were found in the database.")
+
+    rollups.refresh(dbConn) # Picks up any violations added since the last refresh
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.CAMERA_BY_YEAR, (camera.kind, camera.camera_id)) # Only the camera's own type
+    return [{"year": row[0], "violations": row[1]} for row in dbCursor.fetchall()]
+
+##################################################################
+# Command 7
+# Violations per month for a camera in a year.
+@cache.cached
+def violations_by_month(dbConn, camera_id, year):
+    camera = registry.get(dbConn).find(camera_id)
+    if camera is None:
+        raise QueryError("No cameras matching that ID were found in the database.")
+
+    rollups.refresh(dbConn) # Picks up any violations added since the last refresh
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.CAMERA_BY_MONTH, (camera.kind, camera.camera_id, str(year).strip())) # Only the camera's own type
+    return [{"month": row[0], "violations": row[1]} for row in dbCursor.fetchall()]
+
+##################################################################
+# year_range
+# Checks a range of years given as text (just first_year if last_year is None). Returns
+# them as integers. Years run from 0001 to 9998, since the range ends on 1 January of the
+# year after last_year and Python dates stop at 9999.
+def year_range(first_year, last_year=None):
+    years = [str(year).strip() for year in (first_year, first_year if last_year is None else last_year)]
+    if not all(year.isdigit() and len(year) == 4 for year in years):
+        raise QueryError("Invalid year. Please enter the year in YYYY format.")
+    first_year, last_year = int(years[0]), int(years[1])
+    if not (1 <= first_year and last_year <= 9998):
+        raise QueryError("Invalid year. Please enter a year from 0001 to 9998.")
+    if first_year > last_year:
+        raise QueryError("The first year can't be after the last year.")
+    return first_year, last_year
+
+##################################################################
+# Command 8 and the multi-year comparison
+# Red light and speed violations on every day from the start of first_year to the end of
+# last_year (just first_year if last_year isn't given) as a timeseries.DailySeries.
+@cache.cached
+def daily_series(dbConn, first_year, last_year=None):
+    import columnar
+    import timeseries
+
+    first_year, last_year = year_range(first_year, last_year)
+
+    store = columnar.current(dbConn)
+    if store is not None:
+        return timeseries.DailySeries(first_year, last_year, {kind: columnar.daily_counts(store, kind, first_year, last_year)
+                                                              for kind in KINDS})
+
+    rollups.refresh(dbConn) # Picks up any violations added since the last refresh
+    counts = parallel.map_kinds(dbConn, lambda dbConn, kind: timeseries.load_counts(dbConn, kind, first_year, last_year),
+                                KINDS)
+    return timeseries.DailySeries(first_year, last_year, dict(zip(KINDS, counts)))
+
+##################################################################
+# Command 8
+# Red light and speed violations on every day of a year, 0 on days with none.
+@cache.cached
+def daily_violations(dbConn, year):
+    import numpy as np
+
+    series = daily_series(dbConn, year)
+    dates = np.datetime_as_string(series.dates).tolist()
+    return [{"date": date, "red": red, "speed": speed}
+            for date, red, speed in zip(dates, series.counts["red"].tolist(), series.counts["speed"].tolist())]
+
+##################################################################
+# Multi-year comparison
+# Violation totals for each year from first_year to last_year, with the percent change
+# from the year before and the number of red light violations per speed violation
+# (None where they can't be computed).
+def compare_years(dbConn, first_year, last_year):
+    import numpy as np
+    import timeseries
+
+    series = daily_series(dbConn, first_year, last_year)
+    years, totals = timeseries.yearly_totals(series)
+    red_difference, red_change = timeseries.year_over_year(totals["red"])
+    speed_difference, speed_change = timeseries.year_over_year(totals["speed"])
+    ratios = timeseries.ratio(totals["red"], totals["speed"])
+
+    def values(array):
+        return [None if np.isnan(value) else value for value in array.tolist()]
+
+    return [{"year": year, "red": red, "speed": speed, "red_change_pct": red_pct,
+             "speed_change_pct": speed_pct, "red_per_speed": ratio}
+            for year, red, speed, red_pct, speed_pct, ratio
+            in zip(years.tolist(), totals["red"].tolist(), totals["speed"].tolist(),
+                   values(red_change), values(speed_change), values(ratios))]
+
+##################################################################
+# Camera audit
+# Every camera's outages (stopped cameras and runs of days or months without violations)
+# and spikes from first_year to last_year, ranked by the number of violations affected,
+# with each camera's address. grain is "day" or "month". See anomalies.py.
+@cache.cached
+def camera_anomalies(dbConn, first_year, last_year, grain="day"):
+    import anomalies
+    import columnar
+
+    first_year, last_year = year_range(first_year, last_year)
+    grain = str(grain).strip().lower()
+    if grain not in anomalies.SETTINGS:
+        raise QueryError("Invalid grain. Please enter day or month.")
+
+    store = columnar.current(dbConn) if grain == "day" else None
+    if store is not None:
+        matrices = [anomalies.CameraMatrix(kind, grain, first_year, last_year,
+                                           *columnar.camera_days(store, kind, first_year, last_year)) for kind in KINDS]
+    else:
+        rollups.refresh(dbConn) # Picks up any violations added since the last refresh
+        matrices = parallel.map_kinds(dbConn, lambda dbConn, kind: anomalies.load(dbConn, kind, first_year, last_year, grain),
+                                      KINDS)
+    cameras = registry.get(dbConn)
+    addresses = {(camera.kind, camera.camera_id): camera.address for camera in cameras.all}
+    return [{**row, "address": addresses.get((row["type"], row["camera_id"]))} for row in anomalies.audit(matrices)]
+
+##################################################################
+# Command 9
+# Red light and speed cameras whose address contains a street name.
+@cache.cached(ignore_case=True)
+def cameras_on_street(dbConn, street_name):
+    return concatenate(parallel.map_kinds(dbConn, lambda dbConn, kind: list(iter_cameras_on_street(dbConn, kind, street_name)),
+                                          KINDS))
+
+def iter_cameras_on_street(dbConn, kind, street_name, limit=None, offset=0):
+    clause, parameters = page(limit, offset)
+    cameras = queries.TABLES[kind][1]
+    source, column = search.like_source(dbConn, cameras)
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(f"""
+        SELECT {cameras}.Camera_ID, {cameras}.Address, {cameras}.Latitude, {cameras}.Longitude
+        FROM {source}
+        WHERE {column} LIKE ?
+        ORDER BY {cameras}.Camera_ID ASC""" + clause, (f"%{street_name}%",) + parameters)  # Uses wildcards
+    return ({"type": kind, "camera_id": row[0], "address": row[1], "latitude": row[2], "longitude": row[3]}
+            for row in stream(dbCursor))
+
+##################################################################
+# Search
+# Intersections and camera addresses containing some text (at least 3 characters), best
+# match first.
+@cache.cached(ignore_case=True)
+def search_locations(dbConn, text):
+    if len(text.strip()) < 3:
+        raise QueryError("Search text must be at least 3 characters long.")
+    if not search.is_built(dbConn):
+        raise QueryError("The search index hasn't been built for this database.")
+    return search.ranked(dbConn, text.strip())
+
+##################################################################
+# coordinates
+# Converts location arguments to floats, raising QueryError for anything that isn't a number.
+def coordinates(*values):
+    try:
+        return [float(value) for value in values]
+    except ValueError:
+        raise QueryError("Latitude, longitude and distances must be numbers.")
+
+##################################################################
+# Command 10
+# Cameras within some distance (meters) of a point, nearest first, with their all-time
+# violation totals.
+@cache.cached
+def cameras_near(dbConn, latitude, longitude, meters):
+    latitude, longitude, meters = coordinates(latitude, longitude, meters)
+    if not spatial.is_built(dbConn):
+        raise QueryError("The camera location index hasn't been built for this database.")
+    rollups.refresh(dbConn) # Picks up any violations added since the last refresh
+    return spatial.add_violation_totals(dbConn, spatial.within(dbConn, latitude, longitude, meters))
+
+# The count cameras nearest to a point, nearest first, with their all-time violation totals.
+@cache.cached
+def nearest_cameras(dbConn, latitude, longitude, count):
+    latitude, longitude = coordinates(latitude, longitude)
+    if not str(count).strip().isdigit():
+        raise QueryError("The number of cameras must be a whole number.")
+    if not spatial.is_built(dbConn):
+        raise QueryError("The camera location index hasn't been built for this database.")
+    rollups.refresh(dbConn)
+    return spatial.add_violation_totals(dbConn, spatial.nearest(dbConn, latitude, longitude, int(count)))
+
+# Cameras inside a bounding box, with their all-time violation totals.
+@cache.cached
+def cameras_in_box(dbConn, min_latitude, min_longitude, max_latitude, max_longitude):
+    box = coordinates(min_latitude, min_longitude, max_latitude, max_longitude)
+    if not spatial.is_built(dbConn):
+        raise QueryError("The camera location index hasn't been built for this database.")
+    rollups.refresh(dbConn)
+    return spatial.add_violation_totals(dbConn, spatial.in_box(dbConn, *box))
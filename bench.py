@@ -0,0 +1,256 @@
+
+# Description:
+#   Benchmark suite for the menu: runs print_stats and command1-command9 from main.py
+#   against a database with scripted answers to their prompts (no plots), and records
+#   for each one the wall time over several runs, the rows SQLite returned and the peak
+#   Python memory. The query cache is turned off so every run goes to SQLite. Results
+#   are saved as JSON, and --compare prints the change from an earlier results file.
+#
+#   python bench.py [--db FILE] [--runs 5] [--out results.json] [--compare old.json]
+#
+#   Typical use with generate_db.py:
+#       python generate_db.py --out bench10.db --scale 10 --prepare
+#       python bench.py --db bench10.db --out before.json
+#       (make a change)
+#       python bench.py --db bench10.db --out after.json --compare before.json
+#
+#   --startup N instead starts the menu (python main.py) N times and reports how long
+#   it takes to get from launching the process to the first prompt (target: 100 ms).
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import api
+import cache
+import main
+import parallel
+
+##################################################################
+# CountingCursor / CountingConnection
+# A connection whose cursors count every row fetched from SQLite.
+class CountingCursor(sqlite3.Cursor):
+    rows = 0
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            CountingCursor.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = super().fetchmany(*args)
+        CountingCursor.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        CountingCursor.rows += len(rows)
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        CountingCursor.rows += 1
+        return row
+
+class CountingConnection(sqlite3.Connection):
+    def cursor(self, factory=CountingCursor):
+        return super().cursor(factory)
+
+##################################################################
+# sample_inputs
+# Picks answers for the commands' prompts from the database itself: a busy intersection,
+# the red light camera with the most violations, the first full year and a date in it.
+def sample_inputs(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("""
+        SELECT Intersection FROM Intersections
+        WHERE Intersection_ID IN (SELECT Intersection_ID FROM RedCameras)
+        ORDER BY Intersection_ID LIMIT 1""")
+    intersection = dbCursor.fetchone()[0]
+    dbCursor.execute("""
+        SELECT Camera_ID FROM RedViolations GROUP BY Camera_ID ORDER BY SUM(Num_Violations) DESC LIMIT 1""")
+    camera = str(dbCursor.fetchone()[0])
+    dbCursor.execute("SELECT MIN(Violation_Date) FROM RedViolations")
+    year = dbCursor.fetchone()[0][:4]
+    street = intersection.split(" AND ")[0].split()[-1]
+    return {"intersection": intersection, "camera": camera, "year": year,
+            "date": f"{year}-06-15", "street": street}
+
+##################################################################
+# cases
+# Returns [(name, function, answers to its prompts)] for the benchmarked commands.
+def cases(inputs):
+    return [
+        ("print_stats", lambda: main.print_stats(main.dbConn), []),
+        ("command1", main.command1, [f"%{inputs['street']}%"]),
+        ("command2", main.command2, [inputs["intersection"]]),
+        ("command3", main.command3, [inputs["date"]]),
+        ("command4", main.command4, []),
+        ("command5", main.command5, [inputs["year"]]),
+        ("command6", main.command6, [inputs["camera"], "n"]),
+        ("command7", main.command7, [inputs["camera"], inputs["year"], "n"]),
+        ("command8", main.command8, [inputs["year"], "n"]),
+        ("command9", main.command9, [inputs["street"], "n"]),
+    ]
+
+##################################################################
+# run_case
+# Runs a command once with its prompts answered from answers and its output discarded.
+def run_case(function, answers):
+    replies = iter(answers)
+    main.input = lambda prompt="": next(replies)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        function()
+
+##################################################################
+# measure
+# Times a command over runs runs, then runs it once more serially with tracemalloc on to
+# count rows read and find its peak memory (the red/speed halves run on the benchmark
+# connection for that run so all their rows are counted).
+def measure(function, answers, runs):
+    run_case(function, answers)  # Warm the page cache
+    times = []
+    for i in range(runs):
+        start = time.perf_counter()
+        run_case(function, answers)
+        times.append((time.perf_counter() - start) * 1000)
+
+    workers = parallel.WORKERS
+    parallel.WORKERS = 1
+    CountingCursor.rows = 0
+    tracemalloc.start()
+    try:
+        run_case(function, answers)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        parallel.WORKERS = workers
+
+    return {
+        "wall_ms": {"min": min(times), "median": statistics.median(times), "max": max(times)},
+        "rows_read": CountingCursor.rows,
+        "peak_memory_kb": peak / 1024,
+    }
+
+##################################################################
+# table_sizes
+# Returns the row counts of the five data tables.
+def table_sizes(dbConn):
+    dbCursor = dbConn.cursor()
+    sizes = {}
+    for table in ("Intersections", "RedCameras", "SpeedCameras", "RedViolations", "SpeedViolations"):
+        dbCursor.execute(f"SELECT COUNT(*) FROM {table}")
+        sizes[table] = dbCursor.fetchone()[0]
+    return sizes
+
+##################################################################
+# benchmark
+# Runs every case against the database at path and returns the results document.
+def benchmark(path, runs):
+    cache.RESULTS.maxsize = 0
+
+    start = time.perf_counter()
+    api.open_database(path).close()  # Builds indexes and summary tables if they're missing
+    open_ms = (time.perf_counter() - start) * 1000
+
+    main.dbConn = sqlite3.connect(path, factory=CountingConnection)
+    inputs = sample_inputs(main.dbConn)
+    results = {name: measure(function, answers, runs) for name, function, answers in cases(inputs)}
+
+    document = {
+        "database": os.path.abspath(path),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "tables": table_sizes(main.dbConn),
+        "inputs": inputs,
+        "runs": runs,
+        "open_database_ms": open_ms,
+        "results": results,
+    }
+    main.dbConn.close()
+    parallel.shutdown()
+    return document
+
+##################################################################
+# startup
+# Launches the menu runs times against the database at path and returns the times in
+# milliseconds from starting the process to the menu asking for input. The menu opens
+# chicago-traffic-cameras.db in its working folder, so it is run in a temporary folder
+# with a link to the database under that name. The first launch fills the stats cache
+# and isn't counted.
+STARTUP_TARGET_MS = 100
+
+def startup(path, runs):
+    api.open_database(path).close()
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+    times = []
+    with tempfile.TemporaryDirectory() as folder:
+        os.symlink(os.path.abspath(path), os.path.join(folder, api.DATABASE))
+        for i in range(runs + 1):
+            start = time.perf_counter()
+            menu = subprocess.Popen([sys.executable, script], cwd=folder, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, text=True)
+            for line in menu.stdout:
+                if line.startswith("or x to exit"):  # Last line of the menu, then it waits for input
+                    break
+            elapsed = (time.perf_counter() - start) * 1000
+            menu.communicate("x\n")
+            if i > 0:
+                times.append(elapsed)
+    return times
+
+##################################################################
+# report
+# Prints the results, with the change in median time from an earlier run if given.
+def report(document, baseline=None):
+    print(f"{document['database']}: " + ", ".join(f"{table} {rows:,}" for table, rows in document["tables"].items()))
+    print(f"{'command':<14}{'median ms':>12}{'min ms':>10}{'max ms':>10}{'rows read':>12}{'peak KB':>10}"
+          + (f"{'vs. base':>10}" if baseline else ""))
+    for name, result in document["results"].items():
+        wall = result["wall_ms"]
+        line = (f"{name:<14}{wall['median']:>12.2f}{wall['min']:>10.2f}{wall['max']:>10.2f}"
+                f"{result['rows_read']:>12,}{result['peak_memory_kb']:>10.0f}")
+        if baseline and name in baseline["results"]:
+            line += f"{wall['median'] / max(baseline['results'][name]['wall_ms']['median'], 1e-9):>9.2f}x"
+        print(line)
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark print_stats and menu commands 1-9.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="earlier results JSON to compare against")
+    parser.add_argument("--startup", type=int, metavar="N", help="time N menu launches to the first prompt instead")
+    args = parser.parse_args()
+
+    if args.startup:
+        times = startup(args.db, args.startup)
+        median = statistics.median(times)
+        print(f"Menu startup to first prompt over {len(times)} launches: median {median:.1f} ms, "
+              f"min {min(times):.1f} ms, max {max(times):.1f} ms "
+              f"({'within' if median < STARTUP_TARGET_MS else 'over'} the {STARTUP_TARGET_MS} ms target)")
+        sys.exit(0 if median < STARTUP_TARGET_MS else 1)
+
+    document = benchmark(args.db, args.runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    report(document, baseline)
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(document, file, indent=2)
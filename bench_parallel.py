@@ -0,0 +1,59 @@
+
+# Description:
+#   Benchmark for parallel.py: times each command that queries both the red light and
+#   speed tables with the two halves run one after the other and then in parallel, and
+#   prints the speedup. The query cache is turned off so every run goes to SQLite.
+#
+#   python bench_parallel.py [--db FILE] [--runs N] [--year YYYY]
+#   (the year defaults to the first year in the database)
+
+import argparse
+import time
+
+import api
+import cache
+import parallel
+
+##################################################################
+# time_runs
+# Runs a function the given number of times and returns the average time in milliseconds.
+def time_runs(function, runs):
+    start = time.perf_counter()
+    for i in range(runs):
+        function()
+    return (time.perf_counter() - start) / runs * 1000
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serial vs. parallel red light/speed queries.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--year")
+    args = parser.parse_args()
+
+    cache.RESULTS.maxsize = 0
+    dbConn = api.open_database(args.db)
+    if args.year is None:
+        args.year = dbConn.execute("SELECT MIN(Violation_Date) FROM RedViolations").fetchone()[0][:4]
+
+    cases = [
+        ("command2 intersection-cameras", lambda: api.cameras_at_intersection(dbConn, "%")),
+        ("command3 violations-on-date", lambda: api.violations_on_date(dbConn, f"{args.year}-06-01")),
+        ("command4 cameras-per-intersection", lambda: api.cameras_per_intersection(dbConn)),
+        ("command5 violations-by-intersection", lambda: api.violations_by_intersection(dbConn, args.year)),
+        ("command8 daily-violations", lambda: api.daily_violations(dbConn, args.year)),
+        ("command9 street-cameras", lambda: api.cameras_on_street(dbConn, "a")),
+    ]
+
+    print(f"{'command':<38}{'serial ms':>12}{'parallel ms':>14}{'speedup':>10}")
+    for name, function in cases:
+        function()  # Warm the page cache and the worker connections
+
+        parallel.WORKERS = 1
+        serial = time_runs(function, args.runs)
+        parallel.WORKERS = 2
+        threaded = time_runs(function, args.runs)
+
+        print(f"{name:<38}{serial:>12.3f}{threaded:>14.3f}{serial / threaded:>9.2f}x")
+
+    parallel.shutdown()
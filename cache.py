@@ -0,0 +1,137 @@
+
+# Description:
+#   In-process cache of query results for the functions in api.py. Results are keyed by
+#   database, function and normalized arguments, kept in least-recently-used order and
+#   evicted once the cache holds more than its size limit. A database's results are
+#   dropped as soon as a connection to it reports a new PRAGMA data_version (a commit
+#   by another connection) or a new total_changes (a commit by itself). Hit, miss,
+#   eviction and invalidation counters are kept so the size can be tuned.
+
+import collections
+import functools
+import threading
+
+import stats
+
+MISSING = object()  # What get returns for a key that isn't cached (None is a result like any other)
+
+class QueryCache:
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.versions = {}  # (database, connection) -> (data_version, total_changes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()  # Shared by the menu, batch and server threads
+
+    ##################################################################
+    # check_version
+    # Drops every cached result for the connection's database if its data has changed
+    # since this connection last used the cache. Returns the database path.
+    def check_version(self, dbConn):
+        path = stats.database_path(dbConn) or f":memory:{id(dbConn)}"
+        dbCursor = dbConn.cursor()
+        dbCursor.execute("PRAGMA data_version")
+        version = (dbCursor.fetchone()[0], dbConn.total_changes)
+
+        with self.lock:
+            seen = self.versions.get((path, id(dbConn)))
+            if seen is not None and seen != version:
+                stale = [key for key in self.entries if key[0] == path]
+                for key in stale:
+                    del self.entries[key]
+                self.invalidations += 1
+
+            if len(self.versions) > 64:
+                self.versions.clear()  # Forget connections that have since been closed
+            self.versions[(path, id(dbConn))] = version
+        return path
+
+    ##################################################################
+    # get / put
+    # Look up and store results, keeping the entries in least-recently-used order. get
+    # returns MISSING for a key that isn't cached.
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return MISSING
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+
+    ##################################################################
+    # stats
+    # Returns the cache counters as a dictionary.
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+# Cache shared by every api function; set RESULTS.maxsize = 0 to turn caching off
+RESULTS = QueryCache()
+
+##################################################################
+# normalize
+# Normalizes an argument so equivalent lookups share a cache entry: values are compared as
+# text (a camera ID of 1503 or "1503" finds the same rows) and lowercased for LIKE
+# searches, which ignore case.
+def normalize(value, ignore_case):
+    value = str(value)
+    return value.lower() if ignore_case else value
+
+##################################################################
+# cached
+# Decorator for api functions of the form function(dbConn, *args). Set ignore_case for
+# functions that match their arguments with LIKE.
+def cached(function=None, ignore_case=False):
+    if function is None:
+        return functools.partial(cached, ignore_case=ignore_case)
+
+    @functools.wraps(function)
+    def wrapper(dbConn, *args):
+        if RESULTS.maxsize <= 0:
+            return function(dbConn, *args)
+
+        path = RESULTS.check_version(dbConn)
+        key = (path, function.__name__) + tuple(normalize(arg, ignore_case) for arg in args)
+        result = RESULTS.get(key)
+        if result is MISSING:
+            result = function(dbConn, *args)
+            RESULTS.put(key, result)
+        return copy(result)
+
+    return wrapper
+
+##################################################################
+# copy
+# Copies the rows of a cached result (a list of rows, or a tuple holding one) so callers
+# get their own copy of each row.
+def copy(result):
+    if isinstance(result, list):
+        return [dict(row) for row in result]
+    if isinstance(result, tuple):
+        return tuple(copy(item) for item in result)
+    return result
@@ -0,0 +1,187 @@
+
+# Description:
+#   Stopping a command's queries without stopping the program. guard() runs one command
+#   with a time budget and, in the menu, with Ctrl-C caught. Every connection passed to
+#   watch() (the one api.open_database opens and the read-only ones of parallel.py) calls
+#   check() every PROGRESS_STEPS SQLite virtual machine steps, and check() makes SQLite
+#   stop the running statement once the command is over its budget or cancelled. Ctrl-C
+#   also calls Connection.interrupt() on the connections the command has used, so a
+#   statement stops at once, and the command raises Cancelled; the menu reports it and
+#   shows the menu again with the connection still open.
+#
+#   The running command is kept per thread, so a guard only ever stops, and rolls back,
+#   its own connections; parallel.py's worker threads join the command they run for.
+#
+#   While a command runs longer than PROGRESS_AFTER seconds, check() shows the time and
+#   virtual machine steps so far on stderr (when it is a terminal).
+#
+#   The budget is TIME_BUDGET seconds per command: TRAFFIC_TIME_BUDGET (default 60, 0 for
+#   none) for the menu, or --time-budget on the command line. It only applies while SQL is
+#   running.
+
+import contextlib
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+
+TIME_BUDGET = float(os.environ.get("TRAFFIC_TIME_BUDGET", 60))
+PROGRESS_STEPS = 1000  # check() runs every this many virtual machine steps
+PROGRESS_AFTER = 1.0  # Seconds before the progress line appears
+PROGRESS_EVERY = 0.2  # Seconds between updates of the progress line
+
+_local = threading.local()  # operation: the Operation this thread runs for, if any
+_lock = threading.Lock()
+
+##################################################################
+# Cancelled
+# Raised by a command stopped by Ctrl-C or by its time budget.
+class Cancelled(Exception):
+    pass
+
+##################################################################
+# Operation
+# One guarded command: when it started, its deadline (None for no budget), the virtual
+# machine steps counted so far, the connections that ran its statements and, once it is
+# to stop, why ("interrupt" or "budget").
+class Operation:
+    def __init__(self, name, budget):
+        self.name = name
+        self.start = time.monotonic()
+        self.budget = budget
+        self.deadline = self.start + budget if budget else None
+        self.steps = 0
+        self.connections = {}  # id -> connection
+        self.reason = None
+        self.shown = 0.0  # When the progress line was last written, 0 if never
+
+    ##################################################################
+    # message
+    # What to tell the user when the operation stopped.
+    def message(self):
+        if self.reason == "budget":
+            return f"Query stopped: {self.name} took longer than its time budget of {self.budget:g} s."
+        return "Query cancelled."
+
+    ##################################################################
+    # show / clear
+    # Writes the progress line, and blanks it once the operation is over.
+    def show(self, now):
+        self.shown = now
+        sys.stderr.write(f"\r  {self.name}: {now - self.start:.1f} s, {self.steps / 1e6:,.1f}M steps (Ctrl-C to cancel) ")
+        sys.stderr.flush()
+
+    def clear(self):
+        if self.shown:
+            sys.stderr.write("\r" + " " * 72 + "\r")
+            sys.stderr.flush()
+
+##################################################################
+# current
+# The Operation this thread is running for, or None.
+def current():
+    return getattr(_local, "operation", None)
+
+##################################################################
+# joined
+# Context manager that runs this thread's statements as part of operation (another
+# thread's, or None), as parallel.py's workers do for the command that handed them work.
+@contextlib.contextmanager
+def joined(operation):
+    outer, _local.operation = current(), operation
+    try:
+        yield
+    finally:
+        _local.operation = outer
+
+##################################################################
+# check
+# The progress handler of dbConn, run every steps virtual machine steps: returns 1 (stop
+# the statement) once this thread's operation is cancelled or over budget, else 0,
+# noting the connection as one the operation uses and updating the progress line.
+def check(steps=PROGRESS_STEPS, dbConn=None):
+    operation = current()
+    if operation is None:
+        return 0
+    if dbConn is not None and id(dbConn) not in operation.connections:
+        with _lock:
+            operation.connections[id(dbConn)] = dbConn
+    operation.steps += steps
+    if operation.reason:
+        return 1
+    now = time.monotonic()
+    if operation.deadline is not None and now > operation.deadline:
+        operation.reason = "budget"
+        return 1
+    if now - operation.start >= PROGRESS_AFTER and now - operation.shown >= PROGRESS_EVERY and sys.stderr.isatty():
+        operation.show(now)
+    return 0
+
+##################################################################
+# watch
+# Puts a connection under guard(). With handler=False the connection's own progress
+# handler must call check() (as instrument.InstrumentedConnection's does).
+def watch(dbConn, handler=True):
+    if handler:
+        dbConn.set_progress_handler(lambda: check(PROGRESS_STEPS, dbConn), PROGRESS_STEPS)
+
+##################################################################
+# interrupt
+# Stops the statement running on every connection an operation has used.
+def interrupt(operation):
+    with _lock:
+        connections = list(operation.connections.values())
+    for connection in connections:
+        try:
+            connection.interrupt()
+        except sqlite3.ProgrammingError:  # Closed
+            pass
+
+##################################################################
+# roll_back
+# Ends any transaction a stopped statement left open on an operation's connections of
+# this thread, so the next command starts clean.
+def roll_back(operation):
+    with _lock:
+        connections = list(operation.connections.values())
+    for connection in connections:
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.ProgrammingError:  # Closed, or another thread's
+            pass
+
+##################################################################
+# guard
+# Context manager around one command: its statements stop after budget seconds (None for
+# TIME_BUDGET, 0 for no limit) and, with catch_interrupt on the main thread, on Ctrl-C.
+# Either way the stopped statement makes it raise Cancelled.
+@contextlib.contextmanager
+def guard(name, budget=None, catch_interrupt=True):
+    operation = Operation(name, TIME_BUDGET if budget is None else budget)
+    outer, _local.operation = current(), operation
+
+    previous = None
+    if catch_interrupt and threading.current_thread() is threading.main_thread():
+        # Only flags the operation: the interrupted statement's OperationalError becomes
+        # Cancelled below, so the handler never raises in the middle of other code
+        def on_interrupt(signum, frame):
+            operation.reason = "interrupt"
+            interrupt(operation)
+        previous = signal.signal(signal.SIGINT, on_interrupt)
+
+    try:
+        yield operation
+    except sqlite3.OperationalError as error:
+        if operation.reason is None or "interrupt" not in str(error):
+            raise
+        raise Cancelled(operation.message()) from None
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGINT, previous)
+        _local.operation = outer
+        operation.clear()
+        if operation.reason:
+            roll_back(operation)
@@ -0,0 +1,286 @@
+
+# Description:
+#   Draws the menu's charts: yearly violations for a camera (command 6), monthly
+#   violations for a camera (command 7), daily violations for a year (command 8), cameras
+#   on the city map (command 9) and the multi-year comparison (command 11). Each chart is
+#   drawn onto a figure that is reused from one call to the next rather than created
+#   again, and the map image is decoded once and kept in memory. show() displays a chart
+#   with pyplot like before; save() renders it headless with the Agg canvas to a PNG or
+#   SVG file (by extension) without importing pyplot at all. matplotlib itself is only
+#   imported once a chart is drawn, so importing this module costs the menu nothing.
+#
+#   Run as a script it exports charts in bulk, spread over a pool of processes that each
+#   have their own read-only connection:
+#
+#   python charts.py --chart yearly|monthly|daily [--db FILE] [--out DIR] [--format png|svg]
+#                    [--workers N] [--year YYYY]
+#
+#   yearly draws one chart per camera, monthly one per camera per year with violations
+#   (or just --year) and daily one per year.
+
+import functools
+import os
+import time
+
+import api
+import parallel
+import queries
+
+MAP_IMAGE = "chicago.png"
+MAP_EXTENT = [-87.9277, -87.5569, 41.7012, 42.0868]
+
+_figures = {}  # chart name -> headless Figure reused by save()
+
+##################################################################
+# map_image
+# Returns the decoded map image, read from the current folder (like before) or else from
+# the folder this file is in. Decoded on first use only.
+@functools.lru_cache(maxsize=1)
+def map_image():
+    import matplotlib.image
+
+    path = MAP_IMAGE if os.path.exists(MAP_IMAGE) else os.path.join(os.path.dirname(os.path.abspath(__file__)), MAP_IMAGE)
+    return matplotlib.image.imread(path)
+
+##################################################################
+# Charts
+# Each chart has a setup function that adds its axes, fixed labels and (empty) artists to
+# a figure and returns them, and an update function that fills them in for one camera or
+# year. A figure keeps its chart's artists between calls, so drawing the next chart only
+# swaps in the new data, title and ticks.
+def setup_yearly(figure):
+    axes = figure.add_subplot()
+    line, = axes.plot([], [], linestyle="-", color='blue', linewidth=2)
+    axes.set_xlabel("Year")
+    axes.set_ylabel("Number of Violations")
+    return {"axes": axes, "line": line}
+
+def update_yearly(chart, camera_id, violations):
+    years = [int(row["year"]) for row in violations]
+    chart["line"].set_data(years, [row["violations"] for row in violations])
+    chart["axes"].set_title(f"Yearly Violations For Camera {camera_id}")
+    chart["axes"].set_xticks(years)
+    rescale(chart["axes"])
+
+def setup_monthly(figure):
+    axes = figure.add_subplot()
+    line, = axes.plot([], [], linestyle="-", color='blue', linewidth=2)
+    axes.set_xlabel("Month")
+    axes.set_ylabel("Number of Violations")
+    return {"axes": axes, "line": line}
+
+def update_monthly(chart, camera_id, year, violations):
+    months = [int(row["month"]) for row in violations]
+    chart["line"].set_data(months, [row["violations"] for row in violations])
+    chart["axes"].set_title(f"Monthly Violations for Camera {camera_id} ({year})")
+    chart["axes"].set_xticks(months)
+    rescale(chart["axes"])
+
+def setup_daily(figure):
+    axes = figure.add_subplot()
+    red, = axes.plot([], [], linestyle="-", color='red', linewidth=2, label="Red Light Violations")
+    speed, = axes.plot([], [], linestyle="-", color='orange', linewidth=2, label="Speed Violations")
+    axes.set_xlabel("Day")
+    axes.set_ylabel("Number of Violations")
+    axes.legend()
+
+    # Sets x axis ticks from 50 to 350 with step 50
+    tick_positions = list(range(0, 351, 50))
+    axes.set_xticks(tick_positions, [str(i) for i in tick_positions], rotation=45, fontsize=8)
+    axes.grid(axis="y", linestyle="--", alpha=0.7)
+    return {"axes": axes, "red": red, "speed": speed}
+
+def update_daily(chart, year, red_violations, speed_violations):
+    days = range(len(red_violations))
+    chart["red"].set_data(days, red_violations)
+    chart["speed"].set_data(days, speed_violations)
+    chart["axes"].set_title(f"Violations Each Day of {year}")
+    rescale(chart["axes"])
+
+def setup_street(figure):
+    axes = figure.add_subplot()
+    axes.imshow(map_image(), extent=MAP_EXTENT)
+    red, = axes.plot([], [], 'o', color='red', label="Red Light Cameras")
+    speed, = axes.plot([], [], 'o', color='orange', label="Speed Cameras")
+    axes.set_xlim(MAP_EXTENT[:2])
+    axes.set_ylim(MAP_EXTENT[2:])
+    axes.legend()
+    return {"axes": axes, "red": red, "speed": speed, "labels": []}
+
+def update_street(chart, street_name, red_cameras, speed_cameras):
+    chart["red"].set_data([camera["longitude"] for camera in red_cameras], [camera["latitude"] for camera in red_cameras])
+    chart["speed"].set_data([camera["longitude"] for camera in speed_cameras], [camera["latitude"] for camera in speed_cameras])
+
+    # Labels each camera with its ID, replacing the previous chart's labels
+    for label in chart["labels"]:
+        label.remove()
+    chart["labels"] = [chart["axes"].annotate(camera["camera_id"], (camera["longitude"], camera["latitude"]),
+                                              color='black', fontsize=8)
+                       for camera in red_cameras + speed_cameras]
+    chart["axes"].set_title(f"Cameras on {street_name}")
+
+def setup_years(figure):
+    return {"figure": figure}
+
+def update_years(chart, first_year, last_year, series, years):
+    import numpy as np
+    import timeseries
+
+    # The number of bars changes with the range, so this one is drawn from scratch
+    figure = chart["figure"]
+    figure.clear()
+    daily, yearly = figure.subplots(2, 1)
+
+    # 30-day rolling average of daily violations over the whole range
+    daily.plot(series.dates, timeseries.rolling_mean(series.counts["red"], 30), color='red', linewidth=1.5, label="Red Light Violations")
+    daily.plot(series.dates, timeseries.rolling_mean(series.counts["speed"], 30), color='orange', linewidth=1.5, label="Speed Violations")
+    daily.set_ylabel("Violations per Day (30-day average)")
+    daily.set_title(f"Violations {first_year}-{last_year}")
+    daily.legend()
+    daily.grid(axis="y", linestyle="--", alpha=0.7)
+
+    # Yearly totals side by side
+    positions = np.arange(len(years))
+    yearly.bar(positions - 0.2, [row["red"] for row in years], width=0.4, color='red', label="Red Light Violations")
+    yearly.bar(positions + 0.2, [row["speed"] for row in years], width=0.4, color='orange', label="Speed Violations")
+    yearly.set_xticks(positions, [str(row["year"]) for row in years])
+    yearly.set_ylabel("Number of Violations")
+    yearly.legend()
+    figure.tight_layout()
+
+##################################################################
+# rescale
+# Fits an axes' limits to its current data after the data has been swapped.
+def rescale(axes):
+    axes.relim()
+    axes.autoscale_view()
+
+# Chart name -> (setup function, update function, figure size in inches or None for the default)
+CHARTS = {
+    "yearly": (setup_yearly, update_yearly, (8, 5)),
+    "monthly": (setup_monthly, update_monthly, (8, 5)),
+    "daily": (setup_daily, update_daily, (12, 6)),
+    "street": (setup_street, update_street, None),
+    "years": (setup_years, update_years, (12, 8)),
+}
+
+##################################################################
+# draw
+# Draws a chart on a figure, setting the figure up for it the first time.
+def draw(figure, chart, *args):
+    setup, update, size = CHARTS[chart]
+    if getattr(figure, "chart", None) != chart:
+        figure.clear()
+        figure.chart, figure.chart_artists = chart, setup(figure)
+    update(figure.chart_artists, *args)
+
+##################################################################
+# show
+# Draws a chart on its pyplot figure (the same window each time while it stays open) and
+# shows it.
+def show(chart, *args):
+    import matplotlib.pyplot as plt  # Only needed when charts are shown on screen
+
+    figure = plt.figure(num=chart, figsize=CHARTS[chart][2])
+    draw(figure, chart, *args)
+    plt.show()
+
+##################################################################
+# save
+# Draws a chart on its headless figure and writes it to path, as PNG or SVG depending on
+# the file extension. Returns path.
+def save(chart, path, *args):
+    import matplotlib.figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = _figures.get(chart)
+    if figure is None:
+        figure = _figures[chart] = matplotlib.figure.Figure(figsize=CHARTS[chart][2])
+        FigureCanvasAgg(figure)
+    draw(figure, chart, *args)
+    figure.savefig(path)
+    return path
+
+##################################################################
+# plan
+# Lists the charts to export as (chart, arguments) tuples: one per camera for yearly, per
+# camera and year with violations for monthly, or per year with violations for daily.
+def plan(dbConn, chart, year=None):
+    dbCursor = dbConn.cursor()
+    if chart == "yearly":
+        tasks = []
+        for kind, (violations, cameras) in queries.TABLES.items():
+            dbCursor.execute(f"SELECT Camera_ID FROM {cameras} ORDER BY Camera_ID")
+            tasks += [(chart, (str(row[0]),)) for row in dbCursor.fetchall()]
+        return tasks
+    if chart == "monthly":
+        dbCursor.execute("""
+            SELECT DISTINCT Camera_ID, Year FROM Rollup_Camera_Year
+            WHERE ? IS NULL OR Year = ?
+            ORDER BY Camera_ID, Year""", (year, year))
+        return [(chart, (str(row[0]), row[1])) for row in dbCursor.fetchall()]
+    if chart == "daily":
+        dbCursor.execute("SELECT DISTINCT substr(Day, 1, 4) FROM Rollup_Day ORDER BY 1")
+        return [(chart, (row[0],)) for row in dbCursor.fetchall() if year is None or row[0] == year]
+    raise ValueError(f"charts of type {chart} can't be exported in bulk")
+
+##################################################################
+# Batch worker
+# Each worker process keeps one read-only connection and renders the charts it is given.
+_worker = {}
+
+def start_worker(path, out, image_format):
+    parallel.WORKERS = 1  # The process pool already keeps every core busy
+    _worker.update(path=path, out=out, format=image_format)
+
+def render(task):
+    chart, args = task
+    dbConn = parallel.read_only_connection(_worker["path"])
+    name = f"{chart}-{'-'.join(args)}.{_worker['format']}"
+    path = os.path.join(_worker["out"], name)
+    try:
+        if chart == "yearly":
+            save(chart, path, args[0], api.violations_by_year(dbConn, args[0]))
+        elif chart == "monthly":
+            save(chart, path, args[0], args[1], api.violations_by_month(dbConn, args[0], args[1]))
+        elif chart == "daily":
+            series = api.daily_series(dbConn, args[0])
+            save(chart, path, args[0], series.counts["red"], series.counts["speed"])
+    except api.QueryError:
+        return None
+    return name
+
+##################################################################
+# export
+# Renders every chart in the plan across a process pool. Returns (charts written, seconds).
+def export(path, chart, out, image_format="png", workers=None, year=None):
+    import concurrent.futures
+
+    dbConn = api.open_database(path) # Makes sure the rollups are built before the workers read them
+    tasks = plan(dbConn, chart, year)
+    dbConn.close()
+    os.makedirs(out, exist_ok=True)
+
+    start = time.perf_counter()
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                                                initargs=(path, out, image_format)) as pool:
+        written = [name for name in pool.map(render, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+                   if name is not None]
+    return len(written), time.perf_counter() - start
+
+# main
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export charts for every camera or year.")
+    parser.add_argument("--chart", choices=["yearly", "monthly", "daily"], required=True)
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--out", default="charts", help="folder to write to (default: %(default)s)")
+    parser.add_argument("--format", choices=["png", "svg"], default="png")
+    parser.add_argument("--workers", type=int, help="processes to render with (default: one per CPU)")
+    parser.add_argument("--year", help="only this year (monthly and daily charts)")
+    args = parser.parse_args()
+
+    count, seconds = export(args.db, args.chart, args.out, args.format, args.workers, args.year)
+    print(f"Wrote {count:,} {args.chart} charts to {args.out} in {seconds:.1f} s ({count / max(seconds, 1e-9):,.1f} charts/sec)")
@@ -0,0 +1,244 @@
+
+# Description:
+#   Command-line interface over the query functions in api.py, for running lookups from
+#   scripts and cron jobs without the interactive menu. Each menu command is a
+#   subcommand, e.g.
+#       python main.py violations-by-year --camera 1503 --format json
+#   and "batch FILE" runs a file of such commands (one per line) in one process over one
+#   connection. Results are written as JSON or CSV.
+#
+#   The long listings (intersections, cameras-per-intersection, violations-by-intersection
+#   and street-cameras) take --limit N and --offset N, applied in the SQL (to each camera
+#   type separately for the last three), and are written out as their rows are read.
+#   A query still running after --time-budget seconds is stopped and reported as an error
+#   (see cancel.py).
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import shlex
+import sys
+
+import api
+import cache
+import cancel
+import instrument
+
+##################################################################
+# Subcommands: name -> (api function, help text, [(option, help text), ...])
+# The options are passed to the api function in order.
+COMMANDS = {
+    "intersections": (api.find_intersections, "find an intersection by name (command 1)",
+                      [("--name", "intersection name, wildcards _ and % allowed")]),
+    "intersection-cameras": (api.cameras_at_intersection, "cameras at an intersection (command 2)",
+                             [("--intersection", "intersection name")]),
+    "violations-on-date": (api.violations_on_date, "red light vs. speed violations on a date (command 3)",
+                           [("--date", "date in YYYY-MM-DD format")]),
+    "cameras-per-intersection": (api.cameras_per_intersection, "number of cameras at each intersection (command 4)",
+                                 []),
+    "violations-by-intersection": (api.violations_by_intersection, "violations at each intersection in a year (command 5)",
+                                   [("--year", "year, e.g. 2023")]),
+    "violations-by-year": (api.violations_by_year, "violations by year for a camera (command 6)",
+                           [("--camera", "camera ID")]),
+    "violations-by-month": (api.violations_by_month, "violations by month for a camera in a year (command 7)",
+                            [("--camera", "camera ID"), ("--year", "year, e.g. 2023")]),
+    "daily-violations": (api.daily_violations, "red light and speed violations for each day of a year (command 8)",
+                         [("--year", "year, e.g. 2023")]),
+    "street-cameras": (api.cameras_on_street, "cameras located on a street (command 9)",
+                       [("--street", "street name")]),
+    "cameras-near": (api.cameras_near, "cameras within some distance of a point, nearest first (command 10)",
+                     [("--lat", "latitude"), ("--lon", "longitude"), ("--meters", "distance in meters")]),
+    "nearest-cameras": (api.nearest_cameras, "the cameras nearest to a point",
+                        [("--lat", "latitude"), ("--lon", "longitude"), ("--count", "number of cameras")]),
+    "cameras-in-box": (api.cameras_in_box, "cameras inside a latitude/longitude box",
+                       [("--min-lat", "south edge"), ("--min-lon", "west edge"),
+                        ("--max-lat", "north edge"), ("--max-lon", "east edge")]),
+    "compare-years": (api.compare_years, "red light vs. speed violation totals for each year in a range (command 11)",
+                      [("--first-year", "first year, e.g. 2014"), ("--last-year", "last year, e.g. 2024")]),
+    "audit-cameras": (api.camera_anomalies, "every camera's outages and spikes over a range of years, ranked by impact",
+                      [("--first-year", "first year, e.g. 2014"), ("--last-year", "last year, e.g. 2024"),
+                       ("--grain", "day or month")]),
+    "search": (api.search_locations, "intersections and camera addresses containing some text, best match first",
+               [("--text", "text to search for, at least 3 characters")]),
+}
+
+##################################################################
+# Paged subcommands: name -> (api iter_ function, whether it is called once per camera type)
+PAGED = {
+    "intersections": (api.iter_intersections, False),
+    "cameras-per-intersection": (api.iter_cameras_per_intersection, True),
+    "violations-by-intersection": (api.iter_violations_by_intersection, True),
+    "street-cameras": (api.iter_cameras_on_street, True),
+}
+
+##################################################################
+# build_parser
+# Builds the argument parser with one subcommand per entry in COMMANDS plus "batch".
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", default=api.DATABASE, help="database file (default: %(default)s)")
+    common.add_argument("--format", choices=["json", "csv"], default="json", help="output format (default: json)")
+    common.add_argument("--cache-size", type=int, default=cache.RESULTS.maxsize,
+                        help="number of query results to keep in memory, 0 to turn off (default: %(default)s)")
+    common.add_argument("--cache-stats", action="store_true", help="print query cache counters to stderr when done")
+    common.add_argument("--query-log", metavar="FILE", default=os.environ.get("TRAFFIC_QUERY_LOG"),
+                        help="time every statement, log slow ones to FILE and print a summary to stderr")
+    common.add_argument("--slow-ms", type=float, default=float(os.environ.get("TRAFFIC_SLOW_MS", instrument.SLOW_MS)),
+                        help="statements at least this slow are logged (default: %(default)s)")
+    common.add_argument("--time-budget", type=float, default=cancel.TIME_BUDGET,
+                        help="stop a query running longer than this many seconds, 0 for no limit (default: %(default)s)")
+
+    parser = argparse.ArgumentParser(prog="main.py", description="Chicago traffic camera queries.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name, (function, help_text, options) in COMMANDS.items():
+        subparser = subparsers.add_parser(name, help=help_text, parents=[common])
+        for option, option_help in options:
+            subparser.add_argument(option, required=True, help=option_help)
+        if name in PAGED:
+            subparser.add_argument("--limit", type=int, help="at most this many rows (of each camera type)")
+            subparser.add_argument("--offset", type=int, default=0, help="skip this many rows first (default: 0)")
+
+    batch = subparsers.add_parser("batch", parents=[common],
+                                  help="run a file of commands (one per line, - for stdin) over one connection")
+    batch.add_argument("file")
+    return parser
+
+##################################################################
+# run_query
+# Runs one parsed subcommand against an open connection, within its time budget.
+# Returns its rows.
+def run_query(dbConn, args):
+    if args.command in PAGED:
+        with instrument.command(args.command, dbConn), cancel.guard(args.command, args.time_budget, False):
+            return list(stream_query(dbConn, args))
+
+    function, help_text, options = COMMANDS[args.command]
+    values = [getattr(args, option.lstrip("-").replace("-", "_")) for option, option_help in options]
+    with instrument.command(args.command, dbConn), cancel.guard(args.command, args.time_budget, False):
+        return function(dbConn, *values)
+
+##################################################################
+# stream_query
+# Runs one parsed paged subcommand. Returns an iterator over its rows, read as it goes.
+def stream_query(dbConn, args):
+    function, per_kind = PAGED[args.command]
+    values = [getattr(args, option.lstrip("-").replace("-", "_")) for option, option_help in COMMANDS[args.command][2]]
+    if not per_kind:
+        return function(dbConn, *values, args.limit, args.offset)
+    return itertools.chain.from_iterable([function(dbConn, kind, *values, args.limit, args.offset) for kind in api.KINDS])
+
+##################################################################
+# write_rows
+# Writes row dictionaries as CSV, with a header taken from the first row.
+def write_rows(rows, out, extra=None):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    fields = list(extra or {}) + list(first)
+    writer = csv.DictWriter(out, fieldnames=fields, lineterminator="\n")
+    writer.writeheader()
+    for row in itertools.chain([first], rows):
+        writer.writerow({**(extra or {}), **row})
+
+##################################################################
+# write_json
+# Writes row dictionaries as an indented JSON array (the same text as json.dumps(rows,
+# indent=2)) one row at a time.
+def write_json(rows, out):
+    separator = "[\n"
+    for row in rows:
+        out.write(separator + "  " + json.dumps(row, indent=2).replace("\n", "\n  "))
+        separator = ",\n"
+    out.write("[]\n" if separator == "[\n" else "\n]\n")
+
+##################################################################
+# write_output
+# Writes a query's rows in the chosen format.
+def write_output(rows, output_format, out):
+    if output_format == "json":
+        write_json(rows, out)
+    else:
+        write_rows(rows, out)
+
+##################################################################
+# read_batch
+# Yields the command lines of a batch file, skipping blank lines and # comments.
+def read_batch(path):
+    lines = sys.stdin if path == "-" else open(path)
+    try:
+        for line in lines:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if lines is not sys.stdin:
+            lines.close()
+
+##################################################################
+# run_batch
+# Runs every command in a batch file over one connection. JSON output is one object per
+# line ({"query", "rows"} or {"query", "error"}); CSV output is one block per query with
+# a leading "query" column. Returns the number of queries that failed.
+def run_batch(parser, dbConn, args, out):
+    failures = 0
+    for line in read_batch(args.file):
+        try:
+            query_args = parser.parse_args(shlex.split(line))
+            if query_args.command == "batch":
+                raise api.QueryError("batch files can't run other batch files")
+            rows = run_query(dbConn, query_args)
+        except (api.QueryError, cancel.Cancelled, SystemExit) as error:
+            failures += 1
+            message = "invalid command" if isinstance(error, SystemExit) else str(error)
+            if args.format == "json":
+                out.write(json.dumps({"query": line, "error": message}) + "\n")
+            else:
+                print(f"{line}: {message}", file=sys.stderr)
+            continue
+
+        if args.format == "json":
+            out.write(json.dumps({"query": line, "rows": rows}) + "\n")
+        else:
+            write_rows(rows, out, {"query": line})
+            out.write("\n")
+    return failures
+
+##################################################################
+# main
+# Parses the command line and runs it. Returns the exit status.
+def main(argv=None, out=sys.stdout):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    cache.RESULTS.maxsize = args.cache_size
+    if args.query_log:
+        instrument.enable(args.query_log, args.slow_ms)
+    dbConn = api.open_database(args.db)
+
+    try:
+        if args.command == "batch":
+            return 1 if run_batch(parser, dbConn, args, out) else 0
+
+        try:
+            if args.command in PAGED:
+                with instrument.command(args.command, dbConn), cancel.guard(args.command, args.time_budget, False):
+                    write_output(stream_query(dbConn, args), args.format, out) # Fetches as it writes
+                return 0
+            rows = run_query(dbConn, args)
+        except (api.QueryError, cancel.Cancelled) as error:
+            print(error, file=sys.stderr)
+            return 1
+
+        write_output(rows, args.format, out)
+        return 0
+    finally:
+        dbConn.close()
+        if args.cache_stats:
+            print("Query cache:", json.dumps(cache.RESULTS.stats()), file=sys.stderr)
+        instrument.report()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,277 @@
+
+# Description:
+#   Columnar copy of the violation tables for the large aggregate scans (violations per
+#   intersection for a year in command 5, violations per day in command 8, violations
+#   per camera and day for the camera audit). export()
+#   writes each violation table to <database>-columns/ as three NumPy arrays sorted by
+#   date: camera (a dense int32 index into that type's camera list), day (int32 days
+#   since 1970-01-01) and count (int32), plus the camera list and each camera's
+#   intersection. The arrays are memory-mapped read-only, a year is a contiguous slice
+#   found by binary search, and the group-bys are np.bincount over the slice, so nothing
+#   is copied out of the mapped files.
+#
+#   The store records the database file's modification time and size (see
+#   stats.file_key) when it was exported. current() only returns it while they still
+#   match; after any write to the database the commands fall back to SQL until the
+#   store is exported again.
+#
+#   python columnar.py [--db FILE]
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+import api
+import parallel
+import queries
+import shards
+import stats
+
+VERSION = 1
+BATCH_SIZE = 100000
+EPOCH_JULIAN_DAY = 2440587.5  # julianday('1970-01-01')
+
+_stores = {}  # columns folder -> (manifest modification time, ColumnStore)
+
+##################################################################
+# ColumnStore
+# The memory-mapped arrays of one export. arrays[kind] maps "camera", "day", "count",
+# "camera_ids" and "camera_intersections" to read-only arrays. The intersection names are
+# exported with the columns, since any change to the database outdates the whole store.
+class ColumnStore:
+    def __init__(self, folder, manifest):
+        self.folder = folder
+        self.manifest = manifest
+        self.arrays = {kind: {name: np.load(os.path.join(folder, f"{kind}.{name}.npy"), mmap_mode="r")
+                              for name in ("camera", "day", "count", "camera_ids", "camera_intersections")}
+                       for kind in manifest["kinds"]}
+        self.intersection_names = dict(manifest["intersections"])
+
+        # For each type, its intersections (those in the Intersections table, like the join
+        # in SQL) and the position of each camera's intersection among them, or -1
+        self.intersections = {}
+        for kind, arrays in self.arrays.items():
+            camera_intersections = np.asarray(arrays["camera_intersections"])
+            known = np.isin(camera_intersections, list(self.intersection_names))
+            ids = np.unique(camera_intersections[known])
+            self.intersections[kind] = (ids, np.where(known, np.searchsorted(ids, camera_intersections), -1))
+
+    ##################################################################
+    # day_slice
+    # Returns the (start, stop) positions of the rows dated from start_day up to (not
+    # including) end_day, by binary search on the sorted day column. The keys are int32 like
+    # the column, or NumPy would convert the whole column to compare them.
+    def day_slice(self, kind, start_day, end_day):
+        days = self.arrays[kind]["day"]
+        return tuple(np.searchsorted(days, np.array([start_day, end_day], dtype=days.dtype)))
+
+##################################################################
+# columns_folder
+# The folder a database's columnar store is written to.
+def columns_folder(path):
+    return path + "-columns"
+
+##################################################################
+# day_number
+# Days since 1970-01-01 of a datetime.date.
+def day_number(date):
+    return (date - datetime.date(1970, 1, 1)).days
+
+##################################################################
+# export_kind
+# Writes one violation table's columns to folder, streaming the rows in date order from
+# the year shards (if any, see shards.py) and then the main file. Returns the number of
+# rows written.
+def export_kind(dbConn, kind, folder):
+    violations, cameras = queries.TABLES[kind]
+    dbCursor = dbConn.cursor()
+    sources = [parallel.read_only_connection(path) for path in shards.of_connection(dbConn).values()] + [dbConn]
+
+    # Dense camera index: every camera with violations, in ID order
+    camera_ids = set()
+    for source in sources:
+        camera_ids.update(row[0] for row in source.execute(
+            f"SELECT DISTINCT Camera_ID FROM {violations} WHERE Violation_Date IS NOT NULL"))
+    camera_ids = np.array(sorted(camera_ids), dtype=np.int64)
+    dbCursor.execute(f"SELECT Camera_ID, Intersection_ID FROM {cameras} WHERE Intersection_ID IS NOT NULL")
+    intersection_of = dict(dbCursor.fetchall())
+    camera_intersections = np.array([intersection_of.get(camera_id, -1) for camera_id in camera_ids.tolist()],
+                                    dtype=np.int64)  # -1: not in the camera table or no intersection
+    np.save(os.path.join(folder, f"{kind}.camera_ids.npy"), camera_ids)
+    np.save(os.path.join(folder, f"{kind}.camera_intersections.npy"), camera_intersections)
+
+    rows = sum(source.execute(f"SELECT COUNT(*) FROM {violations} WHERE Violation_Date IS NOT NULL").fetchone()[0]
+               for source in sources)
+    columns = {name: np.lib.format.open_memmap(os.path.join(folder, f"{kind}.{name}.npy"), mode="w+",
+                                               dtype=np.int32, shape=(rows,))
+               for name in ("camera", "day", "count")}
+
+    position = 0
+    for source in sources:
+        sourceCursor = source.cursor()
+        sourceCursor.execute(f"""
+            SELECT Camera_ID, CAST(julianday(Violation_Date) - {EPOCH_JULIAN_DAY} AS INTEGER), COALESCE(Num_Violations, 0)
+            FROM {violations}
+            WHERE Violation_Date IS NOT NULL
+            ORDER BY Violation_Date""")
+        while True:
+            batch = sourceCursor.fetchmany(BATCH_SIZE)
+            if not batch:
+                break
+            values = np.array(batch, dtype=np.int64)
+            end = position + len(values)
+            columns["camera"][position:end] = np.searchsorted(camera_ids, values[:, 0])
+            columns["day"][position:end] = values[:, 1]
+            columns["count"][position:end] = values[:, 2]
+            position = end
+
+    # Rows added to the main file for a year already sharded land out of order
+    if rows and np.any(np.diff(columns["day"]) < 0):
+        order = np.argsort(columns["day"], kind="stable")
+        for column in columns.values():
+            column[:] = column[order]
+
+    for column in columns.values():
+        column.flush()
+    return rows
+
+##################################################################
+# export
+# Writes the columnar store for the database at path, replacing any earlier one. The
+# new store is built in a temporary folder and renamed into place. Returns {kind: rows}.
+def export(path):
+    dbConn = api.open_database(path) # Finish any index or rollup writes first so they don't outdate the store
+    dbConn.execute("PRAGMA wal_checkpoint(TRUNCATE)") # And move them into the file, as closing would
+    key = stats.file_key(path)
+
+    folder = columns_folder(path)
+    building = folder + ".tmp"
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    rows = {kind: export_kind(dbConn, kind, building) for kind in queries.TABLES}
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT Intersection_ID, Intersection FROM Intersections")
+    intersections = dbCursor.fetchall()
+    dbConn.close()
+
+    if stats.file_key(path) != key:
+        shutil.rmtree(building)
+        raise RuntimeError("the database changed during the export; run it again")
+
+    with open(os.path.join(building, "manifest.json"), "w") as file:
+        json.dump({"version": VERSION, "file_key": key, "kinds": list(queries.TABLES), "rows": rows,
+                   "intersections": intersections}, file)
+    shutil.rmtree(folder, ignore_errors=True)
+    os.rename(building, folder)
+    _stores.pop(folder, None)
+    return rows
+
+##################################################################
+# current
+# Given connection to database, returns its ColumnStore if one has been exported and the
+# database hasn't changed since, or None so the caller uses SQL instead.
+def current(dbConn):
+    path = stats.database_path(dbConn)
+    if not path:
+        return None
+    folder = columns_folder(path)
+    manifest_path = os.path.join(folder, "manifest.json")
+    try:
+        modified = os.stat(manifest_path).st_mtime_ns
+    except OSError:
+        return None
+
+    cached = _stores.get(folder)
+    if cached is None or cached[0] != modified:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        if manifest.get("version") != VERSION:
+            return None
+        cached = _stores[folder] = (modified, ColumnStore(folder, manifest))
+
+    store = cached[1]
+    if store.manifest["file_key"] != stats.file_key(path):
+        return None
+    return store
+
+##################################################################
+# year_by_intersection
+# Command 5 from the columns: returns (total violations of one camera type in a year,
+# [(intersection ID, intersection name, violations)]) in the same order as
+# queries.YEAR_BY_INTERSECTION, or (None, []) for a year with no violations.
+def year_by_intersection(store, kind, year):
+    year = str(year).strip()
+    if not (year.isdigit() and len(year) == 4 and 1 <= int(year) <= 9998):  # Dates stop at 9999
+        return None, []
+    arrays = store.arrays[kind]
+    start, stop = store.day_slice(kind, day_number(datetime.date(int(year), 1, 1)),
+                                  day_number(datetime.date(int(year) + 1, 1, 1)))
+    if start == stop:
+        return None, []
+
+    cameras = arrays["camera"][start:stop]
+    counts = arrays["count"][start:stop]
+    total = int(counts.sum(dtype=np.int64))
+
+    # Per camera, then per intersection (cameras without one are left out, like the join)
+    size = len(arrays["camera_ids"])
+    camera_totals = np.bincount(cameras, weights=counts, minlength=size)
+    camera_rows = np.bincount(cameras, minlength=size)
+    ids, camera_intersections = store.intersections[kind]
+    known = camera_intersections >= 0
+    totals = np.bincount(camera_intersections[known], weights=camera_totals[known], minlength=len(ids)).astype(np.int64)
+    present = np.bincount(camera_intersections[known], weights=camera_rows[known], minlength=len(ids)) > 0
+
+    rows = [(intersection_id, store.intersection_names[intersection_id], violations)
+            for intersection_id, violations in zip(ids[present].tolist(), totals[present].tolist())]
+    rows.sort(key=lambda row: (row[2], row[0]), reverse=True)
+    return total, rows
+
+##################################################################
+# daily_counts
+# Command 8 from the columns: violations of one camera type on each day from the start
+# of first_year to the end of last_year. The rows are in date order, so each day is a
+# run found by binary search and summed in place with np.add.reduceat.
+def daily_counts(store, kind, first_year, last_year):
+    first_day = day_number(datetime.date(first_year, 1, 1))
+    end_day = day_number(datetime.date(last_year + 1, 1, 1))
+    arrays = store.arrays[kind]
+    bounds = np.searchsorted(arrays["day"], np.arange(first_day, end_day + 1, dtype=arrays["day"].dtype))
+    counts = np.zeros(end_day - first_day, dtype=np.int64)
+    days = bounds[:-1] < bounds[1:]
+    if days.any():
+        counts[days] = np.add.reduceat(arrays["count"][bounds[0]:bounds[-1]], bounds[:-1][days] - bounds[0],
+                                       dtype=np.int64)
+    return counts
+
+##################################################################
+# camera_days
+# The camera audit's day matrix from the columns (see anomalies.py): returns (IDs of the
+# cameras with rows from the start of first_year to the end of last_year, their
+# violations on each day as a cameras x days array), summed with one np.bincount.
+def camera_days(store, kind, first_year, last_year):
+    first_day = day_number(datetime.date(first_year, 1, 1))
+    end_day = day_number(datetime.date(last_year + 1, 1, 1))
+    arrays = store.arrays[kind]
+    start, stop = store.day_slice(kind, first_day, end_day)
+    present, cameras = np.unique(arrays["camera"][start:stop], return_inverse=True)
+    size = end_day - first_day
+    cells = cameras.astype(np.int64) * size + (arrays["day"][start:stop] - first_day)
+    counts = np.bincount(cells, weights=arrays["count"][start:stop], minlength=len(present) * size)
+    return np.asarray(arrays["camera_ids"])[present], counts.astype(np.int64).reshape(len(present), size)
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the violation tables to a memory-mapped columnar store.")
+    parser.add_argument("--db", default=api.DATABASE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = export(args.db)
+    print(f"Exported {', '.join(f'{kind} {count:,} rows' for kind, count in rows.items())} "
+          f"to {columns_folder(args.db)} in {time.perf_counter() - start:.1f} s")
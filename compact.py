@@ -0,0 +1,227 @@
+
+# Description:
+#   Migrates the violation tables to a compact layout. migrate() rewrites RedViolations
+#   and SpeedViolations as WITHOUT ROWID tables (RedViolationDays, SpeedViolationDays)
+#   keyed and clustered on (Camera_ID, Day), where Day is an integer number of days since
+#   1970-01-01 rather than ISO text, so a camera's rows sit together on disk and the
+#   table needs no separate rowid or camera index. A covering (Day, Num_Violations) index
+#   serves the lookups by date. Rows for the same camera and date are merged (summed, as
+#   every query already did) and dates are normalized to YYYY-MM-DD on the way.
+#
+#   RedViolations and SpeedViolations become views over the new tables with the old
+#   columns, with INSTEAD OF triggers for INSERT, UPDATE and DELETE, so existing queries
+#   and scripts keep working. The code that looks up raw rows by date (command 3, the
+#   print_stats totals, the rollup refresh and ingest.py) uses the Day column directly;
+#   everything else already reads the rollups.
+#
+#   python compact.py [--db FILE] [--runs 5] [--no-bench]
+#   prints the file size before and after (both VACUUMed, with the indexes and rollups
+#   api.open_database builds) and, unless --no-bench, the bench.py timings of print_stats
+#   and commands 1-9 before and after.
+
+import os
+
+import queries
+
+EPOCH_JULIAN_DAY = 2440587.5  # julianday('1970-01-01')
+
+# SQL for a day number as ISO text and for ISO text (or any date SQLite understands) as a
+# day number
+DATE = "date({day} + " + str(EPOCH_JULIAN_DAY) + ")"
+DAY = "CAST(julianday({date}) - " + str(EPOCH_JULIAN_DAY) + " AS INTEGER)"
+
+COMPACT_TABLE = """
+    CREATE TABLE {days} (
+        Camera_ID INTEGER NOT NULL, Day INTEGER NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Camera_ID, Day)) WITHOUT ROWID;
+    INSERT INTO {days} (Camera_ID, Day, Num_Violations)
+        SELECT Camera_ID, """ + DAY.format(date="Violation_Date") + """ AS Day, SUM(Num_Violations)
+        FROM {violations}
+        GROUP BY Camera_ID, Day
+        ORDER BY Camera_ID, Day;
+    DROP TABLE {violations};
+    CREATE INDEX idx_{index}_day ON {days} (Day, Num_Violations);
+"""
+
+# The old table as a view, writable through triggers. An insert for a camera and date
+# that already has a row adds to it, as a second row would have before.
+COMPATIBILITY_VIEW = """
+    CREATE VIEW {violations} (Camera_ID, Violation_Date, Num_Violations) AS
+        SELECT Camera_ID, """ + DATE.format(day="Day") + """, Num_Violations FROM {days};
+    CREATE TRIGGER {violations}_insert INSTEAD OF INSERT ON {violations}
+    BEGIN
+        INSERT INTO {days} (Camera_ID, Day, Num_Violations)
+            VALUES (NEW.Camera_ID, """ + DAY.format(date="NEW.Violation_Date") + """, NEW.Num_Violations)
+            ON CONFLICT (Camera_ID, Day) DO UPDATE SET Num_Violations = Num_Violations + excluded.Num_Violations;
+    END;
+    CREATE TRIGGER {violations}_update INSTEAD OF UPDATE ON {violations}
+    BEGIN
+        UPDATE {days}
+            SET Camera_ID = NEW.Camera_ID, Day = """ + DAY.format(date="NEW.Violation_Date") + """,
+                Num_Violations = NEW.Num_Violations
+            WHERE Camera_ID = OLD.Camera_ID AND Day = """ + DAY.format(date="OLD.Violation_Date") + """;
+    END;
+    CREATE TRIGGER {violations}_delete INSTEAD OF DELETE ON {violations}
+    BEGIN
+        DELETE FROM {days} WHERE Camera_ID = OLD.Camera_ID AND Day = """ + DAY.format(date="OLD.Violation_Date") + """;
+    END;
+"""
+
+# rollups.VIOLATION_TRIGGERS on the new tables
+DIRTY_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS rollup_{days}_insert AFTER INSERT ON {days}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', """ + DATE.format(day="NEW.Day") + """);
+    END;
+    CREATE TRIGGER IF NOT EXISTS rollup_{days}_delete AFTER DELETE ON {days}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', """ + DATE.format(day="OLD.Day") + """);
+    END;
+    CREATE TRIGGER IF NOT EXISTS rollup_{days}_update AFTER UPDATE ON {days}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', """ + DATE.format(day="OLD.Day") + """);
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', """ + DATE.format(day="NEW.Day") + """);
+    END;
+"""
+
+# rollups.CAMERA_DAY_REFRESH on the new tables: each dirty date is looked up by its day
+# number in the Day index
+CAMERA_DAY_REFRESH = """
+    INSERT INTO Rollup_Camera_Day (Kind, Day, Camera_ID, Num_Violations)
+    SELECT ?, Rollup_Dirty.Day, {days}.Camera_ID, SUM({days}.Num_Violations)
+    FROM Rollup_Dirty
+    JOIN {days} ON {days}.Day = """ + DAY.format(date="Rollup_Dirty.Day") + """
+    WHERE Rollup_Dirty.Kind = ?
+    GROUP BY Rollup_Dirty.Day, {days}.Camera_ID"""
+
+# Command 3 and print_stats on the new tables
+# Parameters: (date)
+DATE_TOTAL = "SELECT SUM(Num_Violations) FROM {days} WHERE Day = " + DAY.format(date="?")
+DATE_RANGE = ("SELECT (SELECT " + DATE.format(day="MIN(Day)") + " FROM {days}), "
+              "(SELECT " + DATE.format(day="MAX(Day)") + " FROM {days})")
+TOTALS = ("SELECT COUNT(*), " + DATE.format(day="MIN(Day)") + ", " + DATE.format(day="MAX(Day)")
+          + ", SUM(Num_Violations) FROM {days}")
+
+##################################################################
+# days_table
+# Name of the compact table for a violation table, e.g. RedViolationDays.
+def days_table(violations):
+    return violations[:-1] + "Days"
+
+##################################################################
+# compact_table
+# Given connection to database and a violation table, returns the name of its compact
+# table if the database has been migrated, or None.
+def compact_table(dbConn, violations):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (violations,))
+    row = dbCursor.fetchone()
+    return days_table(violations) if row and row[0] == "view" else None
+
+##################################################################
+# upsert_sql
+# ingest.upsert_sql for a migrated violation table: the same two statements with the
+# same parameters (the date given as text), written against the compact table.
+def upsert_sql(violations):
+    days = days_table(violations)
+    day = DAY.format(date="?")
+    update = (f"UPDATE {days} SET Num_Violations = ? "
+              f"WHERE Camera_ID = ? AND Day = {day} AND (Num_Violations IS NOT ?)")
+    insert = (f"INSERT INTO {days} (Camera_ID, Day, Num_Violations) SELECT ?, {day}, ? "
+              f"WHERE NOT EXISTS (SELECT 1 FROM {days} WHERE Camera_ID = ? AND Day = {day})")
+    return update, insert
+
+##################################################################
+# file_size
+# Size in bytes of a database file and its -wal file.
+def file_size(path):
+    return sum(os.path.getsize(name) for name in (path, path + "-wal") if os.path.exists(name))
+
+##################################################################
+# migrate
+# Rewrites the violation tables of the database at path in the compact layout (tables
+# already migrated are left alone), then VACUUMs it. Raises RuntimeError, changing
+# nothing, if any row's date can't be read as a date. Returns {table: (rows before,
+# rows after)}.
+def migrate(path):
+    import api  # api.py imports this module
+
+    dbConn = api.open_database(path) # Brings the rollups up to date first
+    dbCursor = dbConn.cursor()
+    tables = {kind: violations for kind, (violations, cameras) in queries.TABLES.items()
+              if not compact_table(dbConn, violations)}
+
+    counts = {}
+    for violations in tables.values():
+        dbCursor.execute(f"SELECT COUNT(*), SUM({DAY.format(date='Violation_Date')} IS NULL) FROM {violations}")
+        rows, bad = dbCursor.fetchone()
+        if bad:
+            dbConn.close()
+            raise RuntimeError(f"{violations} has {bad:,} rows without a valid date; fix or remove them first")
+        counts[violations] = rows
+
+    # Dates stored in another form (e.g. with a time) are rebuilt in the rollups under
+    # their normalized form
+    script = "BEGIN IMMEDIATE;"
+    for kind, violations in tables.items():
+        script += f"""
+            INSERT OR IGNORE INTO Rollup_Dirty
+                SELECT DISTINCT '{kind}', Violation_Date FROM {violations}
+                WHERE Violation_Date IS NOT {DATE.format(day=DAY.format(date='Violation_Date'))};"""
+        script += f"""
+            INSERT OR IGNORE INTO Rollup_Dirty
+                SELECT DISTINCT '{kind}', {DATE.format(day=DAY.format(date='Violation_Date'))} FROM {violations}
+                WHERE Violation_Date IS NOT {DATE.format(day=DAY.format(date='Violation_Date'))};"""
+        arguments = {"violations": violations, "days": days_table(violations), "index": days_table(violations).lower(),
+                     "kind": kind}
+        script += COMPACT_TABLE.format(**arguments) + COMPATIBILITY_VIEW.format(**arguments)
+        script += DIRTY_TRIGGERS.format(**arguments)
+    dbCursor.executescript(script + "COMMIT;")
+
+    import rollups
+
+    rollups.refresh(dbConn)
+    dbCursor.execute("ANALYZE")
+    dbConn.commit()
+    dbCursor.execute("VACUUM")
+
+    result = {}
+    for violations, rows in counts.items():
+        dbCursor.execute(f"SELECT COUNT(*) FROM {days_table(violations)}")
+        result[violations] = (rows, dbCursor.fetchone()[0])
+    dbConn.close()
+    return result
+
+# main
+if __name__ == "__main__":
+    import argparse  # Only the command line needs these
+    import time
+
+    import api
+    import bench
+
+    parser = argparse.ArgumentParser(description="Rewrite the violation tables as clustered WITHOUT ROWID tables.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--runs", type=int, default=5, help="bench.py runs per command (default: %(default)s)")
+    parser.add_argument("--no-bench", action="store_true", help="skip timing the commands before and after")
+    args = parser.parse_args()
+
+    # The size before is measured like the size after: once open_database has built the
+    # indexes and rollups, and VACUUMed
+    dbConn = api.open_database(args.db)
+    dbConn.execute("VACUUM")
+    dbConn.close()
+    size = file_size(args.db)
+    before = None if args.no_bench else bench.benchmark(args.db, args.runs)
+    start = time.perf_counter()
+    try:
+        migrated = migrate(args.db)
+    except RuntimeError as error:
+        parser.exit(1, f"{error}\n")
+    elapsed = time.perf_counter() - start
+
+    for violations, (rows, merged) in migrated.items():
+        print(f"{violations}: {rows:,} rows -> {days_table(violations)}: {merged:,} rows")
+    print(f"Migrated in {elapsed:.1f} s; file size {size / 1e6:,.1f} MB -> {file_size(args.db) / 1e6:,.1f} MB")
+    if before is not None:
+        bench.report(bench.benchmark(args.db, args.runs), before)
@@ -0,0 +1,160 @@
+
+# Description:
+#   Builds synthetic databases with the same tables and columns as the downloaded
+#   chicago-traffic-cameras.db, for testing and benchmarking without the real data. The
+#   size is given as a multiple of a small base database (40 intersections, 36 red light
+#   and 18 speed cameras, one year of days from 2014-01-01): --scale 10 gives 10 times
+#   the cameras and 10 times the days (so 100 times the violation rows), or the two can
+#   be scaled separately with --camera-scale and --day-scale. The same seed always gives
+#   the same database.
+#
+#   python generate_db.py --out test.db [--scale 1|10|100] [--camera-scale N] [--day-scale N] [--seed N]
+#
+#   Like the download, the result has no indexes or summary tables; the program builds
+#   them the first time it opens the database (pass --prepare to do it here instead).
+
+import argparse
+import datetime
+import os
+import random
+import sqlite3
+import time
+
+import api
+import ingest
+import queries
+
+BASE_INTERSECTIONS = 40
+BASE_CAMERAS = {"red": 36, "speed": 18}
+BASE_DAYS = 365
+START_DATE = datetime.date(2014, 1, 1)
+
+STREETS = ["ASHLAND", "WESTERN", "PULASKI", "CICERO", "HALSTED", "STATE", "MADISON", "IRVING PARK",
+           "FULLERTON", "BELMONT", "DIVISION", "CHICAGO", "ROOSEVELT", "CERMAK", "KEDZIE", "CALIFORNIA",
+           "DAMEN", "LAKE SHORE", "NORTH", "ARMITAGE", "LAWRENCE", "FOSTER", "DEVON", "PETERSON",
+           "79TH", "87TH", "95TH", "103RD", "GARFIELD", "ARCHER", "STONY ISLAND", "COTTAGE GROVE"]
+DIRECTIONS = ["N", "S", "E", "W"]
+
+# Map area used for camera coordinates (same bounds as the command 9 map)
+MIN_LAT, MAX_LAT = 41.7012, 42.0868
+MIN_LON, MAX_LON = -87.9277, -87.5569
+
+# Typical daily violations per camera: (low, high) of each camera's average
+DAILY_AVERAGE = {"red": (2, 30), "speed": (5, 80)}
+
+##################################################################
+# make_intersections
+# Returns rows of (Intersection_ID, Intersection, (street, street)).
+def make_intersections(rng, count):
+    rows = []
+    for intersection_id in range(1, count + 1):
+        streets = rng.sample(STREETS, 2)
+        rows.append((intersection_id, f"{streets[0]} AND {streets[1]}", streets))
+    return rows
+
+##################################################################
+# make_cameras
+# Returns rows of (Camera_ID, Intersection_ID, Address, Latitude, Longitude) for one camera
+# type, each camera on one of the streets of its intersection. IDs start at first_id.
+def make_cameras(rng, count, intersections, first_id):
+    rows = []
+    for camera_id in range(first_id, first_id + count):
+        intersection_id, name, streets = rng.choice(intersections)
+        address = f"{rng.randint(1, 12000)} {rng.choice(DIRECTIONS)} {rng.choice(streets)} AVE"
+        rows.append((camera_id, intersection_id, address,
+                     round(rng.uniform(MIN_LAT, MAX_LAT), 6), round(rng.uniform(MIN_LON, MAX_LON), 6)))
+    return rows
+
+##################################################################
+# make_violations
+# Yields (Camera_ID, Violation_Date, Num_Violations) rows for cameras of one type over the
+# given number of days. Most cameras report from the first day, some start later or stop
+# early, counts follow a weekly and yearly pattern, and days without violations have no row.
+def make_violations(rng, kind, cameras, days):
+    dates = [(START_DATE + datetime.timedelta(days=day)).isoformat() for day in range(days)]
+    seasons = [1 + 0.25 * ((START_DATE + datetime.timedelta(days=day)).month in (5, 6, 7, 8, 9)) for day in range(days)]
+    weekdays = [0.8 if (START_DATE + datetime.timedelta(days=day)).weekday() >= 5 else 1.05 for day in range(days)]
+    for camera in cameras:
+        average = rng.uniform(*DAILY_AVERAGE[kind])
+        first = 0 if rng.random() < 0.7 else rng.randrange(days)
+        last = days if rng.random() < 0.9 else rng.randrange(first, days) + 1
+        for day in range(first, last):
+            if rng.random() < 0.03:
+                continue  # Camera down for the day
+            count = round(rng.gauss(average * seasons[day] * weekdays[day], average ** 0.5))
+            if count > 0:
+                yield (camera[0], dates[day], count)
+
+##################################################################
+# batches
+# Splits an iterable of rows into lists of at most size rows.
+def batches(rows, size=50000):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+##################################################################
+# generate
+# Creates the database at path (replacing any existing file) with the given camera and
+# day scales. Returns {table: rows}.
+def generate(path, camera_scale=1, day_scale=1, seed=341):
+    for suffix in ("", "-wal", "-shm", "-journal", "-meta"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    rng = random.Random(seed)
+    dbConn = sqlite3.connect(path)
+    dbConn.execute("PRAGMA journal_mode = OFF")
+    dbConn.execute("PRAGMA synchronous = OFF")
+    dbConn.executescript(ingest.SCHEMA)
+    dbCursor = dbConn.cursor()
+
+    intersections = make_intersections(rng, BASE_INTERSECTIONS * camera_scale)
+    dbCursor.executemany("INSERT INTO Intersections VALUES (?, ?)", [row[:2] for row in intersections])
+
+    counts = {"Intersections": len(intersections)}
+    days = BASE_DAYS * day_scale
+    first_id = 1001
+    for kind, (violations, cameras) in queries.TABLES.items():
+        rows = make_cameras(rng, BASE_CAMERAS[kind] * camera_scale, intersections, first_id)
+        first_id += len(rows)
+        dbCursor.executemany(f"INSERT INTO {cameras} VALUES (?, ?, ?, ?, ?)", rows)
+        counts[cameras] = len(rows)
+
+        counts[violations] = 0
+        for batch in batches(make_violations(rng, kind, rows, days)):
+            dbCursor.executemany(f"INSERT INTO {violations} VALUES (?, ?, ?)", batch)
+            counts[violations] += len(batch)
+    dbConn.commit()
+    dbConn.close()
+    return counts
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic traffic camera database.")
+    parser.add_argument("--out", required=True, help="database file to create (replaced if it exists)")
+    parser.add_argument("--scale", type=int, default=1, help="multiple of the base cameras and days (default: %(default)s)")
+    parser.add_argument("--camera-scale", type=int, help="multiple of the base cameras (default: --scale)")
+    parser.add_argument("--day-scale", type=int, help="multiple of the base days (default: --scale)")
+    parser.add_argument("--seed", type=int, default=341)
+    parser.add_argument("--prepare", action="store_true", help="build the indexes and summary tables as well")
+    args = parser.parse_args()
+
+    camera_scale = args.camera_scale or args.scale
+    day_scale = args.day_scale or args.scale
+
+    start = time.perf_counter()
+    counts = generate(args.out, camera_scale, day_scale, args.seed)
+    for table, rows in counts.items():
+        print(f"{table}: {rows:,} rows")
+    print(f"Generated {args.out} (cameras x{camera_scale}, days x{day_scale}) in {time.perf_counter() - start:.1f} s")
+
+    if args.prepare:
+        start = time.perf_counter()
+        api.open_database(args.out).close()
+        print(f"Built indexes and summary tables in {time.perf_counter() - start:.1f} s")
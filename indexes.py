@@ -0,0 +1,101 @@
+
+# Description:
+#   Creates the composite indexes the violation queries rely on and checks, with
+#   EXPLAIN QUERY PLAN, that none of the command queries (or the rollup refresh that
+#   reads the raw violations) scan a whole violation table.
+#   Run directly (python indexes.py [database]) to check a database; exits with 1 if any
+#   command query falls back to a full table scan.
+
+import sqlite3
+import sys
+
+import queries
+import rollups
+
+# (index name, table, columns)
+INDEXES = [
+    ("idx_redviolations_date_camera", "RedViolations", "Violation_Date, Camera_ID"),
+    ("idx_redviolations_camera_date", "RedViolations", "Camera_ID, Violation_Date"),
+    ("idx_speedviolations_date_camera", "SpeedViolations", "Violation_Date, Camera_ID"),
+    ("idx_speedviolations_camera_date", "SpeedViolations", "Camera_ID, Violation_Date"),
+    ("idx_redcameras_intersection", "RedCameras", "Intersection_ID"),
+    ("idx_speedcameras_intersection", "SpeedCameras", "Intersection_ID"),
+    ("idx_rollup_camera_year_year", "Rollup_Camera_Year", "Kind, Year, Num_Violations"),  # Covers the year totals
+    ("idx_rollup_camera_month_year", "Rollup_Camera_Month",
+     "Kind, Year, Month, Camera_ID, Num_Violations"),  # Covers the audit's months of every camera
+]
+
+# Tables that must never be read with a full scan, or with a search on Kind alone (which
+# reads every row of a camera type)
+VIOLATION_TABLES = ("RedViolations", "SpeedViolations", "RedViolationDays", "SpeedViolationDays", "Rollup_Day",
+                    "Rollup_Camera_Day", "Rollup_Camera_Month", "Rollup_Camera_Year", "Rollup_Intersection_Day",
+                    "Rollup_Intersection_Month", "Rollup_Intersection_Year")
+
+##################################################################
+# ensure_indexes
+# Given connection to database, checks that every index in INDEXES exists and creates
+# any that are missing. Returns the names of the indexes that were created. Tables that
+# don't exist yet are skipped (rollups.create builds the rollup tables' indexes with them),
+# as are those compact.py has turned into views, whose compact tables have their own keys.
+def ensure_indexes(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existing = {row[0] for row in dbCursor.fetchall()}
+    dbCursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in dbCursor.fetchall()}
+
+    created = []
+    for name, table, columns in INDEXES:
+        if name not in existing and table in tables:
+            dbCursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+            created.append(name)
+
+    if created:
+        dbCursor.execute("ANALYZE")
+        dbConn.commit()
+    return created
+
+##################################################################
+# full_scans
+# Given connection and a query with parameters, runs EXPLAIN QUERY PLAN and returns the
+# plan lines that scan a violation table (or all of one of its indexes) instead of searching
+# it, or that search a rollup table by Kind alone.
+def full_scans(dbConn, sql, params):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+
+    scans = []
+    for row in dbCursor.fetchall():
+        detail = row[-1]
+        for table in VIOLATION_TABLES:
+            if detail == f"SCAN {table}" or detail.startswith(f"SCAN {table} "):
+                scans.append(detail)
+            elif detail.startswith(f"SEARCH {table} ") and detail.endswith("(Kind=?)"):
+                scans.append(detail)
+    return scans
+
+##################################################################
+# check_query_plans
+# Given connection to database, checks the plan of every date-based command query and of
+# the rollup refresh. Returns a list of (label, plan line) for each query that does a
+# full table scan.
+def check_query_plans(dbConn):
+    failures = []
+    for label, sql, params in queries.command_queries() + rollups.refresh_queries(dbConn):
+        for detail in full_scans(dbConn, sql, params):
+            failures.append((label, detail))
+    return failures
+
+# main
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "chicago-traffic-cameras.db"
+    dbConn = sqlite3.connect(path)
+    ensure_indexes(dbConn)
+    rollups.refresh(dbConn)
+
+    failures = check_query_plans(dbConn)
+    for label, detail in failures:
+        print(f"FULL SCAN in {label}: {detail}")
+    if failures:
+        sys.exit(1)
+    print("All command queries use an index.")
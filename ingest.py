@@ -0,0 +1,276 @@
+
+# Description:
+#   Loads CSV exports of intersections, cameras and violations into the database. Files
+#   are streamed a batch at a time (constant memory) and written with executemany inside
+#   large transactions, with the database in WAL mode so the menu and other readers keep
+#   working while an ingest runs. Rows are upserted on their key (Intersection_ID,
+#   Camera_ID, or Camera_ID + Violation_Date), so ingesting the same file twice doesn't
+#   duplicate anything and only rows whose values changed are rewritten. A key that
+#   appears more than once keeps the value from its last row. Violations for a year
+#   already moved to a shard file (see shards.py) are upserted into that shard, so they
+#   replace the rows there rather than being added beside them. Throughput is
+#   reported in rows per second.
+#
+#   python ingest.py [--db FILE] [--intersections CSV] [--red-cameras CSV] [--speed-cameras CSV]
+#                    [--red-violations CSV] [--speed-violations CSV]
+#
+#   Column headers are matched without regard to case, spaces or underscores, so both
+#   the database names (Camera_ID, Violation_Date, Num_Violations) and the city data
+#   portal names (CAMERA ID, VIOLATION DATE, VIOLATIONS) work. Dates may be YYYY-MM-DD or
+#   MM/DD/YYYY.
+
+import argparse
+import csv
+import datetime
+import sqlite3
+import time
+
+import api
+import compact
+import indexes
+import queries
+import rollups
+import shards
+
+# Schema used when the database (or one of its tables) doesn't exist yet
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS Intersections (
+        Intersection_ID INTEGER PRIMARY KEY, Intersection TEXT);
+    CREATE TABLE IF NOT EXISTS RedCameras (
+        Camera_ID INTEGER PRIMARY KEY, Intersection_ID INTEGER, Address TEXT, Latitude REAL, Longitude REAL);
+    CREATE TABLE IF NOT EXISTS SpeedCameras (
+        Camera_ID INTEGER PRIMARY KEY, Intersection_ID INTEGER, Address TEXT, Latitude REAL, Longitude REAL);
+    CREATE TABLE IF NOT EXISTS RedViolations (
+        Camera_ID INTEGER, Violation_Date TEXT, Num_Violations INTEGER);
+    CREATE TABLE IF NOT EXISTS SpeedViolations (
+        Camera_ID INTEGER, Violation_Date TEXT, Num_Violations INTEGER);
+"""
+
+# Source name -> (table, key columns, value columns), in the order they are loaded
+SOURCES = {
+    "intersections": ("Intersections", ["Intersection_ID"], ["Intersection"]),
+    "red-cameras": ("RedCameras", ["Camera_ID"], ["Intersection_ID", "Address", "Latitude", "Longitude"]),
+    "speed-cameras": ("SpeedCameras", ["Camera_ID"], ["Intersection_ID", "Address", "Latitude", "Longitude"]),
+    "red-violations": ("RedViolations", ["Camera_ID", "Violation_Date"], ["Num_Violations"]),
+    "speed-violations": ("SpeedViolations", ["Camera_ID", "Violation_Date"], ["Num_Violations"]),
+}
+
+# Other names the city data portal uses for the same columns
+ALIASES = {"violations": "num_violations"}
+
+# Records the days a batch changes in a shard's violation table, so they can be marked
+# dirty in the main file's Rollup_Dirty (whose triggers can't see the shard). Temporary,
+# so the shard file itself is left as split() made it.
+SHARD_DIRTY = """
+    CREATE TEMP TABLE IF NOT EXISTS Shard_Dirty (Day TEXT PRIMARY KEY) WITHOUT ROWID;
+    CREATE TEMP TRIGGER IF NOT EXISTS shard_{violations}_insert AFTER INSERT ON main.{violations}
+    BEGIN
+        INSERT OR IGNORE INTO Shard_Dirty VALUES (NEW.Violation_Date);
+    END;
+    CREATE TEMP TRIGGER IF NOT EXISTS shard_{violations}_update AFTER UPDATE ON main.{violations}
+    BEGIN
+        INSERT OR IGNORE INTO Shard_Dirty VALUES (NEW.Violation_Date);
+    END;
+"""
+
+##################################################################
+# header_key
+# Normalizes a column header so "CAMERA ID", "Camera_ID" and "camera id" all match.
+def header_key(name):
+    key = name.strip().lower().replace(" ", "_")
+    return ALIASES.get(key, key)
+
+##################################################################
+# convert
+# Converts one CSV value for a column: dates to YYYY-MM-DD, counts to integers,
+# coordinates to floats and empty strings to NULL.
+def convert(column, value):
+    value = value.strip()
+    if value == "":
+        return None
+    if column == "Violation_Date":
+        if "/" in value:
+            return datetime.datetime.strptime(value.split()[0], "%m/%d/%Y").date().isoformat()
+        return value[:10]
+    if column == "Num_Violations":
+        return int(float(value))
+    if column in ("Latitude", "Longitude"):
+        return float(value)
+    return value
+
+##################################################################
+# read_batches
+# Streams a CSV file and yields lists of at most batch_size rows, each row a tuple of
+# the given columns in order.
+def read_batches(path, columns, batch_size):
+    with open(path, newline="") as file:
+        reader = csv.reader(file)
+        header = [header_key(name) for name in next(reader)]
+        missing = [column for column in columns if column.lower() not in header]
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+        positions = [header.index(column.lower()) for column in columns]
+
+        batch = []
+        for record in reader:
+            if not record:
+                continue
+            batch.append(tuple(convert(column, record[position]) for column, position in zip(columns, positions)))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+##################################################################
+# upsert_sql
+# Builds the two statements of an upsert: an UPDATE of existing rows whose values
+# changed, then an INSERT of rows whose key isn't in the table yet. This works whether
+# or not the table has a unique constraint on its key.
+def upsert_sql(table, keys, values):
+    key_match = " AND ".join(f"{key} = ?" for key in keys)
+    changed = " OR ".join(f"{value} IS NOT ?" for value in values)
+    update = (f"UPDATE {table} SET {', '.join(f'{value} = ?' for value in values)} "
+              f"WHERE {key_match} AND ({changed})")
+    columns = keys + values
+    insert = (f"INSERT INTO {table} ({', '.join(columns)}) "
+              f"SELECT {', '.join('?' for column in columns)} "
+              f"WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE {key_match})")
+    return update, insert
+
+##################################################################
+# last_per_key
+# Given a batch of rows read as (keys..., values...), keeps only the last row for each key,
+# so a key repeated within a batch ends with the same value as one repeated across batches.
+def last_per_key(batch, key_count):
+    return list({row[:key_count]: row for row in batch}.values())
+
+##################################################################
+# upsert
+# Runs the statements from upsert_sql (or compact.upsert_sql) for a batch of rows read
+# as (keys..., values...).
+def upsert(dbCursor, statements, keys, batch):
+    update, insert = statements
+    dbCursor.executemany(update, [row[len(keys):] + row[:len(keys)] + row[len(keys):] for row in batch])
+    dbCursor.executemany(insert, [row + row[:len(keys)] for row in batch])
+
+##################################################################
+# upsert_shards
+# Upserts the violations in a batch whose year is in a shard ({year: file}) into that
+# shard, opening it on first use (shardConns holds the connections opened so far), and
+# marks the days they changed dirty in the main file. Returns the rest of the batch.
+def upsert_shards(dbConn, table, batch, sharded, shardConns):
+    kind = next(kind for kind, (violations, cameras) in queries.TABLES.items() if violations == table)
+    keys, values = SOURCES[f"{kind}-violations"][1:]
+    rest = []
+    by_year = {}
+    for row in batch:
+        year = row[1][:4] if row[1] else None  # Rows are (Camera_ID, Violation_Date, Num_Violations)
+        if year in sharded:
+            by_year.setdefault(year, []).append(row)
+        else:
+            rest.append(row)
+
+    for year, rows in by_year.items():
+        if year not in shardConns:
+            shardConns[year] = sqlite3.connect(sharded[year])
+            shardConns[year].executescript(SHARD_DIRTY.format(violations=table))
+        shardCursor = shardConns[year].cursor()
+        upsert(shardCursor, upsert_sql(table, keys, values), keys, rows)
+        shardCursor.execute("SELECT Day FROM Shard_Dirty")
+        dbConn.executemany("INSERT OR IGNORE INTO Rollup_Dirty VALUES (?, ?)",
+                           [(kind, day) for day, in shardCursor.fetchall()])
+        shardCursor.execute("DELETE FROM Shard_Dirty")
+    return rest
+
+##################################################################
+# ingest_file
+# Loads one CSV file into its table, committing every commit_every rows. Returns
+# (rows read, seconds taken).
+def ingest_file(dbConn, source, path, batch_size, commit_every):
+    table, keys, values = SOURCES[source]
+    if compact.compact_table(dbConn, table):
+        statements = compact.upsert_sql(table) # Migrated by compact.py; write the compact table directly
+    else:
+        statements = upsert_sql(table, keys, values)
+    sharded = shards.of_connection(dbConn) if "Violation_Date" in keys else {}
+    shardConns = {}
+    dbCursor = dbConn.cursor()
+
+    # The main file commits first: if the shards' commits then fail, their days are only
+    # rebuilt from the rows they already had
+    def commit():
+        dbConn.commit()
+        for shardConn in shardConns.values():
+            shardConn.commit()
+
+    start = time.perf_counter()
+    rows = 0
+    uncommitted = 0
+    try:
+        for batch in read_batches(path, keys + values, batch_size):
+            rows += len(batch)
+            uncommitted += len(batch)
+            batch = last_per_key(batch, len(keys))
+            if sharded:
+                batch = upsert_shards(dbConn, table, batch, sharded, shardConns)
+            upsert(dbCursor, statements, keys, batch)
+            if uncommitted >= commit_every:
+                commit()
+                uncommitted = 0
+                elapsed = time.perf_counter() - start
+                print(f"  {table}: {rows:,} rows ({rows / elapsed:,.0f} rows/sec)")
+        commit()
+    finally:
+        for shardConn in shardConns.values():
+            shardConn.close()
+    return rows, time.perf_counter() - start
+
+##################################################################
+# open_for_ingest
+# Opens (or creates) the database in WAL mode so readers aren't blocked by the load, and
+# makes sure the tables and the indexes the upserts search by exist.
+def open_for_ingest(path):
+    dbConn = sqlite3.connect(path)
+    dbConn.execute("PRAGMA journal_mode = WAL")
+    dbConn.execute("PRAGMA synchronous = NORMAL")
+    dbConn.executescript(SCHEMA)
+    indexes.ensure_indexes(dbConn)
+    rollups.refresh(dbConn) # Creates the rollups and their triggers before any new rows arrive
+    return dbConn
+
+##################################################################
+# ingest
+# Loads each given source file ({source name: path}) in dependency order, then brings the
+# rollup tables up to date. Returns {source name: (rows, seconds)}.
+def ingest(dbConn, files, batch_size=10000, commit_every=500000):
+    results = {}
+    for source in SOURCES:
+        if files.get(source):
+            results[source] = ingest_file(dbConn, source, files[source], batch_size, commit_every)
+    rollups.refresh(dbConn)
+    return results
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load CSV exports into the traffic camera database.")
+    parser.add_argument("--db", default=api.DATABASE)
+    for source in SOURCES:
+        parser.add_argument(f"--{source}", metavar="CSV")
+    parser.add_argument("--batch-size", type=int, default=10000, help="rows per executemany (default: %(default)s)")
+    parser.add_argument("--commit-every", type=int, default=500000, help="rows per transaction (default: %(default)s)")
+    args = parser.parse_args()
+
+    files = {source: getattr(args, source.replace("-", "_")) for source in SOURCES}
+    if not any(files.values()):
+        parser.error("give at least one CSV file to load")
+
+    dbConn = open_for_ingest(args.db)
+    results = ingest(dbConn, files, args.batch_size, args.commit_every)
+    dbConn.close()
+
+    total_rows = sum(rows for rows, seconds in results.values())
+    total_seconds = sum(seconds for rows, seconds in results.values())
+    for source, (rows, seconds) in results.items():
+        print(f"{source}: {rows:,} rows in {seconds:.2f} s ({rows / max(seconds, 1e-9):,.0f} rows/sec)")
+    print(f"Total: {total_rows:,} rows in {total_seconds:.2f} s ({total_rows / max(total_seconds, 1e-9):,.0f} rows/sec)")
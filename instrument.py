@@ -0,0 +1,296 @@
+
+# Description:
+#   Optional per-statement instrumentation of the SQL run by print_stats and the menu
+#   commands. When it is on, connections are opened with InstrumentedConnection, whose
+#   cursors time every execute (including fetching its rows) and count the rows returned;
+#   a progress handler counts the SQLite virtual machine steps each statement takes and
+#   the trace callback records the statement with its parameters filled in (the handler
+#   also does cancel.check()'s work, a connection having only one). At the end of
+#   each command, statements slower than the threshold are written to the log file with
+#   their EXPLAIN QUERY PLAN, and summary() reports the totals per command.
+#
+#   Turn it on with enable(log_path, slow_ms) before opening the database, or for the
+#   menu by setting TRAFFIC_QUERY_LOG=<file> (and optionally TRAFFIC_SLOW_MS, default 100,
+#   0 to log every statement). When it is off connections are plain sqlite3 connections
+#   and commands only pay for one flag check.
+
+import contextlib
+import datetime
+import functools
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import cancel
+import parallel
+
+ENABLED = False
+SLOW_MS = 100.0
+LOG_PATH = None
+
+PROGRESS_STEPS = 100  # The progress handler runs every this many virtual machine steps
+
+_local = threading.local()
+_plans = {}  # SQL -> EXPLAIN QUERY PLAN lines
+_summary = {}  # command -> totals
+
+##################################################################
+# Statement
+# Measurements of one execute call.
+class Statement:
+    __slots__ = ("sql", "parameters", "expanded", "seconds", "rows", "steps")
+
+    def __init__(self, sql, parameters):
+        self.sql = sql
+        self.parameters = parameters
+        self.expanded = None
+        self.seconds = 0.0
+        self.rows = 0
+        self.steps = 0
+
+##################################################################
+# current_statements
+# The statements run so far by the command running on this thread.
+def current_statements():
+    if not hasattr(_local, "statements"):
+        _local.statements = []
+    return _local.statements
+
+##################################################################
+# InstrumentedCursor
+# Times execute and the fetches that follow it, and counts the rows they return, adding
+# them to the statement last executed on the cursor.
+class InstrumentedCursor(sqlite3.Cursor):
+    statement = None
+
+    def execute(self, sql, parameters=()):
+        self.statement = Statement(sql, parameters)
+        current_statements().append(self.statement)
+        self.connection.statement = self.statement
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.statement.seconds += time.perf_counter() - start
+
+    def executemany(self, sql, seq_of_parameters):
+        self.statement = Statement(sql, None)
+        current_statements().append(self.statement)
+        self.connection.statement = self.statement
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.statement.seconds += time.perf_counter() - start
+
+    def timed_fetch(self, fetch, *args):
+        if self.statement is None:
+            return fetch(*args)
+        self.connection.statement = self.statement
+        start = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self.statement.seconds += time.perf_counter() - start
+
+    def fetchone(self):
+        row = self.timed_fetch(super().fetchone)
+        if row is not None and self.statement is not None:
+            self.statement.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self.timed_fetch(super().fetchmany, *args)
+        if self.statement is not None:
+            self.statement.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.timed_fetch(super().fetchall)
+        if self.statement is not None:
+            self.statement.rows += len(rows)
+        return rows
+
+    def __next__(self):
+        row = self.timed_fetch(super().__next__)
+        if self.statement is not None:
+            self.statement.rows += 1
+        return row
+
+##################################################################
+# InstrumentedConnection
+# Connection whose cursors are InstrumentedCursors, with the progress handler and trace
+# callback attributing steps and expanded SQL to the statement that is running.
+class InstrumentedConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statement = None
+        self.set_progress_handler(self.count_steps, PROGRESS_STEPS)
+        self.set_trace_callback(self.trace)
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def count_steps(self):
+        if self.statement is not None:
+            self.statement.steps += PROGRESS_STEPS
+        return cancel.check(PROGRESS_STEPS, self)
+
+    def trace(self, sql):
+        if self.statement is not None and self.statement.expanded is None:
+            self.statement.expanded = sql
+
+##################################################################
+# enable
+# Turns instrumentation on for connections opened from now on. Statements taking at least
+# slow_ms milliseconds are written to log_path.
+def enable(log_path, slow_ms=100.0):
+    global ENABLED, SLOW_MS, LOG_PATH
+    ENABLED = True
+    SLOW_MS = slow_ms
+    LOG_PATH = log_path
+    # Run the red light/speed halves on the instrumented connection so they're measured too
+    parallel.WORKERS = 1
+
+##################################################################
+# enable_from_environment
+# Turns instrumentation on if TRAFFIC_QUERY_LOG is set.
+def enable_from_environment():
+    if os.environ.get("TRAFFIC_QUERY_LOG"):
+        enable(os.environ["TRAFFIC_QUERY_LOG"], float(os.environ.get("TRAFFIC_SLOW_MS", SLOW_MS)))
+
+##################################################################
+# connection_factory
+# The connection class to open databases with: InstrumentedConnection when on.
+def connection_factory():
+    return InstrumentedConnection if ENABLED else sqlite3.Connection
+
+##################################################################
+# query_plan
+# Returns the EXPLAIN QUERY PLAN lines for a statement, captured once per SQL text.
+def query_plan(dbConn, statement):
+    if statement.sql not in _plans:
+        if not statement.sql.lstrip().upper().startswith(("SELECT", "WITH")) or statement.parameters is None:
+            _plans[statement.sql] = []
+        else:
+            handler_statement, dbConn.statement = dbConn.statement, None
+            try:
+                dbCursor = sqlite3.Cursor(dbConn)
+                dbCursor.execute("EXPLAIN QUERY PLAN " + statement.sql, statement.parameters)
+                _plans[statement.sql] = [row[3] for row in dbCursor.fetchall()]
+            except sqlite3.Error as error:
+                _plans[statement.sql] = [f"(no plan: {error})"]
+            finally:
+                dbConn.statement = handler_statement
+    return _plans[statement.sql]
+
+##################################################################
+# finish_command
+# Adds a finished command's statements to the summary and logs the slow ones.
+def finish_command(name, dbConn, statements, seconds):
+    totals = _summary.setdefault(name, {"calls": 0, "statements": 0, "ms": 0.0, "sql_ms": 0.0,
+                                        "rows": 0, "steps": 0, "slowest_ms": 0.0, "slowest_sql": ""})
+    totals["calls"] += 1
+    totals["statements"] += len(statements)
+    totals["ms"] += seconds * 1000
+    slow = []
+    for statement in statements:
+        ms = statement.seconds * 1000
+        totals["sql_ms"] += ms
+        totals["rows"] += statement.rows
+        totals["steps"] += statement.steps
+        if ms > totals["slowest_ms"]:
+            totals["slowest_ms"], totals["slowest_sql"] = ms, " ".join(statement.sql.split())
+        if ms >= SLOW_MS:
+            slow.append(statement)
+
+    if slow and LOG_PATH:
+        with open(LOG_PATH, "a") as log:
+            for statement in slow:
+                log.write(f"{datetime.datetime.now().isoformat(timespec='seconds')} {name} "
+                          f"{statement.seconds * 1000:.1f} ms, {statement.rows:,} rows, ~{statement.steps:,} steps\n")
+                log.write(f"  {' '.join((statement.expanded or statement.sql).split())}\n")
+                if dbConn is not None:
+                    for line in query_plan(dbConn, statement):
+                        log.write(f"    {line}\n")
+
+##################################################################
+# command
+# Context manager around one run of a command: when instrumentation is on, collects the
+# statements run inside it and records them under name. Time spent in an input function
+# wrapped with timed_input (the user typing) while it runs is left out of its time.
+@contextlib.contextmanager
+def command(name, dbConn):
+    if not ENABLED:
+        yield
+        return
+
+    outer, _local.statements = current_statements(), []
+    outer_waited, _local.waited = getattr(_local, "waited", None), [0.0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        waited = _local.waited[0]
+        seconds = time.perf_counter() - start - waited
+        statements, _local.statements = _local.statements, outer
+        _local.waited = outer_waited
+        if outer_waited is not None:
+            outer_waited[0] += waited  # A command run inside another doesn't count the wait either
+        finish_command(name, dbConn if isinstance(dbConn, InstrumentedConnection) else None, statements, seconds)
+
+##################################################################
+# timed
+# Decorator for print_stats and the menu commands, which take the connection as their
+# first argument or use their module's dbConn.
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return function(*args, **kwargs)
+        with command(function.__name__, args[0] if args else function.__globals__.get("dbConn")):
+            return function(*args, **kwargs)
+    return wrapper
+
+##################################################################
+# timed_input
+# Wraps an input function (e.g. main.py's input) so the time spent in it while a command
+# runs on this thread is counted as waiting for the user rather than as the command's.
+def timed_input(prompt):
+    @functools.wraps(prompt)
+    def wrapper(*args):
+        waited = getattr(_local, "waited", None)
+        if waited is None:
+            return prompt(*args)
+        start = time.perf_counter()
+        try:
+            return prompt(*args)
+        finally:
+            waited[0] += time.perf_counter() - start
+    return wrapper
+
+##################################################################
+# summary
+# Returns the per-command totals as a report, slowest command first.
+def summary():
+    lines = [f"{'command':<20}{'calls':>6}{'stmts':>7}{'total ms':>11}{'sql ms':>10}{'rows':>10}"
+             f"{'vm steps':>12}{'slowest ms':>12}  slowest statement"]
+    for name, totals in sorted(_summary.items(), key=lambda item: -item[1]["ms"]):
+        lines.append(f"{name:<20}{totals['calls']:>6}{totals['statements']:>7}{totals['ms']:>11.1f}"
+                     f"{totals['sql_ms']:>10.1f}{totals['rows']:>10,}{totals['steps']:>12,}"
+                     f"{totals['slowest_ms']:>12.1f}  {totals['slowest_sql'][:60]}")
+    return "\n".join(lines)
+
+##################################################################
+# report
+# Writes the summary to stderr and appends it to the log file, if anything was recorded.
+def report():
+    if not _summary:
+        return
+    text = summary()
+    print(text, file=sys.stderr)
+    if LOG_PATH:
+        with open(LOG_PATH, "a") as log:
+            log.write(f"{datetime.datetime.now().isoformat(timespec='seconds')} summary\n{text}\n")
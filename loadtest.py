@@ -0,0 +1,107 @@
+
+# Description:
+#   Load test for server.py: sends a mix of endpoint requests from several client threads
+#   at once and reports requests per second and the p50/p99 latency, overall and per
+#   endpoint. Start the server first.
+#
+#   python loadtest.py [--url http://127.0.0.1:8341] [--clients 8] [--requests 500]
+#                      [--camera ID] [--year YYYY] [--paths FILE]
+#
+#   --paths gives a file with one request path per line (e.g. /violations-by-year?camera=1503)
+#   to use instead of the built-in mix.
+
+import argparse
+import concurrent.futures
+import time
+import urllib.error
+import urllib.request
+
+##################################################################
+# default_paths
+# A mix of requests covering the menu's commands.
+def default_paths(camera, year):
+    return [
+        "/stats",
+        "/intersections?name=%25ave%25",
+        "/intersection-cameras?intersection=ave",
+        f"/violations-on-date?date={year}-06-01",
+        "/cameras-per-intersection",
+        f"/violations-by-intersection?year={year}",
+        f"/violations-by-year?camera={camera}",
+        f"/violations-by-month?camera={camera}&year={year}",
+        f"/daily-violations?year={year}",
+        "/street-cameras?street=%25ave%25",
+        "/nearest-cameras?lat=41.8781&lon=-87.6298&count=5",
+    ]
+
+##################################################################
+# percentile
+# Returns the pth percentile (0-100) of a sorted list using the nearest-rank method.
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+##################################################################
+# request
+# Sends one GET request and returns (path, HTTP status, seconds taken).
+def request(url, path):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url + path) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    except urllib.error.URLError:
+        status = None
+    return path, status, time.perf_counter() - start
+
+##################################################################
+# run
+# Sends count requests, cycling through paths, from the given number of client threads.
+# Returns (list of (path, status, seconds), total seconds).
+def run(url, paths, clients, count):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=clients) as pool:
+        results = list(pool.map(lambda i: request(url, paths[i % len(paths)]), range(count)))
+    return results, time.perf_counter() - start
+
+##################################################################
+# report
+# Prints throughput, error count and latency percentiles, overall and per endpoint.
+def report(results, elapsed):
+    failed = sum(1 for path, status, seconds in results if status != 200)
+    print(f"{len(results):,} requests in {elapsed:.2f} s: {len(results) / elapsed:,.1f} requests/sec, {failed:,} not OK")
+
+    by_endpoint = {}
+    for path, status, seconds in results:
+        by_endpoint.setdefault(path.split("?")[0], []).append(seconds * 1000)
+    print(f"{'endpoint':<30}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}")
+    for endpoint, latencies in sorted(by_endpoint.items()):
+        latencies.sort()
+        print(f"{endpoint:<30}{len(latencies):>8}{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}")
+    latencies = sorted(seconds * 1000 for path, status, seconds in results)
+    print(f"{'all':<30}{len(latencies):>8}{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}")
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the traffic camera query server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8341")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent client threads (default: %(default)s)")
+    parser.add_argument("--requests", type=int, default=500, help="total requests (default: %(default)s)")
+    parser.add_argument("--camera", default="1503")
+    parser.add_argument("--year", default="2020")
+    parser.add_argument("--paths", metavar="FILE", help="file of request paths, one per line")
+    args = parser.parse_args()
+
+    if args.paths:
+        with open(args.paths) as file:
+            paths = [line.strip() for line in file if line.strip()]
+    else:
+        paths = default_paths(args.camera, args.year)
+
+    url = args.url.rstrip("/")
+    for path in paths:
+        request(url, path)  # Warm up the server's connections and page cache
+    report(*run(url, paths, args.clients, args.requests))
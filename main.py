@@ -6,43 +6,78 @@
 #   Chicago traffic camera database in an organized format and for some options the 
 #   user even has the ability to graph that information for a more visual look.
 
-import sqlite3
-import matplotlib.pyplot as plt
-from datetime import datetime
-import datetime
+import functools
+import itertools
+import os
+import sys
+import threading
+import api
+import cancel
+import charts
+import instrument
+import stats
 
 ##################################################################  
 # print_stats
-# Given connection to database, executes various SQL queries to retrieve and output basic stats.
+# Given connection to database, outputs basic stats (see stats.py for how they are computed and cached).
+@instrument.timed
 def print_stats(dbConn):
-    dbCursor = dbConn.cursor()
+    general = stats.load(dbConn) # Cached unless the database has changed
     
     print("General Statistics:")
+    print("  Number of Red Light Cameras:", f"{general['red_cameras']:,}")
+    print("  Number of Speed Cameras:", f"{general['speed_cameras']:,}")
+    print("  Number of Red Light Camera Violation Entries:", f"{general['red_entries']:,}")
+    print("  Number of Speed Camera Violation Entries:", f"{general['speed_entries']:,}")
+    print(f"  Range of Dates in the Database: {general['start_date']} - {general['end_date']}")
+    print("  Total Number of Red Light Camera Violations:", f"{general['red_violations']:,}")
+    print("  Total Number of Speed Camera Violations:", f"{general['speed_violations']:,}")
     
-    dbCursor.execute("SELECT COUNT(*) FROM RedCameras;")
-    row = dbCursor.fetchone()
-    dbCursor.execute("SELECT COUNT(*) FROM SpeedCameras;")
-    row1 = dbCursor.fetchone()
-    dbCursor.execute("SELECT COUNT(*) FROM RedViolations;")
-    row2 = dbCursor.fetchone()
-    dbCursor.execute("SELECT COUNT(*) FROM SpeedViolations;")
-    row3 = dbCursor.fetchone()
-    dbCursor.execute("SELECT MIN(Violation_Date), MAX(Violation_Date) FROM RedViolations;")
-    row4 = dbCursor.fetchone()
-    dbCursor.execute("SELECT SUM(Num_Violations) FROM RedViolations;")
-    row5 = dbCursor.fetchone()
-    dbCursor.execute("SELECT SUM(Num_Violations) FROM SpeedViolations;")
-    row6 = dbCursor.fetchone()
-    start_date = row4[0]
-    end_date = row4[1]
-    print("  Number of Red Light Cameras:", f"{row[0]:,}")
-    print("  Number of Speed Cameras:", f"{row1[0]:,}")
-    print("  Number of Red Light Camera Violation Entries:", f"{row2[0]:,}")
-    print("  Number of Speed Camera Violation Entries:", f"{row3[0]:,}")
-    print(f"  Range of Dates in the Database: {start_date} - {end_date}")
-    print("  Total Number of Red Light Camera Violations:", f"{row5[0]:,}")
-    print("  Total Number of Speed Camera Violations:", f"{row6[0]:,}")
-    
+##################################################################
+# print_rows
+# Prints lines as they are produced, writing and flushing them a chunk at a time so the
+# first rows of a long listing show up while the rest are still being read. Returns the
+# number of lines printed.
+def print_rows(lines, chunk=api.FETCH_SIZE):
+    count = 0
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= chunk:
+            sys.stdout.write("\n".join(buffer) + "\n")
+            sys.stdout.flush()
+            count += len(buffer)
+            buffer.clear()
+    if buffer:
+        sys.stdout.write("\n".join(buffer) + "\n")
+        count += len(buffer)
+    sys.stdout.flush()
+    return count
+
+##################################################################
+# preload
+# Imports NumPy and the modules built on it while the menu waits for input, so the
+# first command that needs them doesn't have to (matplotlib waits for the first plot).
+def preload():
+    import columnar
+    import timeseries
+
+##################################################################
+# cancellable
+# Decorator for the menu commands, which run their queries under cancel.guard once their
+# input is read (so time at a prompt doesn't count against the budget): when Ctrl-C or the
+# time budget (TRAFFIC_TIME_BUDGET) stops the queries, the menu comes back instead of the
+# program exiting.
+def cancellable(command):
+    @functools.wraps(command)
+    def wrapper():
+        try:
+            return command()
+        except cancel.Cancelled as error:
+            print(f"\n{error}\n")
+            print_menu()
+    return wrapper
+
 ####################################################################################### 
 # Menu Function
 def print_menu():
@@ -56,52 +91,42 @@ def print_menu():
     print("  7. Number of violations by month, given a camera ID and year")
     print("  8. Compare the number of red light and speed violations, given a year")
     print("  9. Find cameras located on a street")
+    print("  10. Find cameras near a location")
+    print("  11. Compare red light and speed violations across years")
     print("or x to exit the program.")
 
 ################################################################################### Command 1
+@cancellable
+@instrument.timed
 def command1(): # Code called when user writes 1 from the menu
     print("Your choice --> ")
     find_int = input("Enter the name of the intersection to find (wildcards _ and % allowed): ")
-    dbCursor = dbConn.cursor() # Connection to database established
-    dbCursor.execute("""SELECT Intersection_ID, Intersection
-                    FROM Intersections WHERE Intersection LIKE ? 
-                    ORDER BY Intersection ASC""", (find_int,))
-    rows = dbCursor.fetchall() # Fetches all rows
-    
-    if rows:
-        for row in rows:
-            print(f"{row[0]} : {row[1]}") # Prints all queried lines
-    else:
-        print("No intersections matching that name were found.")
+
+    with cancel.guard("command1"):
+        rows = api.iter_intersections(dbConn, find_int)
+
+        # Prints all queried lines as they are read
+        if not print_rows(f"{row['intersection_id']} : {row['intersection']}" for row in rows):
+            print("No intersections matching that name were found.")
     print("")
 
     print_menu()
 
 ################################################################################### Command 2
+@cancellable
+@instrument.timed
 def command2(): # Code called when user writes 2 from the menu
     print("Your choice --> ")
     find_int = input("Enter the name of the intersection (no wildcards allowed): \n")
-    dbCursor = dbConn.cursor()
-    # Query for redcameras
-    dbCursor.execute("""SELECT RedCameras.Camera_ID, RedCameras.Address
-                    FROM RedCameras 
-                    JOIN Intersections ON RedCameras.Intersection_ID = Intersections.Intersection_ID
-                    WHERE Intersection LIKE ? 
-                    ORDER BY RedCameras.Camera_ID ASC""", (find_int,))
-    rows = dbCursor.fetchall() # red light cameras
-
-    # Query for speedcameras
-    dbCursor.execute("""SELECT SpeedCameras.Camera_ID, SpeedCameras.Address
-                    FROM SpeedCameras 
-                    JOIN Intersections ON SpeedCameras.Intersection_ID = Intersections.Intersection_ID
-                    WHERE Intersection LIKE ? 
-                    ORDER BY SpeedCameras.Camera_ID ASC""", (find_int,))
-    rows1 = dbCursor.fetchall() # speed cameras
+    with cancel.guard("command2"):
+        cameras = api.cameras_at_intersection(dbConn, find_int)
+    rows = [camera for camera in cameras if camera["type"] == "red"] # red light cameras
+    rows1 = [camera for camera in cameras if camera["type"] == "speed"] # speed cameras
     
     if rows:
         print("Red Light Cameras:")
         for row in rows:
-            print(f"    {row[0]} : {row[1]}") # Prints all queried lines
+            print(f"    {row['camera_id']} : {row['address']}") # Prints all queried lines
     else:
         print("No red light cameras found at that intersection.")
 
@@ -110,7 +135,7 @@ def command2(): # Code called when user writes 2 from the menu
     if rows1:
         print("Speed Cameras:")
         for row in rows1:
-            print(f"    {row[0]} : {row[1]}") # Prints all queried lines
+            print(f"    {row['camera_id']} : {row['address']}") # Prints all queried lines
     else:
         print("No speed cameras found at that intersection.")
 
@@ -118,118 +143,68 @@ def command2(): # Code called when user writes 2 from the menu
     print_menu() # Calls menu function
 
 ################################################################################### Command 3
+@cancellable
+@instrument.timed
 def command3(): # Code called when user writes 3 from the menu
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
-    
-    # Gets min/max dates from database
-    dbCursor.execute("SELECT MIN(Violation_Date), MAX(Violation_Date) FROM SpeedViolations;")
-    min_max_dates = dbCursor.fetchone()
-    
-    if not min_max_dates or not min_max_dates[0]:  # Handles cases where no data exists at all
-        print("No violation records exist in the database.")
-        print_menu()
-        return
-
-    min_date, max_date = min_max_dates  # Extracts min and max dates
     
     # Prompts for date input
     find_vio = input("Enter the date that you would like to look at (format should be YYYY-MM-DD): ").strip()
 
-    # Manually validates date format
-    date = find_vio
-    
-    # Checks for different valid date formats
-    if (len(date) == 10 and date[4] == '-' and date[7] == '-') or (len(date) == 10 and date[2] == '/' and date[5] == '/') or (len(date) == 8 and date[1] == '/' and date[3] == '/') or (len(date) == 8 and date[4] == '-' and date[6] == '-'):
-        # Some valid formats are (YYYY-MM-DD, MM/DD/YY, MM-DD-YY)
-        pass
-    else:
+    # Checks for different valid date formats (YYYY-MM-DD, MM/DD/YYYY, ...)
+    if not api.valid_date(find_vio):
         print("\nInvalid date format. Please enter the date in YYYY-MM-DD format.\n")
         return
 
-    # Checks date is within range
-    if not (min_date <= find_vio <= max_date):
-        print("No violations on record for that date.")
+    try:
+        with cancel.guard("command3"):
+            rows = api.violations_on_date(dbConn, find_vio)
+    except api.QueryError as error:  # Handles cases where no data exists at all
+        print(error)
         print_menu()
         return
 
-    # Fetches red light violations
-    dbCursor.execute("SELECT SUM(Num_Violations) FROM RedViolations WHERE Violation_Date = ?", (find_vio,))
-    red_light_violations = dbCursor.fetchone()[0] or 0  # Convert None to 0
-
-    # Fetches speed violations
-    dbCursor.execute("SELECT SUM(Num_Violations) FROM SpeedViolations WHERE Violation_Date = ?", (find_vio,))
-    speed_violations = dbCursor.fetchone()[0] or 0  # Convert None to 0
-
     # Calculates total violations
-    total_violations = red_light_violations + speed_violations
+    total_violations = sum(row["violations"] for row in rows)
 
     if total_violations == 0:
         print("No violations on record for that date.")
     else:
-        red_light_percentage = (red_light_violations / total_violations * 100)
-        speed_percentage = (speed_violations / total_violations * 100)
+        red_light, speed = rows
 
-        print("Number of Red Light Violations:", f"{red_light_violations:,}", f"({red_light_percentage:.3f}%)")
-        print("Number of Speed Violations:", f"{speed_violations:,}", f"({speed_percentage:.3f}%)")
+        print("Number of Red Light Violations:", f"{red_light['violations']:,}", f"({red_light['percentage']:.3f}%)")
+        print("Number of Speed Violations:", f"{speed['violations']:,}", f"({speed['percentage']:.3f}%)")
         print(f"Total Number of Violations: {total_violations:,}")
 
     print("")
     print_menu()
 
 ################################################################################### Command 4
+@cancellable
+@instrument.timed
 def command4(): # Code called when user writes 4 from the menu
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
-
-    # Query to get total number of red light cameras
-    dbCursor.execute("SELECT COUNT(*) FROM RedCameras")
-    total_red_cameras = dbCursor.fetchone()[0]
-
-    # Query to get total number of speed cameras
-    dbCursor.execute("SELECT COUNT(*) FROM SpeedCameras")
-    total_speed_cameras = dbCursor.fetchone()[0]
-
-    # Query to get number of red light cameras at each intersection
-    dbCursor.execute("""
-        SELECT Intersections.Intersection_ID, Intersections.Intersection, COUNT(RedCameras.Camera_ID)
-        FROM Intersections
-        INNER JOIN RedCameras ON Intersections.Intersection_ID = RedCameras.Intersection_ID
-        GROUP BY Intersections.Intersection_ID, Intersections.Intersection
-        ORDER BY COUNT(RedCameras.Camera_ID) DESC, Intersections.Intersection_ID DESC;
-    """)
-    red_camera_results = dbCursor.fetchall()
-
-    # Query to get number of speed cameras at each intersection
-    dbCursor.execute("""
-        SELECT Intersections.Intersection_ID, Intersections.Intersection, COUNT(SpeedCameras.Camera_ID)
-        FROM Intersections
-        INNER JOIN SpeedCameras ON Intersections.Intersection_ID = SpeedCameras.Intersection_ID
-        GROUP BY Intersections.Intersection_ID, Intersections.Intersection
-        ORDER BY COUNT(SpeedCameras.Camera_ID) DESC, Intersections.Intersection_ID DESC;
-    """)
-    speed_camera_results = dbCursor.fetchall()
-
-    # Prints number of red light cameras at each intersection
-    print("Number of Red Light Cameras at Each Intersection")
-    for intersection_id, intersection, count in red_camera_results:
-        percentage = (count / total_red_cameras * 100)  # Calculates percentage of red cameras at this intersection
-        print(f"  {intersection} ({intersection_id}) : {count} ({percentage:.3f}%)")  # Displays intersection and percentage
-
-    # Print the number of speed cameras at each intersection
-    print("\nNumber of Speed Cameras at Each Intersection")
-    for intersection_id, intersection, count in speed_camera_results:
-        percentage = (count / total_speed_cameras * 100)  # Calculates percentage of speed cameras at this intersection
-        print(f"  {intersection} ({intersection_id}) : {count} ({percentage:.3f}%)")  # Displays intersection and percentage
+
+    with cancel.guard("command4"):
+        # Prints number of red light cameras at each intersection
+        print("Number of Red Light Cameras at Each Intersection")
+        print_rows(f"  {row['intersection']} ({row['intersection_id']}) : {row['cameras']} ({row['percentage']:.3f}%)"  # Displays intersection and percentage
+                   for row in api.iter_cameras_per_intersection(dbConn, "red"))
+
+        # Print the number of speed cameras at each intersection
+        print("\nNumber of Speed Cameras at Each Intersection")
+        print_rows(f"  {row['intersection']} ({row['intersection_id']}) : {row['cameras']} ({row['percentage']:.3f}%)"  # Displays intersection and percentage
+                   for row in api.iter_cameras_per_intersection(dbConn, "speed"))
 
     print("")
     print_menu()
 
 
 ################################################################################### Command 5
+@cancellable
+@instrument.timed
 def command5(): # Code called when user writes 5 from the menu
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
 
     year = input("Enter the year that you would like to analyze: \n")
 
@@ -241,362 +216,264 @@ def command5(): # Code called when user writes 5 from the menu
         print(f"Number of Speed Violations at Each Intersection for {year}")
         print("No speed violations on record for that year.")
     else:
-        # Query for total red light violations in given year
-        dbCursor.execute("""
-            SELECT SUM(Num_Violations) 
-            FROM RedViolations 
-            WHERE strftime('%Y', Violation_Date) = ?""", (year,))
-        total_red_violations = dbCursor.fetchone()[0]
-
-        # Query for total speed violations in given year
-        dbCursor.execute("""
-            SELECT SUM(Num_Violations) 
-            FROM SpeedViolations 
-            WHERE strftime('%Y', Violation_Date) = ?""", (year,))
-        total_speed_violations = dbCursor.fetchone()[0]
-
-        # Query for red light violations per intersection
-        dbCursor.execute("""
-            SELECT Intersections.Intersection_ID, Intersections.Intersection, SUM(RedViolations.Num_Violations)
-            FROM RedViolations
-            JOIN RedCameras ON RedViolations.Camera_ID = RedCameras.Camera_ID
-            JOIN Intersections ON RedCameras.Intersection_ID = Intersections.Intersection_ID
-            WHERE strftime('%Y', RedViolations.Violation_Date) = ?
-            GROUP BY Intersections.Intersection_ID, Intersections.Intersection
-            ORDER BY SUM(RedViolations.Num_Violations) DESC, Intersections.Intersection_ID DESC;
-        """, (year,))
-        red_violation_results = dbCursor.fetchall()
-
-        # Query for speed violations per intersection
-        dbCursor.execute("""
-            SELECT Intersections.Intersection_ID, Intersections.Intersection, SUM(SpeedViolations.Num_Violations)
-            FROM SpeedViolations
-            JOIN SpeedCameras ON SpeedViolations.Camera_ID = SpeedCameras.Camera_ID
-            JOIN Intersections ON SpeedCameras.Intersection_ID = Intersections.Intersection_ID
-            WHERE strftime('%Y', SpeedViolations.Violation_Date) = ?
-            GROUP BY Intersections.Intersection_ID, Intersections.Intersection
-            ORDER BY SUM(SpeedViolations.Num_Violations) DESC, Intersections.Intersection_ID DESC;
-        """, (year,))
-        speed_violation_results = dbCursor.fetchall()
-
-        # Query total number of red light cameras in Chicago
-        dbCursor.execute("SELECT COUNT(*) FROM RedCameras")
-        total_red_cameras = dbCursor.fetchone()[0]
-
-        # Query total number of speed cameras in Chicago
-        dbCursor.execute("SELECT COUNT(*) FROM SpeedCameras")
-        total_speed_cameras = dbCursor.fetchone()[0]
-
-        # Outputs red light violations
-        print(f"\nNumber of Red Light Violations at Each Intersection for {year}")
-        for intersection_id, intersection, count in red_violation_results:
-            percentage = (count / total_red_violations * 100)
-            print(f"  {intersection} ({intersection_id}) : {count:,} ({percentage:.3f}%)")
-        print(f"Total Red Light Violations in {year} : {total_red_violations:,}")
-
-        # Outputs speed camera violations
-        print(f"\nNumber of Speed Violations at Each Intersection for {year}")
-        for intersection_id, intersection, count in speed_violation_results:
-            percentage = (count / total_speed_violations * 100)
-            print(f"  {intersection} ({intersection_id}) : {count:,} ({percentage:.3f}%)")
-        print(f"Total Speed Violations in {year} : {total_speed_violations:,}")
+        with cancel.guard("command5"):
+            # Outputs red light violations
+            total, rows = api.year_by_intersection(dbConn, "red", year)
+            print(f"\nNumber of Red Light Violations at Each Intersection for {year}")
+            print_rows(f"  {row['intersection']} ({row['intersection_id']}) : {row['violations']:,} ({row['percentage']:.3f}%)"
+                       for row in rows)
+            print(f"Total Red Light Violations in {year} : {total:,}")
+
+            # Outputs speed camera violations
+            total, rows = api.year_by_intersection(dbConn, "speed", year)
+            print(f"\nNumber of Speed Violations at Each Intersection for {year}")
+            print_rows(f"  {row['intersection']} ({row['intersection_id']}) : {row['violations']:,} ({row['percentage']:.3f}%)"
+                       for row in rows)
+            print(f"Total Speed Violations in {year} : {total:,}")
 
     print("")
     print_menu()
 
 ################################################################################### Command 6
+@cancellable
+@instrument.timed
 def command6(): # Code called when user writes 6 from the menu
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
 
     # Prompts user for Camera ID
     camera_id = input("Enter a camera ID: ").strip()
 
-    # Checks if camera exists in either table
-    dbCursor.execute("SELECT COUNT(*) FROM RedCameras WHERE Camera_ID = ?", (camera_id,))
-    red_camera_exists = dbCursor.fetchone()[0] > 0
-
-    dbCursor.execute("SELECT COUNT(*) FROM SpeedCameras WHERE Camera_ID = ?", (camera_id,))
-    speed_camera_exists = dbCursor.fetchone()[0] > 0
-
-    if not red_camera_exists and not speed_camera_exists:
-        print("No cameras matching that ID were found in the database.")
+    try:
+        with cancel.guard("command6"):
+            violations = api.violations_by_year(dbConn, camera_id)
+    except api.QueryError as error: # Camera isn't in either table
+        print(error)
         print("")
     else:
-        # Queries number of violations per year for this camera
-        dbCursor.execute("""
-            SELECT strftime('%Y', Violation_Date) AS Year, SUM(Num_Violations)
-            FROM RedViolations
-            WHERE Camera_ID = ?
-            GROUP BY Year
-            ORDER BY Year ASC;
-        """, (camera_id,))
-        red_violations = dbCursor.fetchall()
-
-        dbCursor.execute("""
-            SELECT strftime('%Y', Violation_Date) AS Year, SUM(Num_Violations)
-            FROM SpeedViolations
-            WHERE Camera_ID = ?
-            GROUP BY Year
-            ORDER BY Year ASC;
-        """, (camera_id,))
-        speed_violations = dbCursor.fetchall()
-
-        # Merges red and speed violations
-        violations = red_violations if red_camera_exists else speed_violations
-
         # Displays violations count per year
         print(f"Yearly Violations for Camera {camera_id}")
-        for year, count in violations:
-            print(f"{year} : {count:,}")
+        for row in violations:
+            print(f"{row['year']} : {row['violations']:,}")
 
         # Asks user if they want to plot
         plot_choice = input("\nPlot? (y/n) \n").strip()
         if plot_choice == "y":
-            years = [year for year, _ in violations]
-            counts = [count for _, count in violations]
-
-            # Plots data
-            plt.figure(figsize=(8, 5))
-            plt.plot(years, counts, linestyle="-", color='blue', linewidth=2)
-            plt.xlabel("Year")
-            plt.ylabel("Number of Violations")
-            plt.title(f"Yearly Violations For Camera {camera_id}")
-            plt.xticks(years)
-            plt.show()
+            charts.show("yearly", camera_id, violations)
 
     print_menu()
 
 ################################################################################### Command 7
+@cancellable
+@instrument.timed
 def command7(): # Code called when user writes 7 from the menu
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
 
     # Prompts user for Camera ID
     camera_id = input("Enter a camera ID: ").strip()
 
     # Checks if camera exists in either table
-    dbCursor.execute("SELECT COUNT(*) FROM RedCameras WHERE Camera_ID = ?", (camera_id,))
-    red_camera_exists = dbCursor.fetchone()[0] > 0
-
-    dbCursor.execute("SELECT COUNT(*) FROM SpeedCameras WHERE Camera_ID = ?", (camera_id,))
-    speed_camera_exists = dbCursor.fetchone()[0] > 0
-
-    if not red_camera_exists and not speed_camera_exists:
+    with cancel.guard("command7"):
+        camera_type = api.camera_type(dbConn, camera_id)
+    if camera_type is None:
         print("No cameras matching that ID were found in the database.\n")
     else:
         # Prompts user for year
         year = input("Enter a year: ").strip()
         
         # Queries number of violations per month for this camera in given year
-        dbCursor.execute("""
-            SELECT strftime('%m', Violation_Date) AS Month, SUM(Num_Violations)
-            FROM RedViolations
-            WHERE Camera_ID = ? AND strftime('%Y', Violation_Date) = ?
-            GROUP BY Month
-            ORDER BY Month ASC;
-        """, (camera_id, year))
-        red_violations = dbCursor.fetchall()
-
-        dbCursor.execute("""
-            SELECT strftime('%m', Violation_Date) AS Month, SUM(Num_Violations)
-            FROM SpeedViolations
-            WHERE Camera_ID = ? AND strftime('%Y', Violation_Date) = ?
-            GROUP BY Month
-            ORDER BY Month ASC;
-        """, (camera_id, year))
-        speed_violations = dbCursor.fetchall()
-
-        # Merges red/speed violations
-        violations = red_violations if red_camera_exists else speed_violations
+        with cancel.guard("command7"):
+            violations = api.violations_by_month(dbConn, camera_id, year)
 
         # Displays violations count per month
         print(f"Monthly Violations for Camera {camera_id} in {year}")
-        for month, count in violations:
-            print(f"{month}/{year} : {count:,}")
+        for row in violations:
+            print(f"{row['month']}/{year} : {row['violations']:,}")
 
         # Asks user if they want to plot
         plot_choice = input("\nPlot? (y/n) \n").strip().lower()
         if plot_choice == "y" and (2014 <= int(year) <= 2024):
-            months = [f"{month}" for month, _ in violations]
-            counts = [count for _, count in violations]
-
-            # Plots data
-            plt.figure(figsize=(8, 5))
-            plt.plot(months, counts, linestyle="-", color='blue', linewidth=2)
-            plt.xlabel("Month")
-            plt.ylabel("Number of Violations")
-            plt.title(f"Monthly Violations for Camera {camera_id} ({year})")
-            plt.xticks(months)  # Rotate for better readability
-            plt.show()
+            charts.show("monthly", camera_id, year, violations)
     print_menu()
 
+##################################################################
+# first_and_last_days
+# Given the dates and counts of a daily series, returns (date, count) for the first and
+# last n days with a non-zero count.
+def first_and_last_days(dates, counts, n=5):
+    import numpy as np
+
+    days = np.flatnonzero(counts)
+    days = np.concatenate((days[:n], days[-n:]))
+    return zip(dates[days].tolist(), counts[days].tolist())
+
 ################################################################################### Command 8
+@cancellable
+@instrument.timed
 def command8(): # Code called when user writes 8 from the menu
+    import numpy as np
+
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
 
     # Prompts user for year
     year = input("Enter a year: ").strip()
 
-    # Checks for leap year
-    days_in_year = 366 if datetime.datetime.strptime(f"{year}-12-31", "%Y-%m-%d").timetuple().tm_yday == 366 else 365
-
-    # Initializes arrays with zeros for all days in year
-    red_violations = [0] * days_in_year
-    speed_violations = [0] * days_in_year
-
-    # Generates complete list of dates for year
-    start_date = datetime.date(int(year), 1, 1)
-    all_dates = [(start_date + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(days_in_year)]
-
-    # Queries red light violations
-    dbCursor.execute("""
-        SELECT strftime('%j', Violation_Date) AS DayOfYear, SUM(Num_Violations)
-        FROM RedViolations
-        WHERE strftime('%Y', Violation_Date) = ?
-        GROUP BY DayOfYear
-        ORDER BY DayOfYear ASC;
-    """, (year,))
-    
-    red_data = dbCursor.fetchall()
-    for day_of_year, count in red_data:
-        red_violations[int(day_of_year) - 1] = count  # Convert to zero-based index
-
-    # Queries speed violations
-    dbCursor.execute("""
-        SELECT strftime('%j', Violation_Date) AS DayOfYear, SUM(Num_Violations)
-        FROM SpeedViolations
-        WHERE strftime('%Y', Violation_Date) = ?
-        GROUP BY DayOfYear
-        ORDER BY DayOfYear ASC;
-    """, (year,))
-    
-    speed_data = dbCursor.fetchall()
-    for day_of_year, count in speed_data:
-        speed_violations[int(day_of_year) - 1] = count  # Convert to zero-based index
+    try:
+        with cancel.guard("command8"):
+            series = api.daily_series(dbConn, year) # Every day of the year, 0 on days with none
+    except api.QueryError as error:
+        print(error)
+        print("")
+        print_menu()
+        return
 
-    # Extracts only non-zero data for display
-    non_zero_red = [(all_dates[i], red_violations[i]) for i in range(days_in_year) if red_violations[i] > 0]
-    non_zero_speed = [(all_dates[i], speed_violations[i]) for i in range(days_in_year) if speed_violations[i] > 0]
+    red_violations = series.counts["red"]
+    speed_violations = series.counts["speed"]
+    dates = np.datetime_as_string(series.dates)
 
     # Prints first and last 5 non-zero days
     print("Red Light Violations:")
-    for date, count in non_zero_red[:5] + non_zero_red[-5:]:
+    for date, count in first_and_last_days(dates, red_violations):
         print(f"{date} {count:}")
 
     print("Speed Violations:")
-    for date, count in non_zero_speed[:5] + non_zero_speed[-5:]:
+    for date, count in first_and_last_days(dates, speed_violations):
         print(f"{date} {count:}")
 
     # Asks user if they want to plot
     plot_choice = input("\nPlot? (y/n) ").strip().lower()
     if plot_choice == "y":
-        # Plots data
-        plt.figure(figsize=(12, 6))
-        plt.plot(range(days_in_year), red_violations, linestyle="-", color='red', linewidth=2, label="Red Light Violations")
-        plt.plot(range(days_in_year), speed_violations, linestyle="-", color='orange', linewidth=2, label="Speed Violations")
-
-        plt.xlabel("Day")
-        plt.ylabel("Number of Violations")
-        plt.title(f"Violations Each Day of {year}")
-        plt.legend()
-
-        # Sets x axis ticks from 50 to 350 with step 50
-        tick_positions = list(range(0, 351, 50))
-        tick_labels = [str(i) for i in tick_positions]
-        plt.xticks(tick_positions, tick_labels, rotation=45, fontsize=8)
-
-        plt.grid(axis="y", linestyle="--", alpha=0.7)
-        plt.show()
+        charts.show("daily", year, red_violations, speed_violations)
 
     print("")
 
     print_menu()
 
 ################################################################################### Command 9
+@cancellable
+@instrument.timed
 def command9(): # Code called when user writes 9 from the menu
     print("Your choice --> ")
-    dbCursor = dbConn.cursor()
 
     # Gets street name from user
     street_name = input("Enter a street name: ").strip()
 
-    # Queries for red light cameras on street
-    dbCursor.execute("""
-        SELECT Camera_ID, Address, Latitude, Longitude
-        FROM RedCameras
-        WHERE Address LIKE ?
-        ORDER BY Camera_ID ASC
-    """, (f"%{street_name}%",))  # Uses wildcards
-    red_cameras = dbCursor.fetchall()
-
-    # Query for speed cameras on street
-    dbCursor.execute("""
-        SELECT Camera_ID, Address, Latitude, Longitude
-        FROM SpeedCameras
-        WHERE Address LIKE ?
-        ORDER BY Camera_ID ASC
-    """, (f"%{street_name}%",))
-    speed_cameras = dbCursor.fetchall()
-
-    if not red_cameras and not speed_cameras:
-        print(f"There are no cameras located on that street.")
-    else:
-        # Prints list of cameras found
-        print(f"\nList of Cameras Located on Street: {street_name}")
+    with cancel.guard("command9"):
+        # Queries for red light and speed cameras on street, reading just the first of each
+        # type until they're printed
+        red_cameras = api.iter_cameras_on_street(dbConn, "red", street_name)
+        speed_cameras = api.iter_cameras_on_street(dbConn, "speed", street_name)
+        first_red, first_speed = next(red_cameras, None), next(speed_cameras, None)
 
-        if red_cameras:
-            print("  Red Light Cameras:")
-            for camera in red_cameras:
-                print(f"     {camera[0]} : {camera[1]} ({camera[2]}, {camera[3]})")
+        if first_red is None and first_speed is None:
+            print(f"There are no cameras located on that street.")
         else:
-            print("  Red Light Cameras:")
+            # Prints list of cameras found
+            print(f"\nList of Cameras Located on Street: {street_name}")
 
-        if speed_cameras:
-            print("  Speed Cameras:")
-            for camera in speed_cameras:
-                print(f"     {camera[0]} : {camera[1]} ({camera[2]}, {camera[3]})")
-        else:
-            print("  Speed Cameras:")
+            for title, first, cameras in (("Red Light Cameras", first_red, red_cameras), ("Speed Cameras", first_speed, speed_cameras)):
+                print(f"  {title}:")
+                if first is not None:
+                    print_rows(f"     {camera['camera_id']} : {camera['address']} ({camera['latitude']}, {camera['longitude']})"
+                               for camera in itertools.chain([first], cameras))
 
+    if first_red is not None or first_speed is not None:
         # Asks if user wants to plot cameras
         plot_choice = input("\nPlot? (y/n) ").strip()
 
         if plot_choice == "y":
-            # Prepares coordinates for plotting
-            red_x = [camera[3] for camera in red_cameras]
-            red_y = [camera[2] for camera in red_cameras]
-            speed_x = [camera[3] for camera in speed_cameras]
-            speed_y = [camera[2] for camera in speed_cameras]
+            with cancel.guard("command9"):
+                cameras = api.cameras_on_street(dbConn, street_name)
+            red_cameras = [camera for camera in cameras if camera["type"] == "red"]
+            speed_cameras = [camera for camera in cameras if camera["type"] == "speed"]
+            charts.show("street", street_name, red_cameras, speed_cameras) # Cameras on the city map
+
+    print("")
+    print_menu()
+
+################################################################################### Command 10
+@cancellable
+@instrument.timed
+def command10(): # Code called when user writes 10 from the menu
+    print("Your choice --> ")
+
+    # Gets location and search distance from user
+    latitude = input("Enter a latitude: ").strip()
+    longitude = input("Enter a longitude: ").strip()
+    meters = input("Enter a distance in meters (leave blank for the 5 nearest cameras): ").strip()
+
+    try:
+        with cancel.guard("command10"):
+            if meters:
+                cameras = api.cameras_near(dbConn, latitude, longitude, meters)
+            else:
+                cameras = api.nearest_cameras(dbConn, latitude, longitude, 5)
+    except api.QueryError as error:
+        print(error)
+        print("")
+        print_menu()
+        return
+
+    if not cameras:
+        print("There are no cameras within that distance.")
+    else:
+        # Prints cameras found, nearest first
+        print(f"\nCameras Near ({latitude}, {longitude})")
+        for camera in cameras:
+            camera_type = "Red Light" if camera["type"] == "red" else "Speed"
+            print(f"  {camera['camera_id']} : {camera['address']} ({camera_type} Camera) - "
+                  f"{camera['distance_m']:,.0f} m, {camera['violations']:,} violations")
+
+    print("")
+    print_menu()
 
-            # Loads map image
-            image = plt.imread("chicago.png")
-            xydims = [-87.9277, -87.5569, 41.7012, 42.0868]
+################################################################################### Command 11
+@cancellable
+@instrument.timed
+def command11(): # Code called when user writes 11 from the menu
+    import timeseries
 
-            plt.imshow(image, extent=xydims)
+    print("Your choice --> ")
+
+    # Prompts user for the range of years
+    first_year = input("Enter the first year: ").strip()
+    last_year = input("Enter the last year: ").strip()
 
-            # Plots red light cameras in red
-            plt.plot(red_x, red_y, 'ro', label="Red Light Cameras")
+    try:
+        with cancel.guard("command11"):
+            years = api.compare_years(dbConn, first_year, last_year)
+            series = api.daily_series(dbConn, first_year, last_year) # Already loaded by compare_years
+    except api.QueryError as error:
+        print(error)
+        print("")
+        print_menu()
+        return
 
-            # Plots speed cameras in orange
-            plt.plot(speed_x, speed_y, 'ro', color='orange', label="Speed Cameras")
+    def change(percent):
+        return "-" if percent is None else f"{percent:+.1f}%"
 
-            # Annotates each camera with its ID
-            for camera in red_cameras:
-                plt.annotate(camera[0], (camera[3], camera[2]), color='black', fontsize=8)
+    # Prints totals for each year with the change from the year before
+    print(f"\nRed Light vs. Speed Violations, {first_year}-{last_year}")
+    print(f"  {'Year':<6}{'Red Light':>12}{'Change':>10}{'Speed':>12}{'Change':>10}{'Red/Speed':>11}")
+    for row in years:
+        ratio = "-" if row["red_per_speed"] is None else f"{row['red_per_speed']:.3f}"
+        print(f"  {row['year']:<6}{row['red']:>12,}{change(row['red_change_pct']):>10}"
+              f"{row['speed']:>12,}{change(row['speed_change_pct']):>10}{ratio:>11}")
 
-            for camera in speed_cameras:
-                plt.annotate(camera[0], (camera[3], camera[2]), color='black', fontsize=8)
+    # Prints the average violations per day by weekday and by month
+    print("\nAverage Violations per Day by Weekday (Red Light / Speed)")
+    for name, red, speed in zip(timeseries.WEEKDAYS, timeseries.weekday_profile(series, "red"),
+                                timeseries.weekday_profile(series, "speed")):
+        print(f"  {name} : {red:,.1f} / {speed:,.1f}")
 
-            # Sets map limits and title
-            plt.xlim([-87.9277, -87.5569])
-            plt.ylim([41.7012, 42.0868])
-            plt.title(f"Cameras on {street_name}")
-            plt.legend()
+    print("\nAverage Violations per Day by Month (Red Light / Speed)")
+    for name, red, speed in zip(timeseries.MONTHS, timeseries.month_profile(series, "red"),
+                                timeseries.month_profile(series, "speed")):
+        print(f"  {name} : {red:,.1f} / {speed:,.1f}")
 
-            # Plots data on map
-            plt.show()
+    # Asks user if they want to plot
+    plot_choice = input("\nPlot? (y/n) ").strip().lower()
+    if plot_choice == "y":
+        charts.show("years", first_year, last_year, series, years)
 
     print("")
     print_menu()
@@ -612,44 +489,52 @@ def commandError():
     print("Your choice --> Error, unknown command, try again...\n")
     print_menu()
 
+# Menu choices and the commands they run; anything else runs commandError
+MENU = {"1": command1, "2": command2, "3": command3, "4": command4, "5": command5, "6": command6,
+        "7": command7, "8": command8, "9": command9, "10": command10, "11": command11, "x": commandx}
+
 # main
-dbConn = sqlite3.connect('chicago-traffic-cameras.db')
-run = True
-
-# Beginning project explanation
-print("Project 1: Chicago Traffic Camera Analysis")
-print("CS 341, Spring 2025")
-print()
-print("This application allows you to analyze various")
-print("aspects of the Chicago traffic camera database.")
-print()
-print_stats(dbConn)
-print()
-print_menu()
-
-# Loop runs until user quits by writing x
-while run:
-    inp = input()
-    
-    if inp == "1":
-        command1()
-    elif inp == "2":
-        command2()
-    elif inp == "3":
-        command3()
-    elif inp == "4":
-        command4()
-    elif inp == "5":
-        command5()
-    elif inp == "6":
-        command6()
-    elif inp == "7":
-        command7()
-    elif inp == "8":
-        command8()
-    elif inp == "9":
-        command9()
-    elif inp == "x":
-        commandx()
-    else:
-        commandError()
+# With arguments (e.g. main.py violations-by-year --camera 1503) runs them through the
+# command-line interface in cli.py instead of the interactive menu. Importing this file
+# (as bench.py and sessions.py do) only defines the commands; they use the module's
+# dbConn and input.
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        import cli  # Only needed for the command line, not the menu
+        sys.exit(cli.main(sys.argv[1:]))
+
+    instrument.enable_from_environment() # TRAFFIC_QUERY_LOG=<file> logs slow statements
+    if os.environ.get("TRAFFIC_RECORD"): # TRAFFIC_RECORD=<file> records the session for sessions.py
+        import sessions
+        input = sessions.Recorder(os.environ["TRAFFIC_RECORD"]).input
+    input = instrument.timed_input(input) # Time spent typing isn't counted as the commands'
+    dbConn = api.open_database()
+    run = True
+    dbSnapshot = None
+    if os.environ.get("TRAFFIC_SNAPSHOT"): # TRAFFIC_SNAPSHOT=1 serves commands from an in-memory copy
+        import snapshot
+        dbSnapshot = snapshot.Snapshot(dbConn)
+        dbSnapshot.start() # Copies in the background; commands use the disk until it's done
+
+    # Beginning project explanation
+    print("Project 1: Chicago Traffic Camera Analysis")
+    print("CS 341, Spring 2025")
+    print()
+    print("This application allows you to analyze various")
+    print("aspects of the Chicago traffic camera database.")
+    print()
+    print_stats(dbConn) # From the stats cache unless the database has changed
+    print()
+    print_menu()
+    threading.Thread(target=preload, daemon=True).start()
+
+    # Loop runs until user quits by writing x
+    while run:
+        inp = input()
+        if dbSnapshot:
+            dbConn = dbSnapshot.connection() # The commands use the module's dbConn
+        MENU.get(inp, commandError)()
+
+    if dbSnapshot:
+        print(dbSnapshot.summary(), file=sys.stderr)
+    instrument.report()
@@ -0,0 +1,114 @@
+
+# Description:
+#   Runs the red light and speed halves of a command at the same time. Most commands run
+#   the same query once against the Red tables and once against the Speed tables;
+#   map_kinds() hands each half to a small thread pool where every worker thread has its
+#   own read-only (mode=ro) connection to the same database file, then returns the
+#   results in order. sqlite3 releases the GIL while a query runs, so the two halves
+#   can run on separate cores. In-memory databases, or WORKERS below 2, run the halves one
+#   after the other on the caller's connection. map_files() does the same across several
+#   database files (the year shards of shards.py), with one read-only connection per file.
+#
+#   Serial is the default: bench_parallel.py found the pool slower than running the halves
+#   in turn for most commands (only commands 3 and 9 gained, by 10-20%), since each half is
+#   only a few milliseconds of SQL and handing it to a thread costs about as much. Set WORKERS = 2 where the halves
+#   are long enough to gain from it (check with bench_parallel.py).
+
+import sqlite3
+import threading
+import urllib.parse
+
+import cancel
+import stats
+
+# Number of worker threads (one per camera type); 1 runs the halves serially
+WORKERS = 1
+
+_executor = None
+_files_executor = None
+_local = threading.local()
+
+##################################################################
+# read_only_connection
+# Returns this thread's read-only connection to a database file, opening it the first
+# time the thread needs it.
+def read_only_connection(path):
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    if path not in connections:
+        connections[path] = sqlite3.connect(f"file:{urllib.parse.quote(path)}?mode=ro", uri=True)
+        cancel.watch(connections[path])
+    return connections[path]
+
+##################################################################
+# executor
+# Returns the shared thread pool, creating it on first use.
+def executor():
+    global _executor
+    if _executor is None:
+        import concurrent.futures  # Loaded with the first pool rather than at startup
+
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="query")
+    return _executor
+
+##################################################################
+# files_executor
+# Returns the thread pool map_files uses, one thread per core, creating it on first use.
+def files_executor():
+    global _files_executor
+    if _files_executor is None:
+        import concurrent.futures
+        import os
+
+        _files_executor = concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="shard")
+    return _files_executor
+
+##################################################################
+# map_kinds
+# Given connection to database, a function(dbConn, kind) and the camera types to run it
+# for, runs the function for every type (in parallel on read-only connections if WORKERS
+# is 2 or more) and returns the results in the same order as kinds.
+def map_kinds(dbConn, function, kinds):
+    path = stats.database_path(dbConn)
+    if WORKERS < 2 or not path:
+        return [function(dbConn, kind) for kind in kinds]
+
+    operation = cancel.current()  # The workers' statements count toward the caller's command
+
+    def run(kind):
+        with cancel.joined(operation):
+            return function(read_only_connection(path), kind)
+
+    futures = [executor().submit(run, kind) for kind in kinds]
+    return [future.result() for future in futures]
+
+##################################################################
+# map_files
+# Runs function(connection, path) for each database file on a read-only connection of
+# its own (in parallel if WORKERS is 2 or more), and returns the results in the same
+# order as paths.
+def map_files(paths, function):
+    if WORKERS < 2 or len(paths) < 2:
+        return [function(read_only_connection(path), path) for path in paths]
+
+    operation = cancel.current()
+
+    def run(path):
+        with cancel.joined(operation):
+            return function(read_only_connection(path), path)
+
+    futures = [files_executor().submit(run, path) for path in paths]
+    return [future.result() for future in futures]
+
+##################################################################
+# shutdown
+# Stops the thread pools (their connections are closed along with the threads).
+def shutdown():
+    global _executor, _files_executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    if _files_executor is not None:
+        _files_executor.shutdown()
+        _files_executor = None
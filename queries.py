@@ -0,0 +1,100 @@
+
+# Description:
+#   SQL used by the menu commands that report violation totals by date. Commands 5-8
+#   read the summary tables kept by rollups.py instead of aggregating the raw violation
+#   rows, and every date filter is written as a half-open range (>= start AND < end) so
+#   it can search an index rather than scanning the table.
+
+# Violation and camera table used for each camera type
+TABLES = {
+    "red": ("RedViolations", "RedCameras"),
+    "speed": ("SpeedViolations", "SpeedCameras"),
+}
+
+##################################################################
+# year_bounds
+# Given a year string, returns the half-open date range (start, end) covering that year.
+# Input that is not a year gives an empty range so the queries simply return no rows.
+def year_bounds(year):
+    year = str(year).strip()
+    if not year.isdigit():
+        return (year, year)
+    return (f"{int(year):04d}-01-01", f"{int(year) + 1:04d}-01-01")
+
+##################################################################
+# Command 5: total violations and violations per intersection for a year
+# Parameters: (kind, year); api.py adds a LIMIT clause to YEAR_BY_INTERSECTION
+YEAR_TOTAL = """
+    SELECT SUM(Num_Violations)
+    FROM Rollup_Camera_Year
+    WHERE Kind = ? AND Year = ?"""
+
+YEAR_BY_INTERSECTION = """
+    SELECT Intersections.Intersection_ID, Intersections.Intersection, Rollup_Intersection_Year.Num_Violations
+    FROM Rollup_Intersection_Year
+    JOIN Intersections ON Rollup_Intersection_Year.Intersection_ID = Intersections.Intersection_ID
+    WHERE Rollup_Intersection_Year.Kind = ? AND Rollup_Intersection_Year.Year = ?
+    ORDER BY Rollup_Intersection_Year.Num_Violations DESC, Intersections.Intersection_ID DESC"""
+
+# Command 6: violations per year for a camera
+# Parameters: (kind, camera ID)
+CAMERA_BY_YEAR = """
+    SELECT Year, Num_Violations
+    FROM Rollup_Camera_Year
+    WHERE Kind = ? AND Camera_ID = ?
+    ORDER BY Year ASC;"""
+
+# The report's command 6 charts (see report.py): violations per year for every camera at once.
+# It reads every row of the type, so it is left out of command_queries' plan check
+# Parameters: (kind)
+CAMERA_YEARS = """
+    SELECT Camera_ID, Year, Num_Violations
+    FROM Rollup_Camera_Year
+    WHERE Kind = ?
+    ORDER BY Camera_ID ASC, Year ASC;"""
+
+# Command 7: violations per month for a camera in a year
+# Parameters: (kind, camera ID, year)
+CAMERA_BY_MONTH = """
+    SELECT Month, Num_Violations
+    FROM Rollup_Camera_Month
+    WHERE Kind = ? AND Camera_ID = ? AND Year = ?
+    ORDER BY Month ASC;"""
+
+# Command 8 and the multi-year comparison (see timeseries.py): violations per day over a
+# range of dates, each day given as its offset in days from the start of the range
+# Parameters: (range start, kind, range start, range end)
+DAYS_IN_RANGE = """
+    SELECT CAST(julianday(Day) - julianday(?) AS INTEGER), Num_Violations
+    FROM Rollup_Day
+    WHERE Kind = ? AND Day >= ? AND Day < ?;"""
+
+# Camera audit (see anomalies.py): violations per camera and day, or per camera and month,
+# over a range, each period given as its offset from the start of the range
+# Parameters: (range start, kind, range start, range end) and (first year, kind, first year, last year)
+CAMERA_DAYS_IN_RANGE = """
+    SELECT Camera_ID, CAST(julianday(Day) - julianday(?) AS INTEGER), Num_Violations
+    FROM Rollup_Camera_Day
+    WHERE Kind = ? AND Day >= ? AND Day < ?;"""
+
+CAMERA_MONTHS_IN_RANGE = """
+    SELECT Camera_ID, (CAST(Year AS INTEGER) - ?) * 12 + CAST(Month AS INTEGER) - 1, Num_Violations
+    FROM Rollup_Camera_Month
+    WHERE Kind = ? AND Year >= ? AND Year <= ?;"""
+
+##################################################################
+# command_queries
+# Lists every date-based command query as (label, sql, sample parameters). Used by
+# indexes.check_query_plans to confirm none of them fall back to a full table scan.
+def command_queries():
+    start, end = year_bounds(2020)
+    queries = []
+    for kind in TABLES:
+        queries.append((f"command5 {kind} total", YEAR_TOTAL, (kind, "2020")))
+        queries.append((f"command5 {kind} by intersection", YEAR_BY_INTERSECTION, (kind, "2020")))
+        queries.append((f"command6 {kind} by year", CAMERA_BY_YEAR, (kind, 0)))
+        queries.append((f"command7 {kind} by month", CAMERA_BY_MONTH, (kind, 0, "2020")))
+        queries.append((f"command8 {kind} by day", DAYS_IN_RANGE, (start, kind, start, end)))
+        queries.append((f"audit {kind} by camera and day", CAMERA_DAYS_IN_RANGE, (start, kind, start, end)))
+        queries.append((f"audit {kind} by camera and month", CAMERA_MONTHS_IN_RANGE, (2020, kind, "2020", "2020")))
+    return queries
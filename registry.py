@@ -0,0 +1,129 @@
+
+# Description:
+#   In-memory registry of every red light and speed camera (ID, type, intersection,
+#   address and location) and of the intersection names, read once per database and kept
+#   for the session. Commands use it to check a camera ID and find which table it is in
+#   without querying both camera tables, and to go from cameras to intersections (and
+#   back) without joining. Like the query cache, a registry is rebuilt as soon as a
+#   connection to its database reports a new PRAGMA data_version (a commit by another
+#   connection) or a new total_changes (a commit by itself).
+
+import re
+import threading
+
+import queries
+import stats
+
+# Text SQLite would compare as a number against the integer Camera_ID column
+NUMBER = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+
+_registries = {}  # database path -> Registry
+_versions = {}  # (database path, connection) -> (data_version, total_changes)
+_lock = threading.Lock()
+
+##################################################################
+# Camera
+# One camera's row from RedCameras or SpeedCameras.
+class Camera:
+    __slots__ = ("camera_id", "kind", "intersection_id", "address", "latitude", "longitude")
+
+    def __init__(self, camera_id, kind, intersection_id, address, latitude, longitude):
+        self.camera_id = camera_id
+        self.kind = kind
+        self.intersection_id = intersection_id
+        self.address = address
+        self.latitude = latitude
+        self.longitude = longitude
+
+##################################################################
+# Registry
+# Built from every Camera (red light first) and the intersection names by ID. cameras
+# maps camera ID to Camera (the red light one if an ID is in both tables, as the menu
+# has always looked them up) and at_intersection maps intersection ID to its cameras in
+# ID order.
+class Registry:
+    def __init__(self, cameras, intersections):
+        self.all = cameras
+        self.intersections = intersections
+        self.cameras = {}
+        self.at_intersection = {}
+        for camera in cameras:
+            self.cameras.setdefault(camera.camera_id, camera)
+        for camera in sorted(cameras, key=lambda camera: camera.camera_id):
+            if camera.intersection_id is not None:
+                self.at_intersection.setdefault(camera.intersection_id, []).append(camera)
+
+    ##################################################################
+    # find
+    # Returns the Camera with an ID given as a number or as text, or None.
+    def find(self, camera_id):
+        return self.cameras.get(camera_key(camera_id))
+
+    ##################################################################
+    # of_kind
+    # Returns the cameras of one type.
+    def of_kind(self, kind):
+        return [camera for camera in self.all if camera.kind == kind]
+
+##################################################################
+# camera_key
+# Converts a camera ID to the integer the camera tables store, the way SQLite compares
+# text with an integer column ("1503", " 1503 " and "1503.0" all find camera 1503).
+# Returns None for anything that can't be a camera ID.
+def camera_key(camera_id):
+    if isinstance(camera_id, bool):
+        return None
+    if isinstance(camera_id, int):
+        return camera_id
+    text = str(camera_id).strip()
+    if not NUMBER.fullmatch(text):
+        return None
+    if text.lstrip("+-").isdigit():
+        return int(text)
+    value = float(text)
+    return int(value) if value.is_integer() else None
+
+##################################################################
+# build
+# Given connection to database, reads the camera and intersection tables into a Registry.
+def build(dbConn):
+    dbCursor = dbConn.cursor()
+    cameras = []
+    for kind, (violations, table) in queries.TABLES.items():
+        dbCursor.execute(f"SELECT Camera_ID, Intersection_ID, Address, Latitude, Longitude FROM {table}")
+        cameras += [Camera(row[0], kind, *row[1:]) for row in dbCursor.fetchall()]
+    dbCursor.execute("SELECT Intersection_ID, Intersection FROM Intersections")
+    return Registry(cameras, dict(dbCursor.fetchall()))
+
+##################################################################
+# get
+# Given connection to database, returns its Registry, building it the first time and
+# again whenever the data has changed since this connection last asked.
+def get(dbConn):
+    path = stats.database_path(dbConn) or f":memory:{id(dbConn)}"
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA data_version")
+    version = (dbCursor.fetchone()[0], dbConn.total_changes)
+
+    with _lock:
+        seen = _versions.get((path, id(dbConn)))
+        if seen is not None and seen != version:
+            _registries.pop(path, None)
+        if len(_versions) > 64:
+            _versions.clear()  # Forget connections that have since been closed
+        _versions[(path, id(dbConn))] = version
+        registry = _registries.get(path)
+
+    if registry is None:
+        registry = build(dbConn)
+        with _lock:
+            _registries[path] = registry
+    return registry
+
+##################################################################
+# clear
+# Forgets every registry, so the next get() reads the tables again.
+def clear():
+    with _lock:
+        _registries.clear()
+        _versions.clear()
@@ -0,0 +1,291 @@
+
+# Description:
+#   The monthly report, generated in one run instead of by hand: print_stats, the
+#   command 4 camera distribution, the command 5 intersection rankings and the command 8
+#   daily comparison (CSV and chart) for every year, and the command 6 chart for every
+#   camera, written as text, CSV and PNG/SVG files into <out>/<date>/.
+#
+#   plan() lists the outputs, each with the queries it needs. A query shared by several
+#   outputs runs once: the daily comparisons of every year come from one daily series
+#   over the whole range, and the camera charts from one read of the camera/year rollup
+#   per camera type. The queries, then the outputs, run across a process pool where
+#   each worker keeps one read-only connection (parallel.read_only_connection), and each
+#   file is written under a temporary name and renamed when complete. Outputs whose
+#   files are all there already are skipped, so running the report again with the same
+#   --date resumes an interrupted run. At the end it prints how long planning, the
+#   queries and the outputs took, per kind.
+#
+#   python report.py [--db FILE] [--out reports] [--date YYYY-MM-DD] [--first-year 2014]
+#                    [--last-year 2024] [--workers N] [--format png|svg]
+
+import datetime
+import io
+import os
+import time
+
+import api
+import charts
+import cli
+import parallel
+import queries
+import registry
+import stats
+
+##################################################################
+# plan
+# Lists the report's outputs as (kind, argument) tuples, with the camera charts last.
+def plan(dbConn, first_year, last_year):
+    years = [str(year) for year in range(first_year, last_year + 1)]
+    return ([("stats", None), ("cameras-per-intersection", None), ("camera-years", None)]
+            + [("violations-by-intersection", year) for year in years]
+            + [("daily", year) for year in years]
+            + [("yearly", str(camera_id)) for camera_id in sorted(registry.get(dbConn).cameras)])
+
+##################################################################
+# outputs
+# The files an output writes, relative to the report folder.
+def outputs(task, image_format):
+    kind, argument = task
+    if kind == "stats":
+        return ["stats.txt"]
+    if kind == "cameras-per-intersection":
+        return ["cameras-per-intersection.txt", "cameras-per-intersection.csv"]
+    if kind == "camera-years":
+        return ["violations-by-camera-year.csv"]
+    if kind == "violations-by-intersection":
+        return [f"violations-by-intersection-{argument}.txt", f"violations-by-intersection-{argument}.csv"]
+    if kind == "daily":
+        return [f"daily-{argument}.csv", os.path.join("charts", f"daily-{argument}.{image_format}")]
+    return [os.path.join("charts", f"yearly-{argument}.{image_format}")]
+
+##################################################################
+# needs
+# The query an output is made from, as a key for run_query; outputs with the same key
+# share one run of it.
+def needs(task, first_year, last_year):
+    kind, argument = task
+    if kind == "daily":
+        return ("daily-series", first_year, last_year)
+    if kind in ("yearly", "camera-years"):
+        return ("camera-years", None)
+    return task
+
+##################################################################
+# camera_years
+# Given connection to database, returns {camera ID: command 6 rows} for every camera,
+# each from the camera type the menu would look it up in.
+def camera_years(dbConn):
+    cameras = registry.get(dbConn)
+    dbCursor = dbConn.cursor()
+    result = {}
+    for kind in api.KINDS:
+        dbCursor.execute(queries.CAMERA_YEARS, (kind,))
+        for camera_id, year, violations in dbCursor.fetchall():
+            camera = cameras.find(camera_id)
+            if camera is not None and camera.kind == kind:
+                result.setdefault(camera_id, []).append({"year": year, "violations": violations})
+    return result
+
+##################################################################
+# Worker
+# Each worker process keeps one read-only connection and runs the queries and writes
+# the outputs it is given.
+_worker = {}
+
+def start_worker(path, folder, image_format):
+    parallel.WORKERS = 1  # The process pool already keeps every core busy
+    _worker.update(path=path, folder=folder, format=image_format)
+
+##################################################################
+# run_query
+# Runs one shared query. Returns (key, result, seconds).
+def run_query(key):
+    dbConn = parallel.read_only_connection(_worker["path"])
+    name, argument = key[:2]
+    start = time.perf_counter()
+    if name == "stats":
+        result = stats.load(dbConn)
+    elif name == "cameras-per-intersection":
+        result = api.cameras_per_intersection(dbConn)
+    elif name == "violations-by-intersection":
+        rows, totals = [], {}
+        for kind in api.KINDS:  # Each type's total comes with its rows
+            total, found = api.year_by_intersection(dbConn, kind, argument)
+            rows += found
+            totals[kind] = total or 0
+        result = (rows, totals)
+    elif name == "daily-series":
+        series = api.daily_series(dbConn, key[1], key[2])
+        result = (series.years(), series.counts)
+    else:
+        result = camera_years(dbConn)
+    return key, result, time.perf_counter() - start
+
+##################################################################
+# extract
+# The part of a query's result an output needs, so only that is sent to its worker.
+def extract(task, result):
+    kind, argument = task
+    if kind == "daily":
+        years, counts = result
+        days = years == int(argument)
+        return {name: values[days] for name, values in counts.items()}
+    if kind == "yearly":
+        return result.get(int(argument), [])
+    if kind == "camera-years":
+        return [{"camera_id": camera_id, **row} for camera_id, rows in sorted(result.items()) for row in rows]
+    return result
+
+##################################################################
+# write_text / csv_text
+# Writes a file under a temporary name, then renames it, so a file that exists is
+# complete.
+def write_text(path, text):
+    with open(path + ".part", "w") as file:
+        file.write(text)
+    os.replace(path + ".part", path)
+
+def csv_text(rows):
+    out = io.StringIO()
+    cli.write_rows(rows, out)
+    return out.getvalue()
+
+##################################################################
+# ranking_lines
+# The command 4 and 5 listings for one camera type, as the menu prints them.
+def ranking_lines(rows, kind, value):
+    return [f"  {row['intersection']} ({row['intersection_id']}) : {value(row)} ({row['percentage']:.3f}%)"
+            for row in rows if row["type"] == kind]
+
+##################################################################
+# write_output
+# Writes one output's files from its part of the query result. Returns (task, seconds).
+def write_output(job):
+    task, data = job
+    kind, argument = task
+    start = time.perf_counter()
+    files = [os.path.join(_worker["folder"], name) for name in outputs(task, _worker["format"])]
+    names = {"red": "Red Light", "speed": "Speed"}
+
+    if kind == "stats":
+        write_text(files[0], "\n".join([
+            "General Statistics:",
+            f"  Number of Red Light Cameras: {data['red_cameras']:,}",
+            f"  Number of Speed Cameras: {data['speed_cameras']:,}",
+            f"  Number of Red Light Camera Violation Entries: {data['red_entries']:,}",
+            f"  Number of Speed Camera Violation Entries: {data['speed_entries']:,}",
+            f"  Range of Dates in the Database: {data['start_date']} - {data['end_date']}",
+            f"  Total Number of Red Light Camera Violations: {data['red_violations']:,}",
+            f"  Total Number of Speed Camera Violations: {data['speed_violations']:,}"]) + "\n")
+    elif kind == "cameras-per-intersection":
+        lines = []
+        for camera_kind in api.KINDS:
+            lines += [f"Number of {names[camera_kind]} Cameras at Each Intersection"]
+            lines += ranking_lines(data, camera_kind, lambda row: row["cameras"]) + [""]
+        write_text(files[0], "\n".join(lines))
+        write_text(files[1], csv_text(data))
+    elif kind == "camera-years":
+        write_text(files[0], csv_text(data))
+    elif kind == "violations-by-intersection":
+        rows, totals = data
+        lines = []
+        for camera_kind in api.KINDS:
+            lines += [f"Number of {names[camera_kind]} Violations at Each Intersection for {argument}"]
+            lines += ranking_lines(rows, camera_kind, lambda row: f"{row['violations']:,}")
+            lines += [f"Total {names[camera_kind]} Violations in {argument} : {totals[camera_kind]:,}", ""]
+        write_text(files[0], "\n".join(lines))
+        write_text(files[1], csv_text(rows))
+    elif kind == "daily":
+        import numpy as np
+
+        dates = np.arange(f"{argument}-01-01", f"{int(argument) + 1}-01-01", dtype="datetime64[D]")
+        write_text(files[0], csv_text({"date": date, "red": red, "speed": speed} for date, red, speed
+                                      in zip(np.datetime_as_string(dates).tolist(), data["red"].tolist(),
+                                             data["speed"].tolist())))
+        charts.save("daily", files[1] + ".part." + _worker["format"], argument, data["red"], data["speed"])
+        os.replace(files[1] + ".part." + _worker["format"], files[1])
+    else:
+        charts.save("yearly", files[0] + ".part." + _worker["format"], argument, data)
+        os.replace(files[0] + ".part." + _worker["format"], files[0])
+    return task, time.perf_counter() - start
+
+##################################################################
+# generate
+# Writes the report for first_year to last_year into folder, skipping outputs already
+# written. Returns the timings: {"plan": seconds, "queries": {name: [count, seconds]},
+# "outputs": {kind: [count, seconds]}, "skipped": count, "query_seconds",
+# "output_seconds", "shared": outputs per query}.
+def generate(path, folder, first_year=2014, last_year=2024, workers=None, image_format="png"):
+    import concurrent.futures
+
+    start = time.perf_counter()
+    dbConn = api.open_database(path) # Makes sure the rollups are built before the workers read them
+    tasks = plan(dbConn, first_year, last_year)
+    dbConn.close()
+    os.makedirs(os.path.join(folder, "charts"), exist_ok=True)
+    pending = [task for task in tasks
+               if not all(os.path.exists(os.path.join(folder, name)) for name in outputs(task, image_format))]
+    keys = list(dict.fromkeys(needs(task, first_year, last_year) for task in pending))
+    timings = {"plan": time.perf_counter() - start, "queries": {}, "outputs": {}, "skipped": len(tasks) - len(pending),
+               "shared": len(pending) / max(len(keys), 1), "query_seconds": 0.0, "output_seconds": 0.0}
+    if not pending:
+        return timings
+
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+                                                initargs=(path, folder, image_format)) as pool:
+        start = time.perf_counter()
+        results = {}
+        for key, result, seconds in pool.map(run_query, keys):
+            results[key] = result
+            totals = timings["queries"].setdefault(key[0], [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        timings["query_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        jobs = [(task, extract(task, results[needs(task, first_year, last_year)])) for task in pending]
+        for task, seconds in pool.map(write_output, jobs, chunksize=max(1, len(jobs) // (workers * 8))):
+            totals = timings["outputs"].setdefault(task[0], [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+        timings["output_seconds"] = time.perf_counter() - start
+    return timings
+
+# main
+if __name__ == "__main__":
+    import argparse  # Only the command line needs these
+    import sys
+
+    parser = argparse.ArgumentParser(description="Generate the full report for every year and camera.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--out", default="reports", help="folder for the dated report folders (default: %(default)s)")
+    parser.add_argument("--date", default=datetime.date.today().isoformat(),
+                        help="report folder to write or resume (default: today, %(default)s)")
+    parser.add_argument("--first-year", type=int, default=2014)
+    parser.add_argument("--last-year", type=int, default=2024)
+    parser.add_argument("--workers", type=int, help="processes to run with (default: one per CPU)")
+    parser.add_argument("--format", choices=["png", "svg"], default="png", help="chart format (default: %(default)s)")
+    args = parser.parse_args()
+
+    folder = os.path.join(args.out, args.date)
+    start = time.perf_counter()
+    try:
+        timings = generate(args.db, folder, args.first_year, args.last_year, args.workers, args.format)
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; run again with --date {args.date} to finish the report in {folder}", file=sys.stderr)
+        sys.exit(130)
+    elapsed = time.perf_counter() - start
+
+    written = sum(count for count, seconds in timings["outputs"].values())
+    print(f"Report {folder}: {written:,} outputs written, {timings['skipped']:,} already there, "
+          f"{sum(count for count, seconds in timings['queries'].values()):,} queries "
+          f"({timings['shared']:.1f} outputs per query) in {elapsed:.1f} s")
+    print(f"  {'step':<28}{'count':>8}{'seconds':>10}")
+    print(f"  {'plan':<28}{'':>8}{timings['plan']:>10.2f}")
+    for step, totals, seconds in (("queries", timings["queries"], timings["query_seconds"]),
+                                  ("outputs", timings["outputs"], timings["output_seconds"])):
+        print(f"  {step:<28}{sum(count for count, seconds in totals.values()):>8,}{seconds:>10.2f}")
+        for name, (count, seconds) in totals.items():
+            print(f"    {name:<26}{count:>8,}{seconds:>10.2f}")
+    print("  (per-kind seconds are summed over the workers)")
@@ -0,0 +1,327 @@
+
+# Description:
+#   Summary tables of violation totals at day, month and year grain, keyed by camera and
+#   by intersection, plus citywide totals per day, so commands 5-8 don't have to
+#   aggregate the raw violation rows.
+#   Triggers on the violation and camera tables record which dates changed in
+#   Rollup_Dirty, and refresh() rebuilds only those dates (and the months and years
+#   that contain them). The first refresh on a database builds everything. Dates in
+#   years moved out to shard files (see shards.py) are read from the shard of their year,
+#   and a database migrated by compact.py is read by day number.
+
+import datetime
+import json
+import sqlite3
+
+import compact
+import queries
+
+ROLLUP_TABLES = """
+    CREATE TABLE IF NOT EXISTS Rollup_Dirty (
+        Kind TEXT NOT NULL, Day TEXT NOT NULL,
+        PRIMARY KEY (Kind, Day)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Day (
+        Kind TEXT NOT NULL, Day TEXT NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Day)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Camera_Day (
+        Kind TEXT NOT NULL, Day TEXT NOT NULL, Camera_ID {camera_type} NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Day, Camera_ID)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Camera_Month (
+        Kind TEXT NOT NULL, Camera_ID {camera_type} NOT NULL, Year TEXT NOT NULL, Month TEXT NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Camera_ID, Year, Month)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Camera_Year (
+        Kind TEXT NOT NULL, Camera_ID {camera_type} NOT NULL, Year TEXT NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Camera_ID, Year)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Intersection_Day (
+        Kind TEXT NOT NULL, Day TEXT NOT NULL, Intersection_ID {intersection_type} NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Day, Intersection_ID)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Intersection_Month (
+        Kind TEXT NOT NULL, Intersection_ID {intersection_type} NOT NULL, Year TEXT NOT NULL, Month TEXT NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Intersection_ID, Year, Month)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS Rollup_Intersection_Year (
+        Kind TEXT NOT NULL, Year TEXT NOT NULL, Intersection_ID {intersection_type} NOT NULL, Num_Violations INTEGER,
+        PRIMARY KEY (Kind, Year, Intersection_ID)) WITHOUT ROWID;
+"""
+
+ROLLUP_NAMES = ["Rollup_Dirty", "Rollup_Day", "Rollup_Camera_Day", "Rollup_Camera_Month", "Rollup_Camera_Year",
+                "Rollup_Intersection_Day", "Rollup_Intersection_Month", "Rollup_Intersection_Year"]
+
+# Marks the dates touched by any change to a violation table, and every date of a camera
+# whose intersection changes, as needing to be rebuilt (compact.DIRTY_TRIGGERS replaces
+# the violation table ones in a database migrated by compact.py)
+VIOLATION_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS rollup_{violations}_insert AFTER INSERT ON {violations}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', NEW.Violation_Date);
+    END;
+    CREATE TRIGGER IF NOT EXISTS rollup_{violations}_delete AFTER DELETE ON {violations}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', OLD.Violation_Date);
+    END;
+    CREATE TRIGGER IF NOT EXISTS rollup_{violations}_update AFTER UPDATE ON {violations}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', OLD.Violation_Date);
+        INSERT OR IGNORE INTO Rollup_Dirty VALUES ('{kind}', NEW.Violation_Date);
+    END;
+"""
+
+CAMERA_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS rollup_{cameras}_insert AFTER INSERT ON {cameras}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Violation_Date FROM {violations} WHERE Camera_ID = NEW.Camera_ID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS rollup_{cameras}_delete AFTER DELETE ON {cameras}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Violation_Date FROM {violations} WHERE Camera_ID = OLD.Camera_ID;
+    END;
+    CREATE TRIGGER IF NOT EXISTS rollup_{cameras}_update AFTER UPDATE OF Camera_ID, Intersection_ID ON {cameras}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Violation_Date FROM {violations} WHERE Camera_ID IN (OLD.Camera_ID, NEW.Camera_ID);
+    END;
+"""
+
+# Rebuilds the camera/day rollup for every dirty date of one camera type
+CAMERA_DAY_REFRESH = """
+    INSERT INTO Rollup_Camera_Day (Kind, Day, Camera_ID, Num_Violations)
+    SELECT ?, Violation_Date, Camera_ID, SUM(Num_Violations)
+    FROM {violations}
+    WHERE Violation_Date IN (SELECT Day FROM Rollup_Dirty WHERE Kind = ?)
+    GROUP BY Violation_Date, Camera_ID"""
+
+# The same totals from a year shard (see shards.py), for the dirty dates passed as a JSON
+# list, since the shard's own connection can't see Rollup_Dirty. They are added to the
+# totals from the main file, which can still hold rows for a sharded year.
+SHARD_CAMERA_DAY = """
+    SELECT Violation_Date, Camera_ID, SUM(Num_Violations)
+    FROM {violations}
+    WHERE Violation_Date IN (SELECT value FROM json_each(?))
+    GROUP BY Violation_Date, Camera_ID"""
+
+SHARD_CAMERA_DAY_ADD = """
+    INSERT INTO Rollup_Camera_Day (Kind, Day, Camera_ID, Num_Violations) VALUES (?, ?, ?, ?)
+    ON CONFLICT (Kind, Day, Camera_ID) DO UPDATE SET Num_Violations = Num_Violations + excluded.Num_Violations"""
+
+DAY_REFRESH = """
+    INSERT INTO Rollup_Day (Kind, Day, Num_Violations)
+    SELECT ?, Day, SUM(Num_Violations)
+    FROM Rollup_Camera_Day
+    WHERE Kind = ? AND Day IN (SELECT Day FROM Rollup_Dirty WHERE Kind = ?)
+    GROUP BY Day"""
+
+INTERSECTION_DAY_REFRESH = """
+    INSERT INTO Rollup_Intersection_Day (Kind, Day, Intersection_ID, Num_Violations)
+    SELECT ?, Rollup_Camera_Day.Day, {cameras}.Intersection_ID, SUM(Rollup_Camera_Day.Num_Violations)
+    FROM Rollup_Camera_Day
+    JOIN {cameras} ON Rollup_Camera_Day.Camera_ID = {cameras}.Camera_ID
+    WHERE Rollup_Camera_Day.Kind = ? AND Rollup_Camera_Day.Day IN (SELECT Day FROM Rollup_Dirty WHERE Kind = ?)
+    GROUP BY Rollup_Camera_Day.Day, {cameras}.Intersection_ID"""
+
+# Rebuild one month (given its day range) and one year from the finer grain
+CAMERA_MONTH_REFRESH = """
+    INSERT INTO Rollup_Camera_Month (Kind, Camera_ID, Year, Month, Num_Violations)
+    SELECT ?, Camera_ID, ?, ?, SUM(Num_Violations)
+    FROM Rollup_Camera_Day
+    WHERE Kind = ? AND Day >= ? AND Day < ?
+    GROUP BY Camera_ID"""
+
+INTERSECTION_MONTH_REFRESH = """
+    INSERT INTO Rollup_Intersection_Month (Kind, Intersection_ID, Year, Month, Num_Violations)
+    SELECT ?, Intersection_ID, ?, ?, SUM(Num_Violations)
+    FROM Rollup_Intersection_Day
+    WHERE Kind = ? AND Day >= ? AND Day < ?
+    GROUP BY Intersection_ID"""
+
+CAMERA_YEAR_REFRESH = """
+    INSERT INTO Rollup_Camera_Year (Kind, Camera_ID, Year, Num_Violations)
+    SELECT ?, Camera_ID, ?, SUM(Num_Violations)
+    FROM Rollup_Camera_Month
+    WHERE Kind = ? AND Year = ?
+    GROUP BY Camera_ID"""
+
+INTERSECTION_YEAR_REFRESH = """
+    INSERT INTO Rollup_Intersection_Year (Kind, Year, Intersection_ID, Num_Violations)
+    SELECT ?, ?, Intersection_ID, SUM(Num_Violations)
+    FROM Rollup_Intersection_Month
+    WHERE Kind = ? AND Year = ?
+    GROUP BY Intersection_ID"""
+
+##################################################################
+# column_type
+# Returns the declared type of a column so the rollup keys compare the same way the
+# source columns do (e.g. a camera ID typed in as text still matches an INTEGER column).
+def column_type(dbConn, table, column):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(f"PRAGMA table_info({table})")
+    for row in dbCursor.fetchall():
+        if row[1] == column:
+            return row[2]
+    return ""
+
+##################################################################
+# is_built
+# Given connection to database, returns True if all the rollup tables have been created.
+# A database built before a rollup table was added gets rebuilt in full.
+def is_built(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ({})".format(
+        ", ".join("?" for name in ROLLUP_NAMES)), ROLLUP_NAMES)
+    return dbCursor.fetchone()[0] == len(ROLLUP_NAMES)
+
+##################################################################
+# create
+# Creates the rollup tables and triggers, and marks every date in the violation tables
+# dirty so the next refresh builds the rollups from scratch.
+def create(dbConn):
+    script = ROLLUP_TABLES.format(
+        camera_type=column_type(dbConn, "RedCameras", "Camera_ID"),
+        intersection_type=column_type(dbConn, "Intersections", "Intersection_ID"))
+
+    import indexes  # indexes.py imports this module
+
+    # The rollup tables' indexes, built while the tables are empty
+    for name, table, columns in indexes.INDEXES:
+        if table.startswith("Rollup_"):
+            script += f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});"
+
+    for kind, (violations, cameras) in queries.TABLES.items():
+        days = compact.compact_table(dbConn, violations)
+        if days:
+            script += compact.DIRTY_TRIGGERS.format(kind=kind, days=days)
+        else:
+            script += VIOLATION_TRIGGERS.format(kind=kind, violations=violations)
+        script += CAMERA_TRIGGERS.format(kind=kind, violations=violations, cameras=cameras)
+        script += f"""
+            INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Violation_Date FROM {violations} WHERE Violation_Date IS NOT NULL;"""
+
+    # One transaction, so a half-finished create never looks like a built rollup
+    dbConn.cursor().executescript("BEGIN IMMEDIATE;" + script + "COMMIT;")
+
+##################################################################
+# month_bounds
+# Given "YYYY-MM", returns the half-open day range (start, end) covering that month.
+def month_bounds(month):
+    year, mon = int(month[:4]), int(month[5:7])
+    start = datetime.date(year, mon, 1)
+    end = datetime.date(year + 1, 1, 1) if mon == 12 else datetime.date(year, mon + 1, 1)
+    return (start.isoformat(), end.isoformat())
+
+##################################################################
+# add_shards
+# Adds the camera/day totals of the given dirty dates held in year shards, reading only
+# the shards of the years those dates fall in.
+def add_shards(dbConn, kind, days):
+    import shards
+
+    by_year = {}
+    for day in days:
+        if day:
+            by_year.setdefault(day[:4], []).append(day)
+    sharded = {year: path for year, path in shards.of_connection(dbConn).items() if year in by_year}
+    if not sharded:
+        return
+
+    def camera_days(shardConn, year):
+        shardCursor = shardConn.cursor()
+        shardCursor.execute(SHARD_CAMERA_DAY.format(violations=queries.TABLES[kind][0]), (json.dumps(by_year[year]),))
+        return shardCursor.fetchall()
+
+    dbCursor = dbConn.cursor()
+    for rows in shards.map_shards(sharded, camera_days):
+        dbCursor.executemany(SHARD_CAMERA_DAY_ADD, [(kind, *row) for row in rows])
+
+##################################################################
+# refresh_kind
+# Rebuilds the rollups of one camera type ("red" or "speed") for its dirty dates, then
+# the months and years containing them. Returns the number of dates rebuilt.
+def refresh_kind(dbConn, kind):
+    violations, cameras = queries.TABLES[kind]
+    dbCursor = dbConn.cursor()
+
+    dbCursor.execute("SELECT Day FROM Rollup_Dirty WHERE Kind = ?", (kind,))
+    days = [row[0] for row in dbCursor.fetchall()]
+    if not days:
+        return 0
+
+    # Daily grain: replace the rows of every dirty date
+    for table in ("Rollup_Day", "Rollup_Camera_Day", "Rollup_Intersection_Day"):
+        dbCursor.execute(f"""
+            DELETE FROM {table}
+            WHERE Kind = ? AND Day IN (SELECT Day FROM Rollup_Dirty WHERE Kind = ?)""", (kind, kind))
+    days_table = compact.compact_table(dbConn, violations)
+    if days_table:
+        dbCursor.execute(compact.CAMERA_DAY_REFRESH.format(days=days_table), (kind, kind))
+    else:
+        dbCursor.execute(CAMERA_DAY_REFRESH.format(violations=violations), (kind, kind))
+    add_shards(dbConn, kind, days)
+    dbCursor.execute(DAY_REFRESH, (kind, kind, kind))
+    dbCursor.execute(INTERSECTION_DAY_REFRESH.format(cameras=cameras), (kind, kind, kind))
+
+    # Monthly grain: rebuild every month containing a dirty date
+    months = sorted({day[:7] for day in days if len(day) >= 7})
+    for month in months:
+        year, mon = month[:4], month[5:7]
+        start, end = month_bounds(month)
+        for table in ("Rollup_Camera_Month", "Rollup_Intersection_Month"):
+            dbCursor.execute(f"DELETE FROM {table} WHERE Kind = ? AND Year = ? AND Month = ?", (kind, year, mon))
+        dbCursor.execute(CAMERA_MONTH_REFRESH, (kind, year, mon, kind, start, end))
+        dbCursor.execute(INTERSECTION_MONTH_REFRESH, (kind, year, mon, kind, start, end))
+
+    # Yearly grain: rebuild every year containing a dirty month
+    for year in sorted({month[:4] for month in months}):
+        for table in ("Rollup_Camera_Year", "Rollup_Intersection_Year"):
+            dbCursor.execute(f"DELETE FROM {table} WHERE Kind = ? AND Year = ?", (kind, year))
+        dbCursor.execute(CAMERA_YEAR_REFRESH, (kind, year, kind, year))
+        dbCursor.execute(INTERSECTION_YEAR_REFRESH, (kind, year, kind, year))
+
+    dbCursor.execute("DELETE FROM Rollup_Dirty WHERE Kind = ?", (kind,))
+    return len(days)
+
+##################################################################
+# refresh
+# Given connection to database, builds the rollups if they don't exist yet and otherwise
+# brings them up to date with any violations added, changed or removed since the last
+# refresh. Returns the number of dates rebuilt. If another connection is writing (an
+# ingest, say) or the database is read-only, the rollups are left as they are rather
+# than making the caller wait; the dirty dates stay marked for the next refresh.
+def refresh(dbConn):
+    dbCursor = dbConn.cursor()
+    if is_built(dbConn):
+        dbCursor.execute("SELECT COUNT(*) FROM Rollup_Dirty")
+        if dbCursor.fetchone()[0] == 0:
+            return 0
+
+    dbCursor.execute("PRAGMA busy_timeout")
+    busy_timeout = dbCursor.fetchone()[0]
+    dbCursor.execute("PRAGMA busy_timeout = 0")
+    try:
+        if not is_built(dbConn):
+            create(dbConn)
+
+        rebuilt = 0
+        for kind in queries.TABLES:
+            rebuilt += refresh_kind(dbConn, kind)
+        dbConn.commit()
+        return rebuilt
+    except sqlite3.OperationalError as error:
+        if "locked" not in str(error) and "readonly" not in str(error):
+            raise
+        dbConn.rollback()
+        return 0
+    finally:
+        dbCursor.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+##################################################################
+# refresh_queries
+# Lists the refresh queries that read the raw violation tables as (label, sql, sample
+# parameters), for the query plan check in indexes.py.
+def refresh_queries(dbConn):
+    checks = []
+    for kind, (violations, cameras) in queries.TABLES.items():
+        days = compact.compact_table(dbConn, violations)
+        sql = compact.CAMERA_DAY_REFRESH.format(days=days) if days else CAMERA_DAY_REFRESH.format(violations=violations)
+        checks.append((f"rollup refresh {kind}", sql, (kind, kind)))
+    return checks
@@ -0,0 +1,105 @@
+
+# Description:
+#   FTS5 trigram indexes over intersection names and camera addresses, so the name and
+#   street lookups of commands 1, 2 and 9 don't have to scan the tables with LIKE. Each
+#   index row shares its rowid with the row it indexes, and triggers keep the indexes in
+#   step with Intersections, RedCameras and SpeedCameras. The trigram tokenizer answers
+#   LIKE patterns (including the _ and % wildcards) from the index whenever the pattern
+#   has three or more characters in a row, and ranked() orders free-text matches with bm25.
+
+import sqlite3
+
+# Search table -> (source table, indexed column)
+SEARCH_TABLES = {
+    "Search_Intersections": ("Intersections", "Intersection"),
+    "Search_RedCameras": ("RedCameras", "Address"),
+    "Search_SpeedCameras": ("SpeedCameras", "Address"),
+}
+
+SEARCH_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {search} USING fts5({column}, tokenize = 'trigram');
+    CREATE TRIGGER IF NOT EXISTS {search}_insert AFTER INSERT ON {source}
+    BEGIN
+        INSERT INTO {search} (rowid, {column}) VALUES (NEW.rowid, NEW.{column});
+    END;
+    CREATE TRIGGER IF NOT EXISTS {search}_delete AFTER DELETE ON {source}
+    BEGIN
+        DELETE FROM {search} WHERE rowid = OLD.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {search}_update AFTER UPDATE OF {column} ON {source}
+    BEGIN
+        DELETE FROM {search} WHERE rowid = OLD.rowid;
+        INSERT INTO {search} (rowid, {column}) VALUES (NEW.rowid, NEW.{column});
+    END;
+    DELETE FROM {search};
+    INSERT INTO {search} (rowid, {column}) SELECT rowid, {column} FROM {source};
+"""
+
+##################################################################
+# is_built
+# Given connection to database, returns True if the search tables have been created.
+def is_built(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN ({})".format(
+        ", ".join("?" for search in SEARCH_TABLES)), tuple(SEARCH_TABLES))
+    return dbCursor.fetchone()[0] == len(SEARCH_TABLES)
+
+##################################################################
+# ensure
+# Given connection to database, creates and fills the search tables and their triggers
+# if they don't exist yet. Skipped (and the commands fall back to LIKE on the tables
+# themselves) when the database is read-only or another connection is writing.
+def ensure(dbConn):
+    if is_built(dbConn):
+        return False
+
+    script = "".join(SEARCH_TABLE.format(search=search, source=source, column=column)
+                     for search, (source, column) in SEARCH_TABLES.items())
+    try:
+        dbConn.cursor().executescript("BEGIN IMMEDIATE;" + script + "COMMIT;")
+    except sqlite3.OperationalError as error:
+        if "locked" not in str(error) and "readonly" not in str(error):
+            raise
+        dbConn.rollback()
+        return False
+    return True
+
+##################################################################
+# like_source
+# Returns (FROM clause, column) for running "column LIKE ?" against a source table's
+# indexed column: through its search table when the search tables are built, and on the
+# table itself otherwise. The FROM clause always makes the source table's columns available.
+def like_source(dbConn, source):
+    for search, (table, column) in SEARCH_TABLES.items():
+        if table == source:
+            break
+    if not is_built(dbConn):
+        return source, f"{source}.{column}"
+    return f"{search} JOIN {source} ON {source}.rowid = {search}.rowid", f"{search}.{column}"
+
+##################################################################
+# ranked
+# Given connection to database and free text (at least 3 characters), returns the
+# intersections and camera addresses containing it, best match first, as rows of
+# {"type", "id", "name", "rank"}. type is "intersection", "red" or "speed".
+def ranked(dbConn, text, limit=20):
+    phrase = '"' + text.replace('"', '""') + '"'
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("""
+        SELECT 'intersection', Intersections.Intersection_ID, Intersections.Intersection, Search_Intersections.rank
+        FROM Search_Intersections
+        JOIN Intersections ON Intersections.rowid = Search_Intersections.rowid
+        WHERE Search_Intersections MATCH ?
+        UNION ALL
+        SELECT 'red', RedCameras.Camera_ID, RedCameras.Address, Search_RedCameras.rank
+        FROM Search_RedCameras
+        JOIN RedCameras ON RedCameras.rowid = Search_RedCameras.rowid
+        WHERE Search_RedCameras MATCH ?
+        UNION ALL
+        SELECT 'speed', SpeedCameras.Camera_ID, SpeedCameras.Address, Search_SpeedCameras.rank
+        FROM Search_SpeedCameras
+        JOIN SpeedCameras ON SpeedCameras.rowid = Search_SpeedCameras.rowid
+        WHERE Search_SpeedCameras MATCH ?
+        ORDER BY 4 ASC
+        LIMIT ?""", (phrase, phrase, phrase, limit))
+    return [{"type": row[0], "id": row[1], "name": row[2], "rank": row[3]} for row in dbCursor.fetchall()]
@@ -0,0 +1,143 @@
+
+# Description:
+#   Local HTTP service exposing each query in api.py as a JSON endpoint, so dashboards can
+#   run the menu's analyses concurrently. Endpoints are the command-line subcommands with
+#   their options as query parameters, e.g.
+#       GET /violations-by-year?camera=1503
+#       GET /violations-by-month?camera=1503&year=2023
+#       GET /stats
+#   Requests are handled on separate threads and each one borrows a connection from a
+#   bounded pool of read-only (mode=ro) connections; if none frees up within the pool
+#   timeout the request gets a 503.
+#
+#   python server.py [--db FILE] [--host 127.0.0.1] [--port 8341] [--pool-size 8]
+
+import argparse
+import http.server
+import json
+import queue
+import sqlite3
+import traceback
+import urllib.parse
+
+import api
+import cli
+import parallel
+import stats
+
+##################################################################
+# ConnectionPool
+# A fixed number of read-only connections shared by the request threads.
+class ConnectionPool:
+    def __init__(self, path, size, timeout=5.0):
+        self.timeout = timeout
+        self.connections = queue.Queue()
+        uri = f"file:{urllib.parse.quote(path)}?mode=ro"
+        for i in range(size):
+            self.connections.put(sqlite3.connect(uri, uri=True, check_same_thread=False))
+
+    def acquire(self):
+        return self.connections.get(timeout=self.timeout)
+
+    def release(self, dbConn):
+        self.connections.put(dbConn)
+
+    def close(self):
+        while not self.connections.empty():
+            self.connections.get().close()
+
+##################################################################
+# run_endpoint
+# Runs the query for a request path and parameters on a connection. Returns
+# (HTTP status, response object).
+def run_endpoint(dbConn, name, params):
+    if name == "stats":
+        return 200, stats.load(dbConn)
+    if name not in cli.COMMANDS:
+        return 404, {"error": f"unknown endpoint /{name}", "endpoints": ["stats"] + list(cli.COMMANDS)}
+
+    function, help_text, options = cli.COMMANDS[name]
+    names = [option.lstrip("-") for option, option_help in options]
+    missing = [name for name in names if name not in params]
+    if missing:
+        return 400, {"error": f"missing parameter(s): {', '.join(missing)}"}
+    try:
+        return 200, {"rows": function(dbConn, *[params[name][0] for name in names])}
+    except api.QueryError as error:
+        return 400, {"error": str(error)}
+
+##################################################################
+# QueryHandler
+# Handles GET requests by running the matching endpoint on a pooled connection.
+class QueryHandler(http.server.BaseHTTPRequestHandler):
+    pool = None
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        name = url.path.strip("/")
+        params = urllib.parse.parse_qs(url.query, keep_blank_values=True)
+
+        try:
+            dbConn = self.pool.acquire()
+        except queue.Empty:
+            self.send_json(503, {"error": "all database connections are busy"})
+            return
+        try:
+            status, body = run_endpoint(dbConn, name, params)
+        except sqlite3.Error as error:
+            status, body = 500, {"error": str(error)}
+        except Exception as error:  # A bug shouldn't leave the client without a response
+            traceback.print_exc()
+            status, body = 500, {"error": f"internal error: {type(error).__name__}: {error}"}
+        finally:
+            self.pool.release(dbConn)
+        self.send_json(status, body)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet under load
+
+##################################################################
+# QueryServer
+# Threaded HTTP server with a listen backlog large enough for bursts of clients.
+class QueryServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+##################################################################
+# serve
+# Prepares the database (indexes, rollups, search and location indexes) on a normal
+# connection, then serves requests from a pool of read-only ones until interrupted.
+def serve(path, host, port, pool_size):
+    api.open_database(path).close()
+
+    # Requests already run concurrently, so each one runs its red/speed halves serially
+    parallel.WORKERS = 1
+
+    QueryHandler.pool = ConnectionPool(path, pool_size)
+    httpd = QueryServer((host, port), QueryHandler)
+    print(f"Serving {path} on http://{host}:{port}/ with {pool_size} read-only connections")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        QueryHandler.pool.close()
+
+# main
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the traffic camera queries as JSON over HTTP.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8341)
+    parser.add_argument("--pool-size", type=int, default=8, help="read-only connections (default: %(default)s)")
+    args = parser.parse_args()
+    serve(args.db, args.host, args.port, args.pool_size)
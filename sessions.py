@@ -0,0 +1,245 @@
+
+# Description:
+#   Record and replay of menu sessions, for load testing the menu with the way it is
+#   really used rather than with single queries. With TRAFFIC_RECORD=<file> set,
+#   python main.py records every line typed at the menu and its prompts, with how long
+#   the user took to type it, and appends the session to the file as one JSON line
+#   ({"recorded", "database", "inputs": [[seconds, line], ...]}) when the program ends.
+#
+#   python sessions.py FILE [--db FILE] [--workers N] [--repeat 1] [--think 0]
+#                      [--out results.json] [--compare baseline.json] [--threshold 1.2]
+#   replays the recorded sessions against a database across worker processes. Each
+#   worker opens the database as the menu does and runs main.py's commands on the
+#   session's input (output discarded), starting every session with print_stats and an
+#   empty query cache, as a new menu would. The report gives the throughput (commands
+#   per second over all workers) and each command's latency distribution, counting only
+#   the time spent in the command, not waiting for input. --think replays the recorded
+#   typing delays scaled by that factor (0, the default, replays as fast as possible).
+#   --compare flags the commands whose p50 or p99 latency is more than --threshold times
+#   the baseline's (and a throughput below the baseline's divided by it), and exits with
+#   1 if there are any.
+
+import atexit
+import builtins
+import contextlib
+import datetime
+import json
+import os
+import time
+
+import api
+import cache
+import instrument
+import registry
+
+# Latency changes smaller than this many milliseconds are never flagged, however large
+# the ratio (sub-millisecond commands vary more than that from run to run)
+MIN_CHANGE_MS = 1.0
+
+##################################################################
+# Recorder
+# Records the lines typed into a session; main.py uses its input in place of the
+# built-in one. The session is appended to path when the program exits.
+class Recorder:
+    def __init__(self, path):
+        self.path = path
+        self.recorded = datetime.datetime.now().isoformat(timespec="seconds")
+        self.inputs = []
+        atexit.register(self.save)
+
+    def input(self, prompt=""):
+        start = time.monotonic()
+        line = builtins.input(prompt)
+        self.inputs.append([round(time.monotonic() - start, 3), line])
+        return line
+
+    def save(self):
+        if self.inputs:
+            with open(self.path, "a") as file:
+                file.write(json.dumps({"recorded": self.recorded, "database": os.path.abspath(api.DATABASE),
+                                       "inputs": self.inputs}) + "\n")
+
+##################################################################
+# load
+# Reads the recorded sessions in a file. Returns the input list of each.
+def load(path):
+    with open(path) as file:
+        return [json.loads(line)["inputs"] for line in file if line.strip()]
+
+##################################################################
+# Replay worker
+# Each worker process runs the menu's commands on its own connection, as one menu would.
+_worker = {}
+
+def start_worker(path, think):
+    os.environ.setdefault("MPLBACKEND", "Agg")  # A "y" to a plot prompt draws without a window
+    import main  # Not at the top: main.py imports this module to record
+
+    main.dbConn = api.open_database(path)
+    _worker.update(think=think)
+
+##################################################################
+# replay
+# Runs one session's inputs through the menu loop. Returns ([(command, seconds)], whether
+# it ended with an error rather than with its input).
+def replay(inputs):
+    import main
+
+    lines = iter(inputs)
+    waited = [0.0]
+
+    def feed(prompt=""):
+        try:
+            seconds, line = next(lines)
+        except StopIteration:
+            raise EOFError from None  # As input() does when a recorded session ended without x
+        if _worker["think"]:
+            time.sleep(seconds * _worker["think"])
+            waited[0] += seconds * _worker["think"]
+        return line
+
+    def timed(name, command):
+        waited[0] = 0.0
+        start = time.perf_counter()
+        command()
+        timings.append((name, time.perf_counter() - start - waited[0]))
+
+    main.input = instrument.timed_input(feed) # As main.py wraps input
+    main.run = True
+    cache.RESULTS.clear()
+    registry.clear()
+    timings = []
+    try:
+        timed("print_stats", lambda: main.print_stats(main.dbConn))
+        while main.run:
+            command = main.MENU.get(feed(), main.commandError)
+            timed(command.__name__, command)
+    except EOFError:
+        return timings, False
+    except Exception:  # A command failed; the rest of the session would be out of step
+        return timings, True
+    return timings, False
+
+##################################################################
+# replay_sessions
+# Replays a worker's share of the sessions. Returns (timings, sessions with an error,
+# start, end), the times on the monotonic clock all the workers share.
+def replay_sessions(sessions):
+    timings = []
+    errors = 0
+    start = time.monotonic()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        for inputs in sessions:
+            session_timings, failed = replay(inputs)
+            timings += session_timings
+            errors += failed
+    return timings, errors, start, time.monotonic()
+
+##################################################################
+# run
+# Replays the sessions repeat times over workers processes against the database at path.
+# Returns the results document.
+def run(path, sessions, workers=None, repeat=1, think=0.0):
+    import concurrent.futures
+
+    import loadtest
+
+    api.open_database(path).close()  # Builds indexes and summary tables before the workers start
+    workers = workers or os.cpu_count()
+    queue = sessions * repeat
+    shares = [queue[i::workers] for i in range(workers) if queue[i::workers]]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(shares), initializer=start_worker,
+                                                initargs=(path, think)) as pool:
+        results = list(pool.map(replay_sessions, shares))
+
+    latencies = {}
+    for timings, errors, start, end in results:
+        for name, seconds in timings:
+            latencies.setdefault(name, []).append(seconds * 1000)
+    seconds = (max(end for timings, errors, start, end in results)
+               - min(start for timings, errors, start, end in results))
+    commands = sum(len(values) for values in latencies.values())
+
+    summary = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        summary[name] = {"count": len(values), "mean": sum(values) / len(values),
+                         "p50": loadtest.percentile(values, 50), "p90": loadtest.percentile(values, 90),
+                         "p99": loadtest.percentile(values, 99), "max": values[-1]}
+    return {
+        "database": os.path.abspath(path),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "sessions": len(queue),
+        "workers": len(shares),
+        "think": think,
+        "errors": sum(errors for timings, errors, start, end in results),
+        "commands": commands,
+        "seconds": seconds,
+        "throughput": commands / max(seconds, 1e-9),
+        "latency_ms": summary,
+    }
+
+##################################################################
+# regressions
+# Returns the names of the commands (and "throughput") that got worse than the baseline
+# document by more than threshold times (and, for latency, by at least MIN_CHANGE_MS).
+def regressions(document, baseline, threshold):
+    found = [name for name, latency in document["latency_ms"].items() if name in baseline["latency_ms"]
+             and any(latency[p] > threshold * baseline["latency_ms"][name][p]
+                     and latency[p] - baseline["latency_ms"][name][p] >= MIN_CHANGE_MS for p in ("p50", "p99"))]
+    if document["throughput"] * threshold < baseline["throughput"]:
+        found.append("throughput")
+    return found
+
+##################################################################
+# report
+# Prints throughput and the latency table, with the change in p50 from a baseline if given.
+def report(document, baseline=None, flagged=()):
+    print(f"{document['sessions']:,} sessions, {document['commands']:,} commands on {document['workers']} workers "
+          f"in {document['seconds']:.2f} s: {document['throughput']:,.1f} commands/sec, "
+          f"{document['errors']:,} sessions failed"
+          + (f" (baseline {baseline['throughput']:,.1f} commands/sec)" if baseline else ""))
+    print(f"{'command':<14}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          + (f"{'p50 vs. base':>14}" if baseline else ""))
+    for name, latency in document["latency_ms"].items():
+        line = (f"{name:<14}{latency['count']:>8,}{latency['mean']:>10.2f}{latency['p50']:>10.2f}"
+                f"{latency['p90']:>10.2f}{latency['p99']:>10.2f}{latency['max']:>10.2f}")
+        if baseline and name in baseline["latency_ms"]:
+            line += f"{latency['p50'] / max(baseline['latency_ms'][name]['p50'], 1e-3):>13.2f}x"
+        print(line + ("  REGRESSION" if name in flagged else ""))
+    if "throughput" in flagged:
+        print("Throughput REGRESSION")
+
+# main
+if __name__ == "__main__":
+    import argparse  # Only the command line needs these
+    import sys
+
+    parser = argparse.ArgumentParser(description="Replay recorded menu sessions in parallel and report their latency.")
+    parser.add_argument("sessions", help="file of sessions recorded with TRAFFIC_RECORD=<file> python main.py")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per CPU)")
+    parser.add_argument("--repeat", type=int, default=1, help="times to replay each session (default: %(default)s)")
+    parser.add_argument("--think", type=float, default=0.0,
+                        help="replay the recorded typing delays times this factor (default: %(default)s, no delays)")
+    parser.add_argument("--out", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="flag latency above (or throughput below) the baseline by this factor (default: %(default)s)")
+    args = parser.parse_args()
+
+    sessions = load(args.sessions)
+    if not sessions:
+        parser.exit(1, f"No sessions in {args.sessions}\n")
+    document = run(args.db, sessions, args.workers, args.repeat, args.think)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    flagged = regressions(document, baseline, args.threshold) if baseline else []
+    report(document, baseline, flagged)
+
+    if args.out:
+        with open(args.out, "w") as file:
+            json.dump(document, file, indent=2)
+    sys.exit(1 if flagged else 0)
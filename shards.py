@@ -0,0 +1,206 @@
+
+# Description:
+#   Optional year-partitioned storage for the violation tables. split() moves every
+#   violation of a finished year out of the main database into a shard file of its own,
+#   <database>-shards/<year>.db, with the same RedViolations/SpeedViolations tables and
+#   indexes, so the main file (and its VACUUM, reindex and backups) only grows with the
+#   years still receiving data. Each year is moved in one transaction with the shard
+#   ATTACHed to the main connection.
+#
+#   Cameras, intersections and the rollup tables stay in the main file, so commands 5-11
+#   never open a shard. The code that reads raw violation rows - the print_stats totals,
+#   command 3, the rollup refresh and the columnar export - reads the shards through one
+#   read-only connection per shard (rather than ATTACH, which is limited to 10 databases
+#   per connection): a single date or year opens only its own shard, and anything over
+#   the whole history fans out across the shards (in parallel if parallel.WORKERS is 2 or
+#   more) and merges the results.
+#
+#   ingest.py upserts violations for a year already in a shard into that shard. Rows for
+#   a sharded year written to the main file some other way stay there until the next
+#   split merges them into their shard, replacing rows for the same camera and date.
+#
+#   python shards.py [--db FILE] [--keep 1] [--vacuum]
+
+import os
+import re
+import sqlite3
+
+import api
+import compact
+import indexes
+import parallel
+import queries
+import rollups
+import stats
+
+SHARD_FILE = re.compile(r"(\d{4})\.db")
+
+# Shard schema: the violation tables and their indexes
+SHARD_SCHEMA = "".join(f"""
+    CREATE TABLE IF NOT EXISTS {violations} (Camera_ID INTEGER, Violation_Date TEXT, Num_Violations INTEGER);"""
+                       for violations, cameras in queries.TABLES.values()) + "".join(f"""
+    CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns});"""
+                       for name, table, columns in indexes.INDEXES if table.endswith("Violations"))
+
+# Marks the sharded days of a camera dirty when it is added, removed or moved to another
+# intersection, like rollups.CAMERA_TRIGGERS does for the days in the main file (whose
+# triggers can't see the shards). The days come from the camera/day rollup.
+SHARDED_CAMERA_TRIGGERS = """
+    CREATE TRIGGER rollup_{cameras}_insert_sharded AFTER INSERT ON {cameras}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Day FROM Rollup_Camera_Day
+            WHERE Kind = '{kind}' AND Camera_ID = NEW.Camera_ID AND Day < '{end}';
+    END;
+    CREATE TRIGGER rollup_{cameras}_delete_sharded AFTER DELETE ON {cameras}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Day FROM Rollup_Camera_Day
+            WHERE Kind = '{kind}' AND Camera_ID = OLD.Camera_ID AND Day < '{end}';
+    END;
+    CREATE TRIGGER rollup_{cameras}_update_sharded AFTER UPDATE OF Camera_ID, Intersection_ID ON {cameras}
+    BEGIN
+        INSERT OR IGNORE INTO Rollup_Dirty
+            SELECT DISTINCT '{kind}', Day FROM Rollup_Camera_Day
+            WHERE Kind = '{kind}' AND Camera_ID IN (OLD.Camera_ID, NEW.Camera_ID) AND Day < '{end}';
+    END;
+"""
+
+##################################################################
+# folder / shard_path
+# Where a database's shards are kept.
+def folder(path):
+    return path + "-shards"
+
+def shard_path(path, year):
+    return os.path.join(folder(path), f"{year}.db")
+
+##################################################################
+# years
+# Returns {year: shard file} for the shards of the database at path, in year order.
+def years(path):
+    if not path or not os.path.isdir(folder(path)):
+        return {}
+    found = {}
+    for name in sorted(os.listdir(folder(path))):
+        match = SHARD_FILE.fullmatch(name)
+        if match:
+            found[match.group(1)] = os.path.join(folder(path), name)
+    return found
+
+##################################################################
+# of_connection
+# Given connection to database, returns {year: shard file} for its shards.
+def of_connection(dbConn):
+    return years(stats.database_path(dbConn))
+
+##################################################################
+# map_shards
+# Runs function(connection, year) against each given shard ({year: file}) on its own
+# read-only connection (see parallel.map_files) and returns the results in year order.
+def map_shards(shards, function):
+    return parallel.map_files(list(shards.values()),
+                              lambda dbConn, path: function(dbConn, SHARD_FILE.fullmatch(os.path.basename(path)).group(1)))
+
+##################################################################
+# date_range
+# Given connection to database and a violation table, returns its (MIN, MAX) of
+# Violation_Date over the main file and the shards. Each end is an index lookup, and
+# only the shards needed to find it are opened (the first and last, unless they hold no
+# rows of that table).
+def date_range(dbConn, violations):
+    # Separate subqueries: SQLite only reads MIN or MAX straight from an index on its own
+    query = f"SELECT (SELECT MIN(Violation_Date) FROM {violations}), (SELECT MAX(Violation_Date) FROM {violations})"
+    days = compact.compact_table(dbConn, violations)
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(compact.DATE_RANGE.format(days=days) if days else query)
+    low, high = dbCursor.fetchone()
+
+    files = list(of_connection(dbConn).values())
+    for end, ordered in ((0, files), (1, files[::-1])):
+        for path in ordered:
+            value = parallel.read_only_connection(path).execute(query).fetchone()[end]
+            if value is not None:
+                low, high = (min(low or value, value), high) if end == 0 else (low, max(high or value, value))
+                break
+    return low, high
+
+##################################################################
+# split
+# Moves the violations of every year except the last keep years with violations from
+# the database at path into per-year shards. Returns {year: rows moved}.
+def split(path, keep=1, vacuum=False):
+    dbConn = api.open_database(path) # Brings the rollups up to date before any rows move
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(" UNION ".join(f"SELECT DISTINCT substr(Violation_Date, 1, 4) FROM {violations}"
+                                    for violations, cameras in queries.TABLES.values()) + " ORDER BY 1")
+    present = [row[0] for row in dbCursor.fetchall() if row[0] and row[0].isdigit()]
+    latest = max(present + list(years(path)) or ["0"])
+    move = [year for year in present if int(year) <= int(latest) - keep]
+
+    os.makedirs(folder(path), exist_ok=True)
+    moved = {}
+    for year in move:
+        start, end = queries.year_bounds(year)
+        shardConn = sqlite3.connect(shard_path(path, year))
+        shardConn.executescript(SHARD_SCHEMA)
+        shardConn.close()
+
+        dbCursor.execute("ATTACH DATABASE ? AS shard", (shard_path(path, year),))
+        try:
+            dbCursor.execute("BEGIN IMMEDIATE")
+            moved[year] = 0
+            for violations, cameras in queries.TABLES.values():
+                # Rows for a camera and date already in the shard are replaced by the newer ones
+                dbCursor.execute(f"""
+                    DELETE FROM shard.{violations}
+                    WHERE Violation_Date >= ? AND Violation_Date < ?
+                      AND EXISTS (SELECT 1 FROM main.{violations} AS New
+                                  WHERE New.Camera_ID = shard.{violations}.Camera_ID
+                                    AND New.Violation_Date = shard.{violations}.Violation_Date)""", (start, end))
+                dbCursor.execute(f"""
+                    INSERT INTO shard.{violations} (Camera_ID, Violation_Date, Num_Violations)
+                    SELECT Camera_ID, Violation_Date, Num_Violations FROM main.{violations}
+                    WHERE Violation_Date >= ? AND Violation_Date < ?""", (start, end))
+                moved[year] += dbCursor.rowcount
+                dbCursor.execute(f"DELETE FROM main.{violations} WHERE Violation_Date >= ? AND Violation_Date < ?",
+                                 (start, end))
+            dbCursor.execute("COMMIT")
+        except sqlite3.Error:
+            dbCursor.execute("ROLLBACK")
+            raise
+        finally:
+            dbCursor.execute("DETACH DATABASE shard")
+
+    # Camera changes must mark the sharded days dirty too, which the main file's own
+    # triggers can't see; then rebuild the days whose rows moved (their totals only change
+    # if a shard row was replaced)
+    end = queries.year_bounds(max(years(path) or ["0"]))[1]
+    script = "BEGIN IMMEDIATE;"
+    for kind, (violations, cameras) in queries.TABLES.items():
+        script += "".join(f"DROP TRIGGER IF EXISTS rollup_{cameras}_{event}_sharded;" for event in ("insert", "delete", "update"))
+        script += SHARDED_CAMERA_TRIGGERS.format(kind=kind, cameras=cameras, end=end)
+    dbCursor.executescript(script + "COMMIT;")
+    rollups.refresh(dbConn)
+
+    if vacuum:
+        dbCursor.execute("VACUUM")
+    dbConn.close()
+    return moved
+
+# main
+if __name__ == "__main__":
+    import argparse  # Only the command line needs these, not the menu that imports this module
+    import time
+
+    parser = argparse.ArgumentParser(description="Move finished years of violations into per-year shard files.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--keep", type=int, default=1, help="latest years to keep in the main file (default: %(default)s)")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the main file afterwards to give back the space")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    moved = split(args.db, args.keep, args.vacuum)
+    for year, rows in moved.items():
+        print(f"{year}: {rows:,} rows -> {shard_path(args.db, year)}")
+    print(f"Moved {sum(moved.values()):,} rows into {len(moved)} shards in {time.perf_counter() - start:.1f} s")
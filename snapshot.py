@@ -0,0 +1,185 @@
+
+# Description:
+#   Optional in-memory copy of the database for sessions that only read, such as kiosks
+#   and dashboards, so the commands run without reading pages from disk. A Snapshot
+#   copies the database file into a :memory: connection with Connection.backup on a
+#   background thread, a batch of pages at a time, and builds any missing command
+#   indexes in the copy; until the copy is ready, connection() hands out the disk
+#   connection. Before every command connection() also checks the file (stats.file_key),
+#   and once the file has changed the snapshot is out of date: commands go back to disk
+#   while a new copy is made in the background.
+#
+#   The menu uses a snapshot when TRAFFIC_SNAPSHOT=1 is set, and reports its size and
+#   the commands it served on exit. Databases split into year shards (see shards.py)
+#   stay on disk, since the copy wouldn't include the shards.
+#
+#   python snapshot.py [--db FILE] [--runs 5]
+#   copies a database and prints its size in memory, then times print_stats and commands
+#   1-9 (as bench.py does) on disk and on the snapshot.
+
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import cancel
+import indexes
+import instrument
+import shards
+import stats
+
+BACKUP_PAGES = 4096  # Pages copied per backup step
+
+##################################################################
+# Snapshot
+# In-memory copy of the database behind a disk connection opened by api.open_database.
+class Snapshot:
+    def __init__(self, dbConn):
+        self.disk = dbConn
+        self.path = stats.database_path(dbConn)
+        self.memory = None  # Connection to the latest copy
+        self.key = None  # stats.file_key of the file when it was copied
+        self.copying = None  # Thread making a copy, if any
+        self.retired = []  # Earlier copies, closed by the next connection() call
+        self.copies = 0
+        self.copy_seconds = 0.0
+        self.served = {"disk": 0, "memory": 0}
+        self.unavailable = None  # Why there can't be a snapshot, if there can't
+        self.lock = threading.Lock()
+        if not self.path:
+            self.unavailable = "the database is already in memory"
+        elif shards.years(self.path):
+            self.unavailable = "the database is split into year shards"
+
+    ##################################################################
+    # start
+    # Starts copying the database in the background.
+    def start(self):
+        with self.lock:
+            if self.unavailable or self.copying is not None:
+                return
+            self.copying = threading.Thread(target=self.copy, name="snapshot", daemon=True)
+            self.copying.start()
+
+    ##################################################################
+    # copy
+    # Copies the database into a new :memory: connection and makes it the snapshot.
+    # Returns False, leaving the commands on disk, if the copy fails.
+    def copy(self):
+        key = stats.file_key(self.path)  # Taken first, so a change during the copy means another copy
+        start = time.perf_counter()
+        memory = sqlite3.connect(":memory:", check_same_thread=False, factory=instrument.connection_factory())
+        try:
+            source = sqlite3.connect(f"file:{urllib.parse.quote(self.path)}?mode=ro", uri=True)
+            try:
+                source.backup(memory, pages=BACKUP_PAGES, sleep=0)
+            finally:
+                source.close()
+            indexes.ensure_indexes(memory)
+        except sqlite3.Error:
+            memory.close()
+            with self.lock:
+                self.copying = None
+            return False
+
+        cancel.watch(memory, handler=not instrument.ENABLED)
+        with self.lock:
+            if self.memory is not None:
+                self.retired.append(self.memory)
+            self.memory, self.key = memory, key
+            self.copies += 1
+            self.copy_seconds = time.perf_counter() - start
+            self.copying = None
+        return True
+
+    ##################################################################
+    # connection
+    # Returns the connection the next command should use: the snapshot if it is ready and
+    # the file hasn't changed since it was copied, else the disk connection (starting a
+    # new copy if the file has changed).
+    def connection(self):
+        with self.lock:
+            retired, self.retired = self.retired, []
+            memory, key, copying = self.memory, self.key, self.copying
+        for old in retired:
+            old.close()
+
+        if memory is not None and key == stats.file_key(self.path):
+            self.served["memory"] += 1
+            return memory
+        if memory is not None and copying is None:
+            self.start()  # Out of date
+        self.served["disk"] += 1
+        return self.disk
+
+    ##################################################################
+    # footprint
+    # Bytes of database pages the snapshot holds in memory (0 before the first copy).
+    def footprint(self):
+        with self.lock:
+            memory = self.memory
+        if memory is None:
+            return 0
+        page_count = memory.execute("PRAGMA page_count").fetchone()[0]
+        return page_count * memory.execute("PRAGMA page_size").fetchone()[0]
+
+    ##################################################################
+    # summary
+    # One line on the snapshot for the end of a session.
+    def summary(self):
+        if self.unavailable:
+            return f"Snapshot: not used, {self.unavailable}"
+        return (f"Snapshot: {self.footprint() / 1e6:,.1f} MB in memory, copied {self.copies} time(s) "
+                f"(last in {self.copy_seconds:.2f} s); {self.served['memory']} command(s) served from memory, "
+                f"{self.served['disk']} from disk")
+
+    ##################################################################
+    # close
+    # Closes the copies (not the disk connection).
+    def close(self):
+        if self.copying is not None:
+            self.copying.join()
+        for memory in self.retired + [self.memory]:
+            if memory is not None:
+                memory.close()
+        self.memory = None
+        self.retired = []
+
+# main
+if __name__ == "__main__":
+    import argparse  # Only the command line needs these
+
+    import api
+    import bench
+    import cache
+    import compact
+    import main
+
+    parser = argparse.ArgumentParser(description="Time the menu commands on disk and on an in-memory snapshot.")
+    parser.add_argument("--db", default=api.DATABASE)
+    parser.add_argument("--runs", type=int, default=5, help="runs per command (default: %(default)s)")
+    args = parser.parse_args()
+
+    dbConn = api.open_database(args.db)
+    snapshot = Snapshot(dbConn)
+    if snapshot.unavailable:
+        parser.exit(1, f"No snapshot: {snapshot.unavailable}\n")
+    if not snapshot.copy():
+        parser.exit(1, f"Couldn't copy {args.db}\n")
+    print(f"Snapshot of {args.db}: {compact.file_size(args.db) / 1e6:,.1f} MB on disk, "
+          f"{snapshot.footprint() / 1e6:,.1f} MB in memory, copied in {snapshot.copy_seconds:.2f} s")
+
+    cache.RESULTS.maxsize = 0  # Every run goes to SQLite
+    inputs = bench.sample_inputs(dbConn)
+    medians = {}
+    for source in ("disk", "memory"):
+        main.dbConn = snapshot.connection() if source == "memory" else dbConn
+        medians[source] = {name: bench.measure(function, answers, args.runs)["wall_ms"]["median"]
+                           for name, function, answers in bench.cases(inputs)}
+
+    print(f"{'command':<14}{'disk ms':>10}{'memory ms':>11}{'gain':>8}")
+    for name, disk_ms in medians["disk"].items():
+        memory_ms = medians["memory"][name]
+        print(f"{name:<14}{disk_ms:>10.2f}{memory_ms:>11.2f}{disk_ms / max(memory_ms, 1e-9):>7.2f}x")
+    snapshot.close()
+    dbConn.close()
@@ -0,0 +1,162 @@
+
+# Description:
+#   R*Tree indexes over camera locations, for finding the cameras inside a bounding box,
+#   within some distance of a point, or nearest to a point. There is one R*Tree per
+#   camera table (Locations_RedCameras, Locations_SpeedCameras) sharing rowids with it,
+#   kept in sync by triggers, and each R*Tree entry carries the camera's ID, address and
+#   exact coordinates so lookups never read the camera tables. Violation totals for the
+#   cameras found come from the yearly rollup (see rollups.py).
+
+import math
+import sqlite3
+
+import queries
+
+METERS_PER_DEGREE = 111320  # Meters per degree of latitude (and of longitude at the equator)
+EARTH_RADIUS = 6371000
+
+LOCATION_TABLE = """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {locations} USING rtree(
+        id, min_lat, max_lat, min_lon, max_lon, +Camera_ID, +Address, +Latitude, +Longitude);
+    CREATE TRIGGER IF NOT EXISTS {locations}_insert AFTER INSERT ON {cameras}
+    BEGIN
+        INSERT INTO {locations}
+            SELECT NEW.rowid, NEW.Latitude, NEW.Latitude, NEW.Longitude, NEW.Longitude,
+                   NEW.Camera_ID, NEW.Address, NEW.Latitude, NEW.Longitude
+            WHERE NEW.Latitude IS NOT NULL AND NEW.Longitude IS NOT NULL;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {locations}_delete AFTER DELETE ON {cameras}
+    BEGIN
+        DELETE FROM {locations} WHERE id = OLD.rowid;
+    END;
+    CREATE TRIGGER IF NOT EXISTS {locations}_update AFTER UPDATE OF Camera_ID, Address, Latitude, Longitude ON {cameras}
+    BEGIN
+        DELETE FROM {locations} WHERE id = OLD.rowid;
+        INSERT INTO {locations}
+            SELECT NEW.rowid, NEW.Latitude, NEW.Latitude, NEW.Longitude, NEW.Longitude,
+                   NEW.Camera_ID, NEW.Address, NEW.Latitude, NEW.Longitude
+            WHERE NEW.Latitude IS NOT NULL AND NEW.Longitude IS NOT NULL;
+    END;
+    DELETE FROM {locations};
+    INSERT INTO {locations}
+        SELECT rowid, Latitude, Latitude, Longitude, Longitude, Camera_ID, Address, Latitude, Longitude
+        FROM {cameras}
+        WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL;
+"""
+
+##################################################################
+# location_table
+# Returns the R*Tree over a camera type's locations ("red" or "speed").
+def location_table(kind):
+    return "Locations_" + queries.TABLES[kind][1]
+
+##################################################################
+# is_built
+# Given connection to database, returns True if the location R*Trees have been created.
+def is_built(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+                     tuple(location_table(kind) for kind in queries.TABLES))
+    return dbCursor.fetchone()[0] == len(queries.TABLES)
+
+##################################################################
+# ensure
+# Given connection to database, creates and fills the location R*Trees and their
+# triggers if they don't exist yet. Skipped when the database is read-only or another
+# connection is writing. Returns True if they were built.
+def ensure(dbConn):
+    if is_built(dbConn):
+        return False
+
+    script = "".join(LOCATION_TABLE.format(locations=location_table(kind), cameras=cameras)
+                     for kind, (violations, cameras) in queries.TABLES.items())
+    try:
+        dbConn.cursor().executescript("BEGIN IMMEDIATE;" + script + "COMMIT;")
+    except sqlite3.OperationalError as error:
+        if "locked" not in str(error) and "readonly" not in str(error):
+            raise
+        dbConn.rollback()
+        return False
+    return True
+
+##################################################################
+# distance
+# Great-circle distance in meters between two (latitude, longitude) points.
+def distance(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+##################################################################
+# radius_box
+# Returns the bounding box (min_lat, min_lon, max_lat, max_lon) that contains every point
+# within meters of (lat, lon).
+def radius_box(lat, lon, meters):
+    dlat = meters / METERS_PER_DEGREE
+    dlon = meters / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+    return (lat - dlat, lon - dlon, lat + dlat, lon + dlon)
+
+##################################################################
+# in_box
+# Given connection to database and a bounding box, returns the cameras of both types inside
+# it as rows of {"type", "camera_id", "address", "latitude", "longitude"}.
+def in_box(dbConn, min_lat, min_lon, max_lat, max_lon):
+    dbCursor = dbConn.cursor()
+    rows = []
+    for kind in queries.TABLES:
+        dbCursor.execute(f"""
+            SELECT Camera_ID, Address, Latitude, Longitude
+            FROM {location_table(kind)}
+            WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+            ORDER BY Camera_ID ASC""", (min_lat, max_lat, min_lon, max_lon))
+        # The R*Tree stores 32-bit boxes rounded outward, so check the exact coordinates too
+        rows += [{"type": kind, "camera_id": row[0], "address": row[1], "latitude": row[2], "longitude": row[3]}
+                 for row in dbCursor.fetchall()
+                 if min_lat <= row[2] <= max_lat and min_lon <= row[3] <= max_lon]
+    return rows
+
+##################################################################
+# within
+# Given connection to database, a point and a distance in meters, returns the cameras
+# within that distance, nearest first, each row with a "distance_m" added.
+def within(dbConn, lat, lon, meters):
+    rows = []
+    for row in in_box(dbConn, *radius_box(lat, lon, meters)):
+        row["distance_m"] = distance(lat, lon, row["latitude"], row["longitude"])
+        if row["distance_m"] <= meters:
+            rows.append(row)
+    rows.sort(key=lambda row: row["distance_m"])
+    return rows
+
+##################################################################
+# nearest
+# Given connection to database and a point, returns the count cameras nearest to it,
+# nearest first. Searches a growing radius until enough cameras are found.
+def nearest(dbConn, lat, lon, count, start_meters=250, max_meters=100000):
+    meters = start_meters
+    while True:
+        rows = within(dbConn, lat, lon, meters)
+        if len(rows) >= count or meters >= max_meters:
+            return rows[:count]
+        meters *= 2
+
+##################################################################
+# add_violation_totals
+# Adds each camera's all-time violation total ("violations") to rows of cameras, read
+# from the yearly rollup.
+def add_violation_totals(dbConn, rows):
+    dbCursor = dbConn.cursor()
+    for kind in queries.TABLES:
+        ids = [row["camera_id"] for row in rows if row["type"] == kind]
+        if not ids:
+            continue
+        dbCursor.execute(f"""
+            SELECT Camera_ID, SUM(Num_Violations)
+            FROM Rollup_Camera_Year
+            WHERE Kind = ? AND Camera_ID IN ({', '.join('?' for camera_id in ids)})
+            GROUP BY Camera_ID""", [kind] + ids)
+        totals = dict(dbCursor.fetchall())
+        for row in rows:
+            if row["type"] == kind:
+                row["violations"] = totals.get(row["camera_id"], 0)
+    return rows
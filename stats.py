@@ -0,0 +1,144 @@
+
+# Description:
+#   General statistics shown by print_stats. They are computed with one pass over each
+#   violation table and saved in a Metadata table, keyed on the modification time and
+#   size of the database file (and its -wal file), so startup only recomputes them when
+#   the data has changed. The Metadata table lives in a small sidecar database next to
+#   the main one (<database>-meta) so that saving the cache doesn't itself change the
+#   key. PRAGMA data_version is used on top of that to skip the file check when the
+#   same connection asks again and nothing has been written. Violations moved into year
+#   shards by shards.py are counted from the shards.
+
+import json
+import os
+import sqlite3
+
+# (path, connection, data_version, total_changes) -> stats, for repeat calls in one session
+_session = {}
+
+##################################################################
+# compute
+# Given connection to database, computes the general statistics with a single pass over
+# each violation table. Returns them as a dictionary.
+def compute(dbConn):
+    import compact  # shards.py imports this module
+    import shards
+
+    dbCursor = dbConn.cursor()
+
+    dbCursor.execute("SELECT (SELECT COUNT(*) FROM RedCameras), (SELECT COUNT(*) FROM SpeedCameras)")
+    red_cameras, speed_cameras = dbCursor.fetchone()
+
+    def totals(dbConn, year=None):
+        dbCursor = dbConn.cursor()
+        days = compact.compact_table(dbConn, "RedViolations") # Read by day number if migrated
+        dbCursor.execute(compact.TOTALS.format(days=days) if days else
+                         "SELECT COUNT(*), MIN(Violation_Date), MAX(Violation_Date), SUM(Num_Violations) FROM RedViolations")
+        red = dbCursor.fetchone()
+        dbCursor.execute("SELECT COUNT(*), SUM(Num_Violations) FROM SpeedViolations")
+        return red + dbCursor.fetchone()
+
+    # The main file, then every year shard, merged
+    parts = [totals(dbConn)] + shards.map_shards(shards.of_connection(dbConn), totals)
+    red_entries = sum(part[0] for part in parts)
+    start_date = min((part[1] for part in parts if part[1] is not None), default=None)
+    end_date = max((part[2] for part in parts if part[2] is not None), default=None)
+    red_violations = add(part[3] for part in parts)
+    speed_entries = sum(part[4] for part in parts)
+    speed_violations = add(part[5] for part in parts)
+
+    return {
+        "red_cameras": red_cameras,
+        "speed_cameras": speed_cameras,
+        "red_entries": red_entries,
+        "speed_entries": speed_entries,
+        "start_date": start_date,
+        "end_date": end_date,
+        "red_violations": red_violations,
+        "speed_violations": speed_violations,
+    }
+
+##################################################################
+# add
+# Sums SQL SUM() results, which are None for no rows: None only if every part is None.
+def add(values):
+    values = [value for value in values if value is not None]
+    return sum(values) if values else None
+
+##################################################################
+# database_path
+# Returns the file name of the connection's main database, or "" for an in-memory one.
+def database_path(dbConn):
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA database_list")
+    for row in dbCursor.fetchall():
+        if row[1] == "main":
+            return row[2] or ""
+    return ""
+
+##################################################################
+# file_key
+# Builds the cache key from the modification time and size of the database file and of
+# its write-ahead log, since in WAL mode new data can sit in the -wal file for a while,
+# and of any year shards (see shards.py).
+def file_key(path):
+    import shards
+
+    parts = []
+    for name in [path, path + "-wal"] + list(shards.years(path).values()):
+        if os.path.exists(name):
+            info = os.stat(name)
+            if name.endswith("-wal") and info.st_size == 0:
+                continue  # Reset by the last checkpoint; comes and goes with the connections
+            parts.append(f"{info.st_mtime_ns}:{info.st_size}")
+    return "|".join(parts)
+
+##################################################################
+# open_metadata
+# Opens the sidecar database holding the Metadata table, creating it if needed.
+def open_metadata(path):
+    metaConn = sqlite3.connect(path + "-meta")
+    metaConn.execute("CREATE TABLE IF NOT EXISTS Metadata (Key TEXT PRIMARY KEY, Cache_Key TEXT, Value TEXT)")
+    return metaConn
+
+##################################################################
+# load
+# Given connection to database, returns the general statistics, reading them from the
+# cache when the database hasn't changed and recomputing (and saving) them when it has.
+def load(dbConn):
+    path = database_path(dbConn)
+    dbCursor = dbConn.cursor()
+    dbCursor.execute("PRAGMA data_version")
+    # data_version only changes for other connections' commits, total_changes for our own. The
+    # key holds the connection itself, since a new one can reuse a closed one's id()
+    session_key = (path, dbConn, dbCursor.fetchone()[0], dbConn.total_changes)
+    if session_key in _session:
+        return _session[session_key]
+
+    if not path:
+        result = compute(dbConn)
+    else:
+        key = file_key(path)
+        try:
+            metaConn = open_metadata(path)
+        except sqlite3.Error:
+            metaConn = None  # Read-only folder; just compute the stats every time
+
+        row = None
+        if metaConn:
+            row = metaConn.execute("SELECT Cache_Key, Value FROM Metadata WHERE Key = 'stats'").fetchone()
+
+        if row and row[0] == key:
+            result = json.loads(row[1])
+        else:
+            result = compute(dbConn)
+            if metaConn:
+                metaConn.execute("INSERT OR REPLACE INTO Metadata VALUES ('stats', ?, ?)", (key, json.dumps(result)))
+                metaConn.commit()
+
+        if metaConn:
+            metaConn.close()
+
+    _session.clear()
+    _session[session_key] = result
+    return result
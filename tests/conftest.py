@@ -0,0 +1,58 @@
+# Description:
+#   Shared fixtures for the tests. The modules are imported from the repository root;
+#   small_database gives each test its own copy of a tiny database with the same tables
+#   as chicago-traffic-cameras.db, and database a small synthetic one from generate_db.py.
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_db
+
+SCHEMA = """
+    CREATE TABLE Intersections (Intersection_ID INTEGER PRIMARY KEY, Intersection TEXT);
+    CREATE TABLE RedCameras (Camera_ID INTEGER PRIMARY KEY, Intersection_ID INTEGER, Address TEXT, Latitude REAL, Longitude REAL);
+    CREATE TABLE SpeedCameras (Camera_ID INTEGER PRIMARY KEY, Intersection_ID INTEGER, Address TEXT, Latitude REAL, Longitude REAL);
+    CREATE TABLE RedViolations (Camera_ID INTEGER, Violation_Date TEXT, Num_Violations INTEGER);
+    CREATE TABLE SpeedViolations (Camera_ID INTEGER, Violation_Date TEXT, Num_Violations INTEGER);
+"""
+
+INTERSECTIONS = [(1, "STATE AND MADISON"), (2, "CLARK AND LAKE"), (3, "HALSTED AND 18TH")]
+RED_CAMERAS = [(1001, 1, "1 N STATE ST", 41.882, -87.628), (1002, 2, "200 W LAKE ST", 41.886, -87.631)]
+SPEED_CAMERAS = [(2001, 1, "10 S STATE ST", 41.881, -87.627), (2002, 3, "1800 S HALSTED ST", 41.857, -87.646)]
+
+# Two years of violations, across a month and a year boundary, with one camera and date
+# given twice (the rows are summed, as the original queries did)
+RED_VIOLATIONS = [(1001, "2019-12-31", 4), (1001, "2020-01-01", 7), (1001, "2020-01-01", 2), (1002, "2020-01-01", 3),
+                  (1002, "2020-02-15", 5), (1001, "2020-02-15", 1)]
+SPEED_VIOLATIONS = [(2001, "2019-12-31", 30), (2002, "2020-01-01", 12), (2001, "2020-02-15", 9), (2002, "2020-02-16", 20)]
+
+##################################################################
+# small_database
+# Path to a new copy of the tiny database.
+@pytest.fixture
+def small_database(tmp_path):
+    path = str(tmp_path / "small.db")
+    dbConn = sqlite3.connect(path)
+    dbConn.executescript(SCHEMA)
+    dbConn.executemany("INSERT INTO Intersections VALUES (?, ?)", INTERSECTIONS)
+    dbConn.executemany("INSERT INTO RedCameras VALUES (?, ?, ?, ?, ?)", RED_CAMERAS)
+    dbConn.executemany("INSERT INTO SpeedCameras VALUES (?, ?, ?, ?, ?)", SPEED_CAMERAS)
+    dbConn.executemany("INSERT INTO RedViolations VALUES (?, ?, ?)", RED_VIOLATIONS)
+    dbConn.executemany("INSERT INTO SpeedViolations VALUES (?, ?, ?)", SPEED_VIOLATIONS)
+    dbConn.commit()
+    dbConn.close()
+    return path
+
+##################################################################
+# database
+# Path to a fresh synthetic database with two years of days (2014 and 2015).
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "traffic.db")
+    generate_db.generate(path, day_scale=2)
+    return path
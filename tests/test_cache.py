@@ -0,0 +1,80 @@
+# Description:
+#   Tests for the query result cache in cache.py: hits, results that are None, dropping
+#   a database's results when it changes, and least-recently-used eviction.
+
+import sqlite3
+
+import pytest
+
+import cache
+
+calls = []
+
+@cache.cached
+def red_total(dbConn, camera_id):
+    calls.append(camera_id)
+    return dbConn.execute("SELECT SUM(Num_Violations) FROM RedViolations WHERE Camera_ID = ?", (camera_id,)).fetchone()[0]
+
+@cache.cached
+def red_rows(dbConn, camera_id):
+    calls.append(camera_id)
+    return [{"date": date, "violations": count} for date, count in dbConn.execute(
+        "SELECT Violation_Date, Num_Violations FROM RedViolations WHERE Camera_ID = ?", (camera_id,))]
+
+@pytest.fixture
+def dbConn(small_database):
+    cache.RESULTS.clear()
+    cache.RESULTS.maxsize = 256
+    calls.clear()
+    dbConn = sqlite3.connect(small_database)
+    yield dbConn
+    dbConn.close()
+
+def test_hit_skips_the_query(dbConn):
+    assert red_total(dbConn, 1001) == 14
+    assert red_total(dbConn, "1001") == 14  # Arguments compare as text
+    assert calls == [1001]
+
+def test_none_is_cached(dbConn):
+    assert red_total(dbConn, 9999) is None
+    assert red_total(dbConn, 9999) is None
+    assert calls == [9999]
+
+def test_callers_get_their_own_rows(dbConn):
+    red_rows(dbConn, 1002)[0]["violations"] = -1
+    assert red_rows(dbConn, 1002)[0]["violations"] == 3
+
+def test_commit_on_same_connection_invalidates(dbConn):
+    red_total(dbConn, 1001)
+    dbConn.execute("INSERT INTO RedViolations VALUES (1001, '2020-03-01', 6)")
+    dbConn.commit()
+    assert red_total(dbConn, 1001) == 20  # total_changes moved on
+    assert calls == [1001, 1001]
+
+def test_commit_on_other_connection_invalidates(dbConn, small_database):
+    red_total(dbConn, 1001)
+    invalidations = cache.RESULTS.invalidations
+    other = sqlite3.connect(small_database)
+    other.execute("DELETE FROM RedViolations WHERE Violation_Date = '2019-12-31'")
+    other.commit()
+    other.close()
+    assert red_total(dbConn, 1001) == 10  # data_version moved on
+    assert cache.RESULTS.invalidations == invalidations + 1
+
+def test_least_recently_used_is_evicted(dbConn):
+    cache.RESULTS.maxsize = 2
+    evictions = cache.RESULTS.evictions
+    red_total(dbConn, 1001)
+    red_total(dbConn, 1002)
+    red_total(dbConn, 1001)  # 1002 is now the least recently used
+    red_total(dbConn, 2001)
+    assert cache.RESULTS.evictions == evictions + 1
+    red_total(dbConn, 1001)
+    red_total(dbConn, 1002)
+    assert calls == [1001, 1002, 2001, 1002]
+
+def test_size_zero_turns_caching_off(dbConn):
+    cache.RESULTS.maxsize = 0
+    red_total(dbConn, 1001)
+    red_total(dbConn, 1001)
+    assert calls == [1001, 1001]
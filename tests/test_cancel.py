@@ -0,0 +1,111 @@
+# Description:
+#   Tests that cancel.guard stops a command's statements once it is over its time budget
+#   or on Ctrl-C, raising Cancelled and rolling back what the command left open, and that
+#   it only ever stops, or rolls back, its own connections and those of the workers it
+#   handed work to.
+
+import os
+import signal
+import sqlite3
+import threading
+
+import pytest
+
+import cancel
+import parallel
+
+# Counts for as long as it is let run; with LIMIT, a second or so of work
+COUNT = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c {limit}) SELECT COUNT(*) FROM c"
+FOREVER = COUNT.format(limit="")
+LONG = COUNT.format(limit="LIMIT 2000000")
+
+##################################################################
+# connect
+# A new connection to path, under guard() the way api.open_database's is.
+def connect(path):
+    dbConn = sqlite3.connect(path, check_same_thread=False)
+    cancel.watch(dbConn)
+    return dbConn
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "cancel.db")
+    dbConn = sqlite3.connect(path)
+    dbConn.execute("CREATE TABLE Numbers (N INTEGER)")
+    dbConn.commit()
+    dbConn.close()
+    return path
+
+def test_budget_stops_query(path):
+    dbConn = connect(path)
+    with pytest.raises(cancel.Cancelled, match="time budget"):
+        with cancel.guard("test", budget=0.05):
+            dbConn.execute(FOREVER).fetchone()
+    assert dbConn.execute("SELECT 1").fetchone() == (1,)  # Still usable
+    dbConn.close()
+
+def test_budget_rolls_back_own_transaction_only(path):
+    dbConn, otherConn = connect(path), connect(path + "-other")
+    otherConn.execute("CREATE TABLE Other (N INTEGER)")
+    otherConn.execute("INSERT INTO Other VALUES (1)")  # Left open, outside the command
+    with pytest.raises(cancel.Cancelled):
+        with cancel.guard("test", budget=0.05):
+            dbConn.execute("INSERT INTO Numbers VALUES (1)")
+            dbConn.execute(FOREVER).fetchone()
+    assert not dbConn.in_transaction
+    assert dbConn.execute("SELECT COUNT(*) FROM Numbers").fetchone() == (0,)
+    assert otherConn.in_transaction
+    otherConn.close()
+    dbConn.close()
+
+def test_other_thread_unaffected(path):
+    found = []
+
+    def other():
+        otherConn = connect(path)
+        with cancel.guard("other", budget=0):
+            found.append(otherConn.execute(LONG).fetchone())
+        otherConn.close()
+
+    dbConn = connect(path)
+    thread = threading.Thread(target=other)
+    thread.start()
+    with pytest.raises(cancel.Cancelled):
+        with cancel.guard("test", budget=0.01):
+            dbConn.execute(FOREVER).fetchone()
+    thread.join()
+    dbConn.close()
+    assert found == [(2000000,)]
+
+def test_operation_notes_only_its_connections(path):
+    dbConn, otherConn = connect(path), connect(path)
+    with cancel.guard("test", budget=0) as operation:
+        dbConn.execute(LONG).fetchone()  # Runs the progress handler, noting the connection
+        otherConn.execute("SELECT 1").fetchone()  # Too short to run it
+    assert list(operation.connections.values()) == [dbConn]
+    dbConn.close()
+    otherConn.close()
+
+def test_ctrl_c_raises_cancelled(path):
+    dbConn = connect(path)
+    previous = signal.getsignal(signal.SIGINT)
+    timer = threading.Timer(0.1, os.kill, (os.getpid(), signal.SIGINT))
+    with pytest.raises(cancel.Cancelled, match="cancelled"):
+        with cancel.guard("test", budget=0):
+            timer.start()
+            dbConn.execute(FOREVER).fetchone()
+    timer.join()
+    assert signal.getsignal(signal.SIGINT) is previous
+    assert dbConn.execute("SELECT 1").fetchone() == (1,)
+    dbConn.close()
+
+def test_budget_stops_workers(path, monkeypatch):
+    monkeypatch.setattr(parallel, "WORKERS", 2)
+    dbConn = connect(path)
+    try:
+        with pytest.raises(cancel.Cancelled, match="time budget"):
+            with cancel.guard("test", budget=0.05):
+                parallel.map_kinds(dbConn, lambda dbConn, kind: dbConn.execute(FOREVER).fetchone(), ["red", "speed"])
+    finally:
+        parallel.shutdown()
+        dbConn.close()
@@ -0,0 +1,60 @@
+# Description:
+#   Tests that ingest.py upserts on each table's key: loading the same file again leaves
+#   the database unchanged, changed values replace the old ones, and a key repeated in a
+#   file always ends with its last row, whether or not the repeats share a batch.
+
+import csv
+
+import pytest
+
+import ingest
+
+VIOLATIONS = [("CAMERA ID", "VIOLATION DATE", "VIOLATIONS"),
+              ("1001", "03/01/2020", "6"), ("1002", "2020-03-01", "4"), ("1001", "2020-01-01", "5")]
+
+##################################################################
+# write_csv
+# Writes rows (the first one being the header) to a CSV file and returns its path.
+def write_csv(tmp_path, name, rows):
+    path = str(tmp_path / name)
+    with open(path, "w", newline="") as file:
+        csv.writer(file).writerows(rows)
+    return path
+
+##################################################################
+# state
+# Every row of the red light tables and of the rollup the menu reads them through.
+def state(dbConn):
+    return {table: sorted(dbConn.execute(f"SELECT * FROM {table}").fetchall())
+            for table in ("RedCameras", "RedViolations", "Rollup_Camera_Day")}
+
+@pytest.fixture
+def dbConn(small_database):
+    dbConn = ingest.open_for_ingest(small_database)
+    yield dbConn
+    dbConn.close()
+
+def test_reingest_changes_nothing(dbConn, tmp_path):
+    path = write_csv(tmp_path, "red.csv", VIOLATIONS)
+    ingest.ingest(dbConn, {"red-violations": path})
+    once = state(dbConn)
+    ingest.ingest(dbConn, {"red-violations": path})
+    assert state(dbConn) == once
+    assert dbConn.execute("SELECT Num_Violations FROM RedViolations WHERE Camera_ID = 1001 AND Violation_Date = '2020-03-01'").fetchall() == [(6,)]
+
+def test_changed_value_replaces_old_one(dbConn, tmp_path):
+    ingest.ingest(dbConn, {"red-violations": write_csv(tmp_path, "red.csv", VIOLATIONS)})
+    ingest.ingest(dbConn, {"red-violations": write_csv(tmp_path, "red2.csv", [VIOLATIONS[0], ("1002", "2020-03-01", "9")])})
+    assert dbConn.execute("SELECT Num_Violations FROM RedViolations WHERE Camera_ID = 1002 AND Violation_Date = '2020-03-01'").fetchall() == [(9,)]
+    assert dbConn.execute("SELECT Num_Violations FROM Rollup_Camera_Day WHERE Kind = 'red' AND Camera_ID = 1002 AND Day = '2020-03-01'").fetchall() == [(9,)]
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_repeated_key_keeps_last_row(small_database, tmp_path, batch_size):
+    dbConn = ingest.open_for_ingest(small_database)
+    rows = [("Camera_ID", "Intersection_ID", "Address", "Latitude", "Longitude"),
+            ("1003", "3", "FIRST", "", ""), ("1001", "1", "OLD", "", ""),     # New key, existing key
+            ("1003", "3", "SECOND", "", ""), ("1001", "1", "NEW", "", "")]    # ... each given again
+    ingest.ingest(dbConn, {"red-cameras": write_csv(tmp_path, "cameras.csv", rows)}, batch_size=batch_size)
+    addresses = dict(dbConn.execute("SELECT Camera_ID, Address FROM RedCameras WHERE Camera_ID IN (1001, 1003)").fetchall())
+    dbConn.close()
+    assert addresses == {1001: "NEW", 1003: "SECOND"}
@@ -0,0 +1,50 @@
+# Description:
+#   Tests that registry.get keeps one registry per database while the data is unchanged
+#   and rebuilds it after a commit, whether by the same connection (total_changes) or by
+#   another one (data_version), and that camera IDs are matched the way SQLite would.
+
+import sqlite3
+
+import pytest
+
+import registry
+
+@pytest.fixture
+def dbConn(small_database):
+    registry.clear()
+    dbConn = sqlite3.connect(small_database)
+    yield dbConn
+    dbConn.close()
+    registry.clear()
+
+def test_unchanged_database_reuses_registry(dbConn):
+    first = registry.get(dbConn)
+    assert registry.get(dbConn) is first
+    assert first.find(1001).kind == "red" and first.find(2002).kind == "speed"
+    assert [camera.camera_id for camera in first.at_intersection[1]] == [1001, 2001]
+
+def test_commit_on_same_connection_rebuilds(dbConn):
+    registry.get(dbConn)
+    dbConn.execute("INSERT INTO RedCameras VALUES (1003, 3, '1800 S HALSTED ST', 41.857, -87.646)")
+    dbConn.commit()
+    cameras = registry.get(dbConn)
+    assert cameras.find(1003).intersection_id == 3
+    assert [camera.camera_id for camera in cameras.at_intersection[3]] == [1003, 2002]
+
+def test_commit_on_other_connection_rebuilds(dbConn, small_database):
+    assert registry.get(dbConn).find(1002).intersection_id == 2
+    otherConn = sqlite3.connect(small_database)
+    otherConn.execute("UPDATE RedCameras SET Intersection_ID = 3 WHERE Camera_ID = 1002")
+    otherConn.execute("DELETE FROM SpeedCameras WHERE Camera_ID = 2001")
+    otherConn.commit()
+    otherConn.close()
+
+    cameras = registry.get(dbConn)
+    assert cameras.find(1002).intersection_id == 3
+    assert cameras.find(2001) is None
+    assert 2 not in cameras.at_intersection
+
+@pytest.mark.parametrize("camera_id, key", [(1503, 1503), ("1503", 1503), (" 1503 ", 1503), ("1503.0", 1503),
+                                            ("1503.5", None), ("abc", None), ("", None), (True, None)])
+def test_camera_key_matches_sqlite(camera_id, key):
+    assert registry.camera_key(camera_id) == key
@@ -0,0 +1,77 @@
+# Description:
+#   Tests that rollups.refresh keeps the rollup tables equal to totals computed from the
+#   raw violation rows as they are added, changed and removed, and that it only rebuilds
+#   the dates that changed.
+
+import collections
+import sqlite3
+
+import pytest
+
+import queries
+import rollups
+
+##################################################################
+# expected
+# The rollup rows computed in Python from the raw violation and camera tables, as
+# {table: {key: violations}}.
+def expected(dbConn):
+    tables = collections.defaultdict(lambda: collections.defaultdict(int))
+    for kind, (violations, cameras) in queries.TABLES.items():
+        intersections = dict(dbConn.execute(f"SELECT Camera_ID, Intersection_ID FROM {cameras}").fetchall())
+        for camera_id, day, count in dbConn.execute(f"SELECT Camera_ID, Violation_Date, Num_Violations FROM {violations}"):
+            year, month = day[:4], day[5:7]
+            tables["Rollup_Day"][(kind, day)] += count
+            tables["Rollup_Camera_Day"][(kind, day, camera_id)] += count
+            tables["Rollup_Camera_Month"][(kind, camera_id, year, month)] += count
+            tables["Rollup_Camera_Year"][(kind, camera_id, year)] += count
+            if camera_id in intersections:
+                intersection_id = intersections[camera_id]
+                tables["Rollup_Intersection_Day"][(kind, day, intersection_id)] += count
+                tables["Rollup_Intersection_Month"][(kind, intersection_id, year, month)] += count
+                tables["Rollup_Intersection_Year"][(kind, year, intersection_id)] += count
+    return {table: dict(rows) for table, rows in tables.items()}
+
+##################################################################
+# actual
+# The rows of the same rollup tables, in the same form.
+def actual(dbConn):
+    found = {}
+    for table in ("Rollup_Day", "Rollup_Camera_Day", "Rollup_Camera_Month", "Rollup_Camera_Year",
+                  "Rollup_Intersection_Day", "Rollup_Intersection_Month", "Rollup_Intersection_Year"):
+        rows = dbConn.execute(f"SELECT * FROM {table}").fetchall()
+        found[table] = {row[:-1]: row[-1] for row in rows}
+    return found
+
+@pytest.fixture
+def dbConn(small_database):
+    dbConn = sqlite3.connect(small_database)
+    rollups.refresh(dbConn)
+    yield dbConn
+    dbConn.close()
+
+def test_first_refresh_builds_everything(dbConn):
+    assert actual(dbConn) == expected(dbConn)
+    assert actual(dbConn)["Rollup_Camera_Day"][("red", "2020-01-01", 1001)] == 9  # Both rows for the date
+    assert rollups.refresh(dbConn) == 0  # Nothing left to do
+
+def test_refresh_rebuilds_only_changed_dates(dbConn):
+    dbConn.execute("INSERT INTO RedViolations VALUES (1002, '2020-03-01', 6)")
+    dbConn.commit()
+    assert rollups.refresh(dbConn) == 1
+    assert actual(dbConn) == expected(dbConn)
+
+def test_refresh_after_update_and_delete(dbConn):
+    dbConn.execute("UPDATE RedViolations SET Num_Violations = 50 WHERE Camera_ID = 1001 AND Violation_Date = '2019-12-31'")
+    dbConn.execute("DELETE FROM SpeedViolations WHERE Violation_Date = '2020-02-16'")
+    dbConn.commit()
+    assert rollups.refresh(dbConn) == 2
+    assert actual(dbConn) == expected(dbConn)
+    assert ("speed", "2020-02-16", 2002) not in actual(dbConn)["Rollup_Camera_Day"]
+
+def test_refresh_after_camera_moves(dbConn):
+    dbConn.execute("UPDATE RedCameras SET Intersection_ID = 3 WHERE Camera_ID = 1001")
+    dbConn.commit()
+    rollups.refresh(dbConn)
+    assert actual(dbConn) == expected(dbConn)
+    assert ("red", "2020", 1) not in actual(dbConn)["Rollup_Intersection_Year"]
@@ -0,0 +1,72 @@
+# Description:
+#   Tests for the year shards of shards.py and for ingesting into a database that has
+#   been split.
+
+import sqlite3
+
+import api
+import cache
+import ingest
+import shards
+import stats
+
+##################################################################
+# answers
+# What the menu shows for a date (command 3), a camera's months of that year (command 7)
+# and print_stats, read on a new connection with an empty query cache.
+def answers(path, date, camera_id):
+    cache.RESULTS.clear()
+    dbConn = api.open_database(path)
+    try:
+        return {"date": api.violations_on_date(dbConn, date),
+                "months": api.violations_by_month(dbConn, camera_id, date[:4]),
+                "stats": stats.load(dbConn)}
+    finally:
+        dbConn.close()
+
+##################################################################
+# ingest_rows
+# Writes violation rows to a CSV file and loads them with ingest.py.
+def ingest_rows(path, csv_path, source, rows):
+    with open(csv_path, "w") as file:
+        file.write("Camera_ID,Violation_Date,Num_Violations\n")
+        file.writelines(f"{camera_id},{date},{count}\n" for camera_id, date, count in rows)
+    dbConn = ingest.open_for_ingest(path)
+    ingest.ingest(dbConn, {source: str(csv_path)})
+    dbConn.close()
+
+def test_split_keeps_answers(database):
+    before = answers(database, "2014-03-04", "1001")
+    dbConn = sqlite3.connect(database)
+    rows = sum(dbConn.execute(f"SELECT COUNT(*) FROM {table} WHERE Violation_Date < '2015'").fetchone()[0]
+               for table in ("RedViolations", "SpeedViolations"))
+    dbConn.close()
+
+    assert shards.split(database) == {"2014": rows}
+    assert list(shards.years(database)) == ["2014"]
+    assert answers(database, "2014-03-04", "1001") == before
+
+def test_reingest_after_split(database, tmp_path):
+    shards.split(database)
+    shardConn = sqlite3.connect(shards.shard_path(database, "2014"))
+    rows = shardConn.execute("SELECT Camera_ID, Violation_Date, Num_Violations FROM RedViolations "
+                             "WHERE Violation_Date = '2014-03-04' ORDER BY Camera_ID").fetchall()
+    shardConn.close()
+    camera_id, date, count = rows[0]
+    before = answers(database, date, str(camera_id))
+
+    # The same rows again change nothing
+    ingest_rows(database, tmp_path / "same.csv", "red-violations", rows)
+    assert answers(database, date, str(camera_id)) == before
+
+    # A changed count replaces the shard's row rather than being added beside it
+    ingest_rows(database, tmp_path / "changed.csv", "red-violations", [(camera_id, date, count + 5)])
+    after = answers(database, date, str(camera_id))
+    assert after["date"][0]["violations"] == before["date"][0]["violations"] + 5
+    assert after["months"][2]["violations"] == before["months"][2]["violations"] + 5
+    assert after["stats"]["red_entries"] == before["stats"]["red_entries"]
+    assert after["stats"]["red_violations"] == before["stats"]["red_violations"] + 5
+
+    dbConn = sqlite3.connect(database)
+    assert dbConn.execute("SELECT COUNT(*) FROM RedViolations WHERE Violation_Date < '2015'").fetchone()[0] == 0
+    dbConn.close()
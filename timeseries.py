@@ -0,0 +1,140 @@
+
+# Description:
+#   Daily red light and speed violation totals for a range of whole years as NumPy
+#   arrays, and the aggregations command 8 and the multi-year comparison are built on.
+#   load() fetches each camera type's days with one grouped query on the daily rollup
+#   (see rollups.py) and drops the counts into a zero-filled array in one step, so days
+#   without violations are 0. Everything else works on whole arrays: rolling averages,
+#   yearly totals and year-over-year changes, weekday and month profiles and the red to
+#   speed ratio. Arrays in a DailySeries are read-only, so a cached series can be shared.
+
+import datetime
+
+import numpy as np
+
+import queries
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+##################################################################
+# DailySeries
+# Violations per day from January 1 of first_year to December 31 of last_year: dates is
+# an array of numpy datetime64 days and counts maps each camera type to an int64 array
+# of the same length.
+class DailySeries:
+    def __init__(self, first_year, last_year, counts):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.dates = np.arange(f"{first_year:04d}-01-01", f"{last_year + 1:04d}-01-01", dtype="datetime64[D]")
+        self.counts = counts
+        for values in [self.dates] + list(counts.values()):
+            values.flags.writeable = False
+
+    def __len__(self):
+        return len(self.dates)
+
+    ##################################################################
+    # years / months / weekdays
+    # Calendar year, month (0-11) and weekday (0 = Monday) of every day.
+    def years(self):
+        return self.dates.astype("datetime64[Y]").astype(np.int64) + 1970
+
+    def months(self):
+        return self.dates.astype("datetime64[M]").astype(np.int64) % 12
+
+    def weekdays(self):
+        return (self.dates.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+
+    ##################################################################
+    # active
+    # Mask of the days from the first to the last day with any violations, so profiles
+    # aren't pulled down by days before the cameras were installed or after the data ends.
+    def active(self):
+        total = sum(self.counts.values())
+        days = np.flatnonzero(total)
+        mask = np.zeros(len(self), dtype=bool)
+        if len(days):
+            mask[days[0]:days[-1] + 1] = True
+        return mask
+
+##################################################################
+# load_counts
+# Given connection to database, a camera type and a range of years, returns an array of
+# that type's violations on each day of the range. The rollups should be up to date (see
+# rollups.refresh).
+def load_counts(dbConn, kind, first_year, last_year):
+    start = datetime.date(first_year, 1, 1)
+    end = datetime.date(last_year + 1, 1, 1)
+
+    dbCursor = dbConn.cursor()
+    dbCursor.execute(queries.DAYS_IN_RANGE, (start.isoformat(), kind, start.isoformat(), end.isoformat()))
+    days = np.array(dbCursor.fetchall(), dtype=np.int64).reshape(-1, 2)
+    counts = np.zeros((end - start).days, dtype=np.int64)
+    counts[days[:, 0]] = days[:, 1]
+    return counts
+
+##################################################################
+# load
+# Given connection to database and a range of years, returns their DailySeries.
+def load(dbConn, first_year, last_year, kinds=("red", "speed")):
+    return DailySeries(first_year, last_year, {kind: load_counts(dbConn, kind, first_year, last_year) for kind in kinds})
+
+##################################################################
+# rolling_mean
+# Mean of each window days ending on every day, from a running sum. The first window - 1
+# days don't have a full window and are NaN.
+def rolling_mean(values, window):
+    sums = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    result = np.full(len(values), np.nan)
+    if 0 < window <= len(values):
+        result[window - 1:] = (sums[window:] - sums[:-window]) / window
+    return result
+
+##################################################################
+# yearly_totals
+# Returns (years, {kind: total violations in each year}).
+def yearly_totals(series):
+    index = series.years() - series.first_year
+    size = series.last_year - series.first_year + 1
+    years = np.arange(series.first_year, series.last_year + 1)
+    return years, {kind: np.bincount(index, weights=values, minlength=size).astype(np.int64)
+                   for kind, values in series.counts.items()}
+
+##################################################################
+# year_over_year
+# Change in yearly totals from the year before, as (difference, percent change). The
+# first year, and years following one without violations, have a NaN percent change.
+def year_over_year(totals):
+    totals = np.asarray(totals, dtype=np.float64)
+    difference = np.full(len(totals), np.nan)
+    percent = np.full(len(totals), np.nan)
+    difference[1:] = totals[1:] - totals[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent[1:] = np.where(totals[:-1] > 0, difference[1:] / totals[:-1] * 100, np.nan)
+    return difference, percent
+
+##################################################################
+# profile
+# Average violations per day for each group (e.g. weekday or month) over the active days.
+def profile(values, groups, size, mask):
+    days = np.bincount(groups[mask], minlength=size)
+    sums = np.bincount(groups[mask], weights=values[mask], minlength=size)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(days > 0, sums / days, np.nan)
+
+def weekday_profile(series, kind):
+    return profile(series.counts[kind], series.weekdays(), 7, series.active())
+
+def month_profile(series, kind):
+    return profile(series.counts[kind], series.months(), 12, series.active())
+
+##################################################################
+# ratio
+# Red light violations per speed violation for each element of the two arrays, NaN
+# where there were no speed violations.
+def ratio(red, speed):
+    red = np.asarray(red, dtype=np.float64)
+    speed = np.asarray(speed, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(speed > 0, red / speed, np.nan)